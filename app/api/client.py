@@ -1,11 +1,48 @@
+import asyncio
+import copy
 import logging
+import mimetypes
+import time
 from datetime import datetime
 from io import BytesIO
-from typing import Optional
+from typing import AsyncGenerator, AsyncIterable, Optional, Union
 
 import aiohttp
 
+from app.api.resilience import CircuitBreaker, backoff_delay, parse_retry_after, path_template
+from app.api.tokens import token_store
 from app.config import settings
+from app.services.case_cache import case_cache
+from app.services.document_cache import document_cache
+from app.services.history_cache import history_cache
+from app.services.ocr_results import ocr_results
+from app.services.metrics import api_request_duration, api_requests
+from app.services.profiling import span
+from app.services.reference_cache import reference_cache
+from app.services.single_flight import SingleFlight
+
+# Статусы, при которых идемпотентный запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class CaseDocument:
+    """Файл документа из ответа бэкенда, читаемый потоком. Соединение освобождается после чтения или close()."""
+
+    def __init__(self, response: aiohttp.ClientResponse, filename: str):
+        self._response = response
+        self.filename = filename
+        self.size = response.content_length
+
+    async def chunks(self) -> AsyncGenerator[bytes, None]:
+        try:
+            async for chunk in self._response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            self._response.release()
+
+    def close(self):
+        self._response.release()
 
 
 class ApiClient:
@@ -14,20 +51,78 @@ class ApiClient:
     def __init__(self, base_url: str):
         self._base_url = base_url
         self._session: Optional[aiohttp.ClientSession] = None
-        # Словарь для хранения токенов: {user_id: token}
-        self._user_tokens: dict[int, str] = {}
+        # Одновременные повторные входы одного пользователя объединяются в один
+        self._reauth_flights = SingleFlight()
+        # Предохранители по шаблону пути: {"/cases/{id}": CircuitBreaker}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        # Одинаковые одновременные GET-запросы в рамках одной учетной записи
+        self._read_flights = SingleFlight()
 
     async def _get_session(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
+            # Долгоживущий пул: keep-alive, кеш DNS и лимиты на хост,
+            # чтобы запросы к бэкенду не платили за установку соединения
+            connector = aiohttp.TCPConnector(
+                limit=settings.api_pool_limit,
+                limit_per_host=settings.api_pool_limit_per_host,
+                keepalive_timeout=settings.api_keepalive_timeout,
+                ttl_dns_cache=settings.api_dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=settings.api_request_timeout,
+                connect=settings.api_connect_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
         return self._session
 
+    async def warmup(self, connections: Optional[int] = None) -> int:
+        """
+        Заранее открывает соединения с бэкендом, чтобы первые запросы
+        пользователей не ждали TCP/TLS-рукопожатия. Возвращает число успешных соединений.
+        """
+        if connections is None:
+            connections = settings.api_pool_warmup_connections
+        session = await self._get_session()
+
+        async def _probe() -> bool:
+            try:
+                async with session.get(f"{self._base_url}/health") as response:
+                    await response.read()
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"API pool warmup failed: {e}")
+                return False
+
+        results = await asyncio.gather(*(_probe() for _ in range(connections)))
+        opened = sum(results)
+        logging.info(f"API pool warmed up: {opened}/{connections} connections. Stats: {self.pool_stats()}")
+        return opened
+
+    def pool_stats(self) -> dict:
+        """Возвращает статистику пула соединений: занятые, свободные и ожидающие."""
+        stats = {
+            "limit": settings.api_pool_limit,
+            "limit_per_host": settings.api_pool_limit_per_host,
+            "in_use": 0,
+            "idle": 0,
+            "waiters": 0,
+        }
+        if self._session is None or self._session.closed:
+            return stats
+        connector = self._session.connector
+        # aiohttp не предоставляет публичного API для статистики пула
+        stats["in_use"] = len(getattr(connector, "_acquired", ()))
+        stats["idle"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        stats["waiters"] = sum(len(waiters) for waiters in getattr(connector, "_waiters", {}).values())
+        return stats
+
     async def close(self):
         if self._session and not self._session.closed:
             await self._session.close()
 
-    async def login(self, user_id: int, username: str, password: str) -> bool:
-        """Аутентифицирует пользователя и сохраняет токен."""
+    async def _authenticate(self, user_id: int, username: str, password: str) -> Optional[str]:
+        """Запрашивает у API новый токен доступа."""
         session = await self._get_session()
         try:
             async with session.post(
@@ -36,28 +131,127 @@ class ApiClient:
             ) as response:
                 if response.status == 200:
                     data = await response.json()
-                    token = data.get("access_token")
-                    if token:
-                        self._user_tokens[user_id] = token
-                        logging.info(f"Successfully authenticated user {user_id}")
-                        return True
+                    if token := data.get("access_token"):
+                        return token
                 logging.warning(f"Failed to authenticate user {user_id}. Status: {response.status}")
-                return False
+                return None
         except aiohttp.ClientError as e:
             logging.error(f"Login error for user {user_id}: {e}")
+            return None
+
+    async def login(self, user_id: int, username: str, password: str) -> bool:
+        """Аутентифицирует пользователя и сохраняет токен."""
+        token = await self._authenticate(user_id, username, password)
+        if token is None:
+            return False
+        token_store.set(user_id, token, credentials=(username, password))
+        # Вход мог быть под другой учетной записью: ее история дел другая
+        history_cache.invalidate(user_id)
+        logging.info(f"Successfully authenticated user {user_id}")
+        return True
+
+    async def _reauthenticate(self, user_id: int) -> bool:
+        """Повторно получает токен по сохраненным учетным данным."""
+        credentials = token_store.get_credentials(user_id)
+        if credentials is None:
             return False
 
+        async def _refresh() -> bool:
+            token = await self._authenticate(user_id, *credentials)
+            if token is None:
+                return False
+            token_store.set(user_id, token)
+            logging.info(f"Refreshed auth token for user {user_id}")
+            return True
+
+        return await self._reauth_flights.do(user_id, _refresh)
+
     async def _get_headers(self, user_id: int) -> dict:
         """Возвращает заголовки с токеном авторизации для пользователя."""
-        token = self._user_tokens.get(user_id)
+        # Обновляем токен заранее, не дожидаясь 401 от API
+        if token_store.needs_refresh(user_id):
+            await self._reauthenticate(user_id)
+        token = token_store.get(user_id)
         if token:
             return {"Authorization": f"Bearer {token}"}
         return {}
 
+    def _get_breaker(self, path: str) -> CircuitBreaker:
+        template = path_template(path)
+        breaker = self._breakers.get(template)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                failure_threshold=settings.api_breaker_failure_threshold,
+                recovery_timeout=settings.api_breaker_recovery_timeout,
+            )
+            self._breakers[template] = breaker
+        return breaker
+
     async def _make_request(
+        self, method: str, path: str, user_id: int, coalesce: bool = False, **kwargs
+    ) -> Optional[dict]:
+        """
+        Универсальный метод для выполнения запросов к API.
+        Идемпотентные GET-запросы повторяются с экспоненциальной задержкой при 429/5xx
+        и сетевых ошибках, а при известной недоступности эндпоинта запрос сразу
+        отклоняется предохранителем, не нагружая бэкенд.
+
+        С coalesce=True одновременные одинаковые GET-запросы (тот же путь и та же
+        учетная запись API) выполняются одним HTTP-запросом с общим результатом.
+        Если учетная запись неизвестна (нет действующего токена), запросы не объединяются.
+        """
+        async with span(f"api_client.{method} {path_template(path)}"):
+            # Токен мог быть выдан другим воркером кластера или истечь: учетная
+            # запись определяется по действующему токену
+            scope = await self.auth_scope(user_id)
+            if coalesce and method == "GET" and not kwargs and scope is not None:
+                key = (path, scope)
+                result = await self._read_flights.do(
+                    key, lambda: self._request_with_retries(method, path, user_id)
+                )
+                # Каждый вызывающий получает свою копию, чтобы не делить изменяемые объекты
+                return copy.deepcopy(result)
+            return await self._request_with_retries(method, path, user_id, **kwargs)
+
+    async def _request_with_retries(
         self, method: str, path: str, user_id: int, **kwargs
     ) -> Optional[dict]:
-        """Универсальный метод для выполнения запросов к API."""
+        template = path_template(path)
+        breaker = self._get_breaker(path)
+        if not breaker.allow():
+            logging.warning(f"Circuit open for {template}, request to {path} rejected")
+            api_requests.inc(method, template, "circuit_open")
+            return {"error": "api_error", "status_code": 503}
+
+        attempts = settings.api_retry_attempts if method == "GET" else 1
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            status, result, retry_after = await self._send(method, path, user_id, **kwargs)
+            api_request_duration.observe(time.perf_counter() - started, method, template)
+            api_requests.inc(method, template, str(status) if status is not None else "network_error")
+
+            # Ошибки клиента (4xx) означают, что бэкенд жив
+            if status is None or status >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+            retryable = status is None or status in RETRYABLE_STATUSES
+            if attempt == attempts - 1 or not retryable or not breaker.allow():
+                return result
+
+            delay = retry_after if retry_after is not None else backoff_delay(
+                attempt, settings.api_retry_base_delay, settings.api_retry_max_delay
+            )
+            delay = min(delay, settings.api_retry_max_delay)
+            logging.warning(f"Retrying {method} {path} in {delay:.2f}s (attempt {attempt + 1}/{attempts}, status {status})")
+            await asyncio.sleep(delay)
+        return result
+
+    async def _send(
+        self, method: str, path: str, user_id: int, **kwargs
+    ) -> tuple[Optional[int], Optional[dict], Optional[float]]:
+        """Выполняет один запрос. Возвращает (HTTP-статус или None, результат, Retry-After)."""
         session = await self._get_session()
         headers = await self._get_headers(user_id)
         if "Authorization" not in headers:
@@ -66,35 +260,72 @@ class ApiClient:
             # return {"error": "unauthorized"}
         
         # Обновляем заголовки из аргументов
-        headers.update(kwargs.pop("headers", {}))
+        extra_headers = kwargs.pop("headers", {})
+        headers.update(extra_headers)
 
         url = f"{self._base_url}{path}"
         
         try:
             async with session.request(method, url, headers=headers, **kwargs) as response:
-                if response.status in [200, 201, 202]:
-                    return await response.json()
-                elif response.status == 404:
-                    return {"error": "not_found"}
-                else:
-                    logging.error(f"API Error: {response.status} for path {path}. Body: {await response.text()}")
-                    return {"error": "api_error", "status_code": response.status}
-        except aiohttp.ClientError as e:
-            logging.error(f"Request exception for {path}: {e}")
-            return None
+                # Токен истек или отозван раньше срока: входим заново и повторяем запрос.
+                # multipart-тело (data) нельзя отправить повторно, такие запросы не повторяем.
+                if response.status == 401 and "data" not in kwargs:
+                    token_store.discard(user_id)
+                    if await self._reauthenticate(user_id):
+                        headers = {**await self._get_headers(user_id), **extra_headers}
+                        async with session.request(method, url, headers=headers, **kwargs) as retry:
+                            return await self._handle_response(retry, path)
+                return await self._handle_response(response, path)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Request exception for {path}: {e!r}")
+            return None, None, None
+
+    async def _handle_response(
+        self, response: aiohttp.ClientResponse, path: str
+    ) -> tuple[int, Optional[dict], Optional[float]]:
+        """Преобразует ответ API в результат для обработчиков."""
+        if response.status in [200, 201, 202]:
+            return response.status, await response.json(), None
+        elif response.status == 404:
+            return response.status, {"error": "not_found"}, None
+        else:
+            logging.error(f"API Error: {response.status} for path {path}. Body: {await response.text()}")
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            return response.status, {"error": "api_error", "status_code": response.status}, retry_after
+
+    async def _get_reference(self, path: str, user_id: int) -> Optional[list]:
+        """Получает справочник через кеш: справочники почти не меняются."""
+        return await reference_cache.get(
+            path, lambda: self._make_request("GET", path, user_id=user_id, coalesce=True)
+        )
 
     async def get_pension_types(self, user_id: int) -> Optional[list]:
         """Получает список доступных типов пенсий."""
-        return await self._make_request("GET", "/pension_types", user_id=user_id)
+        return await self._get_reference("/pension_types", user_id=user_id)
 
     async def get_required_documents(self, user_id: int, pension_type_id: str) -> Optional[list]:
         """Получает список необходимых документов для типа пенсии."""
-        return await self._make_request("GET", f"/pension_documents/{pension_type_id}", user_id=user_id)
+        return await self._get_reference(f"/pension_documents/{pension_type_id}", user_id=user_id)
+
+    async def get_standard_document_names(self, user_id: int) -> Optional[list]:
+        """Получает список стандартных названий документов."""
+        return await self._get_reference("/standard_document_names", user_id=user_id)
 
-    async def create_ocr_task(self, user_id: int, file_content: bytes, document_type: str) -> Optional[dict]:
-        """Отправляет документ на OCR."""
+    async def create_ocr_task(
+        self,
+        user_id: int,
+        file_content: Union[bytes, AsyncIterable[bytes]],
+        document_type: str,
+        content_type: str = "image/jpeg",
+    ) -> Optional[dict]:
+        """
+        Отправляет документ на OCR.
+        file_content может быть потоком байтов: тогда он передается в multipart-тело
+        по частям, без накопления всего изображения в памяти.
+        """
+        extension = mimetypes.guess_extension(content_type) or ".jpg"
         data = aiohttp.FormData()
-        data.add_field('image', file_content, content_type='image/jpeg', filename='document.jpg')
+        data.add_field('image', file_content, content_type=content_type, filename=f'document{extension}')
         data.add_field('document_type', document_type)
         return await self._make_request(
             "POST", "/document_extractions", user_id=user_id, data=data
@@ -102,7 +333,16 @@ class ApiClient:
 
     async def get_ocr_task_status(self, user_id: int, task_id: str) -> Optional[dict]:
         """Получает статус задачи OCR."""
-        return await self._make_request("GET", f"/document_extractions/{task_id}", user_id=user_id)
+        # Результат, уже полученный для того же фото, не запрашивается у бэкенда
+        if (cached := ocr_results.get_task(task_id, await self.auth_scope(user_id))) is not None:
+            return cached
+        result = await self._make_request(
+            "GET", f"/document_extractions/{task_id}", user_id=user_id, coalesce=True
+        )
+        if result:
+            # В ответе задачи есть поле error, поэтому ответ оценивается по status
+            ocr_results.record(task_id, result)
+        return result
 
     async def create_case(self, user_id: int, case_data: dict) -> Optional[dict]:
         """Создает новое дело."""
@@ -126,19 +366,116 @@ class ApiClient:
                 except ValueError:
                     logging.warning(f"Invalid disability date format for case creation: {d_date}")
 
-        return await self._make_request("POST", "/cases", user_id=user_id, json=data_to_send)
+        result = await self._make_request("POST", "/cases", user_id=user_id, json=data_to_send)
+        if result and result.get("case_id"):
+            # Новое дело должно появиться в истории сразу
+            history_cache.invalidate(user_id)
+        return result
 
     async def get_case_status(self, user_id: int, case_id: int) -> Optional[dict]:
-        """Получает статус дела."""
-        return await self._make_request("GET", f"/cases/{case_id}", user_id=user_id)
+        """Получает статус дела. Дела с окончательным решением берутся из кеша."""
+        if (cached := case_cache.get(case_id, await self.auth_scope(user_id))) is not None:
+            return cached
+        result = await self._make_request("GET", f"/cases/{case_id}", user_id=user_id, coalesce=True)
+        if result and "error" not in result:
+            # Учетная запись — та, с чьим токеном бэкенд отдал дело (токен мог обновиться при запросе)
+            case_cache.put(case_id, token_store.auth_scope(user_id), result)
+        return result
 
-    async def get_case_history(self, user_id: int, limit: int = 5, offset: int = 0) -> Optional[dict]:
-        """Получает историю дел пользователя с пагинацией."""
-        return await self._make_request(
-            "GET",
-            f"/cases/history?limit={limit}&offset={offset}",
-            user_id=user_id
+    async def delete_case(self, user_id: int, case_id: int) -> Optional[dict]:
+        """Удаляет дело и сбрасывает его из кешей."""
+        result = await self._make_request("DELETE", f"/cases/{case_id}", user_id=user_id)
+        if result and "error" not in result:
+            case_cache.invalidate(case_id)
+            document_cache.invalidate(case_id)
+            history_cache.invalidate(user_id)
+        return result
+
+    async def auth_scope(self, user_id: int) -> Optional[str]:
+        """
+        Учетная запись API пользователя: по ней разделяются кеши с данными дел.
+        Токен предварительно подтягивается из общего хранилища и обновляется,
+        если истек; None — действующего токена нет, кешами пользоваться нельзя.
+        """
+        await token_store.sync(user_id)
+        if token_store.needs_refresh(user_id):
+            await self._reauthenticate(user_id)
+        return token_store.auth_scope(user_id)
+
+    async def open_case_document(
+        self, user_id: int, case_id: int, doc_format: str
+    ) -> Union[CaseDocument, dict, None]:
+        """
+        Запрашивает документ с решением по делу (pdf или docx) и возвращает его
+        для чтения потоком, без загрузки в память целиком. При ошибке возвращает
+        ответ API с ошибкой (None — бэкенд недоступен). Запрос не повторяется:
+        тело ответа читает вызывающий.
+        """
+        path = f"/cases/{case_id}/document?format={doc_format}"
+        template = path_template(path)
+        breaker = self._get_breaker(path)
+        if not breaker.allow():
+            logging.warning(f"Circuit open for {template}, request to {path} rejected")
+            api_requests.inc("GET", template, "circuit_open")
+            return {"error": "api_error", "status_code": 503}
+
+        await token_store.sync(user_id)
+        session = await self._get_session()
+        url = f"{self._base_url}{path}"
+        # Общий таймаут сессии ограничивал бы всю передачу файла, поэтому ограничено только ожидание данных
+        timeout = aiohttp.ClientTimeout(
+            total=None, connect=settings.api_connect_timeout, sock_read=settings.api_request_timeout
         )
+        started = time.perf_counter()
+        try:
+            response = await session.get(url, headers=await self._get_headers(user_id), timeout=timeout)
+            if response.status == 401:
+                response.release()
+                token_store.discard(user_id)
+                if not await self._reauthenticate(user_id):
+                    breaker.record_success()
+                    api_requests.inc("GET", template, "401")
+                    return {"error": "api_error", "status_code": 401}
+                response = await session.get(url, headers=await self._get_headers(user_id), timeout=timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Request exception for {path}: {e!r}")
+            breaker.record_failure()
+            api_requests.inc("GET", template, "network_error")
+            return None
+        api_request_duration.observe(time.perf_counter() - started, "GET", template)
+        api_requests.inc("GET", template, str(response.status))
+        if response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if response.status == 200:
+            filename = response.content_disposition.filename if response.content_disposition else None
+            return CaseDocument(response, filename or f"case_{case_id}.{doc_format}")
+        try:
+            _, result, _ = await self._handle_response(response, path)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Request exception for {path}: {e!r}")
+            return {"error": "api_error", "status_code": response.status}
+        finally:
+            response.release()
+        return result
+
+    async def get_case_processing_status(self, user_id: int, case_id: int) -> Optional[dict]:
+        """Получает статус обработки дела (ProcessOutput): PROCESSING или итоговое решение."""
+        return await self._make_request("GET", f"/cases/{case_id}/status", user_id=user_id, coalesce=True)
+
+    async def get_case_history(self, user_id: int, limit: int = 5, skip: int = 0) -> Optional[dict]:
+        """Получает страницу истории дел пользователя через кеш (следующая страница загружается заранее)."""
+        async def fetch(skip: int, limit: int):
+            return await self._make_request(
+                "GET",
+                f"/cases/history?skip={skip}&limit={limit}",
+                user_id=user_id,
+                coalesce=True
+            )
+
+        return await history_cache.get_page(user_id, skip, limit, fetch)
 
 
 # Создаем единственный экземпляр клиента
@@ -0,0 +1,81 @@
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# Числовые ID и UUID в пути заменяются плейсхолдером, чтобы /cases/1 и /cases/2
+# считались одним эндпоинтом
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27,})$")
+
+
+def path_template(path: str) -> str:
+    """Возвращает шаблон пути без query-параметров и идентификаторов."""
+    path = path.split("?", 1)[0]
+    return "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Экспоненциальная задержка с полным джиттером."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для эндпоинта API.
+    После failure_threshold ошибок подряд запросы сразу отклоняются на
+    recovery_timeout секунд, затем пропускается один пробный запрос.
+    """
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float):
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self._recovery_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self._recovery_timeout:
+            return False
+        # Полуоткрытое состояние: пропускаем один пробный запрос.
+        # Если проба зависла или была отменена, через recovery_timeout пускаем следующую.
+        if self._probe_started_at is not None and now - self._probe_started_at < self._recovery_timeout:
+            return False
+        self._probe_started_at = now
+        return True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_started_at = None
+        if self._opened_at is not None or self._failures >= self._failure_threshold:
+            self._opened_at = time.monotonic()
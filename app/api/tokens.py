@@ -0,0 +1,233 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from app.config import settings
+from app.services.shared_store import SharedStore
+
+
+def decode_jwt_claims(token: str) -> dict:
+    """Извлекает полезную нагрузку JWT без проверки подписи."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else {}
+    except (IndexError, ValueError, binascii.Error):
+        return {}
+
+
+def decode_jwt_exp(token: str) -> Optional[float]:
+    """Извлекает время истечения (exp) из JWT."""
+    try:
+        exp = decode_jwt_claims(token).get("exp")
+        return float(exp) if exp is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
+class TokenStore:
+    """
+    Хранилище JWT-токенов пользователей.
+    Знает срок жизни каждого токена (exp из JWT), удаляет просроченные и
+    сохраняет токены на диск в зашифрованном виде, чтобы перезапуск бота
+    не вызывал массовый повторный вход.
+
+    Учетные данные для повторного входа хранятся только в памяти процесса
+    и никогда не пишутся на диск. Они переживают истечение токена (по ним
+    токен и обновляется) и удаляются, только если пользователь не обращался
+    к боту дольше credentials_idle_ttl.
+
+    В кластерном режиме токены публикуются в общее хранилище, и любой воркер
+    (например, лидер фоновых опросов) может действовать от имени пользователя.
+    """
+
+    def __init__(
+        self,
+        default_ttl: float,
+        refresh_margin: float,
+        credentials_idle_ttl: float,
+        persist_path: Optional[str] = None,
+        encryption_key: Optional[str] = None,
+    ):
+        self._default_ttl = default_ttl
+        self._refresh_margin = refresh_margin
+        self._credentials_idle_ttl = credentials_idle_ttl
+        # {user_id: (token, expires_at)}
+        self._tokens: dict[int, tuple[str, float]] = {}
+        self._credentials: dict[int, tuple[str, str]] = {}
+        # {user_id: время последнего обращения} — для удаления учетных данных неактивных
+        self._last_used: dict[int, float] = {}
+        self._persist_path = persist_path
+        self._fernet = Fernet(encryption_key.encode()) if encryption_key else None
+        self._save_task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+        self._shared: Optional[SharedStore] = None
+        self._publish_tasks: set[asyncio.Task] = set()
+
+    def attach(self, store: SharedStore):
+        """Переключает хранение токенов на общее хранилище вместо файла."""
+        self._shared = store
+        self._persist_path = None
+
+    def set(self, user_id: int, token: str, credentials: Optional[tuple[str, str]] = None):
+        expires_at = decode_jwt_exp(token) or time.time() + self._default_ttl
+        self._tokens[user_id] = (token, expires_at)
+        if credentials is not None:
+            self._credentials[user_id] = credentials
+        self._last_used[user_id] = time.time()
+        self._sweep()
+        self._schedule_save()
+        if self._shared is not None:
+            task = asyncio.create_task(self._publish(user_id, token, expires_at))
+            self._publish_tasks.add(task)
+            task.add_done_callback(self._publish_tasks.discard)
+
+    def get(self, user_id: int) -> Optional[str]:
+        """
+        Возвращает действующий токен пользователя или None. Просроченный токен
+        удаляется, а учетные данные остаются для обновления (как и в _sweep).
+        """
+        now = time.time()
+        if user_id in self._credentials:
+            self._last_used[user_id] = now
+        entry = self._tokens.get(user_id)
+        if entry is None:
+            return None
+        token, expires_at = entry
+        if expires_at <= now:
+            self._tokens.pop(user_id, None)
+            return None
+        return token
+
+    def auth_scope(self, user_id: int) -> Optional[str]:
+        """
+        Учетная запись API, от имени которой работает пользователь (claim sub).
+        Пользователи с одной учетной записью видят одни и те же данные.
+        """
+        token = self.get(user_id)
+        if token is None:
+            return None
+        return decode_jwt_claims(token).get("sub") or token
+
+    async def sync(self, user_id: int):
+        """Подтягивает токен из общего хранилища, если его выдал другой воркер."""
+        if self._shared is None or self.get(user_id) is not None:
+            return
+        raw = await self._shared.get(f"token:{user_id}")
+        if raw is None:
+            return
+        try:
+            token = self._fernet.decrypt(raw.encode()).decode() if self._fernet else raw
+        except InvalidToken:
+            logging.warning(f"Token store: failed to decrypt shared token for user {user_id}")
+            return
+        expires_at = decode_jwt_exp(token) or time.time() + self._default_ttl
+        self._tokens[user_id] = (token, expires_at)
+
+    async def _publish(self, user_id: int, token: str, expires_at: float):
+        ttl = expires_at - time.time()
+        if ttl <= 0:
+            return
+        value = self._fernet.encrypt(token.encode()).decode() if self._fernet else token
+        await self._shared.set(f"token:{user_id}", value, ttl=ttl)
+
+    def get_credentials(self, user_id: int) -> Optional[tuple[str, str]]:
+        credentials = self._credentials.get(user_id)
+        if credentials is not None:
+            self._last_used[user_id] = time.time()
+        return credentials
+
+    def needs_refresh(self, user_id: int) -> bool:
+        """True, если токен скоро истечет (или уже истек) и его можно обновить."""
+        if user_id not in self._credentials:
+            return False
+        entry = self._tokens.get(user_id)
+        return entry is None or entry[1] - time.time() < self._refresh_margin
+
+    def discard(self, user_id: int):
+        # Только локально: токен в общем хранилище обновит воркер, знающий учетные данные
+        self._tokens.pop(user_id, None)
+        self._schedule_save()
+
+    def _sweep(self):
+        # Периодически удаляем просроченные токены, чтобы словарь не рос бесконечно.
+        # Учетные данные нужны для обновления токена и удаляются только после простоя
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        expired = [user_id for user_id, (_, expires_at) in self._tokens.items() if expires_at <= now]
+        for user_id in expired:
+            del self._tokens[user_id]
+        idle = [user_id for user_id, used_at in self._last_used.items() if now - used_at >= self._credentials_idle_ttl]
+        for user_id in idle:
+            del self._last_used[user_id]
+            self._credentials.pop(user_id, None)
+
+    # --- Зашифрованное хранение на диске ---
+
+    def load(self):
+        if not self._fernet or not self._persist_path or not os.path.exists(self._persist_path):
+            return
+        try:
+            with open(self._persist_path, "rb") as f:
+                raw = json.loads(self._fernet.decrypt(f.read()))
+        except (OSError, ValueError, InvalidToken) as e:
+            logging.warning(f"Token store: failed to load {self._persist_path}: {e}")
+            return
+        now = time.time()
+        for user_id, token in raw.items():
+            expires_at = decode_jwt_exp(token) or 0
+            if expires_at > now:
+                self._tokens[int(user_id)] = (token, expires_at)
+        logging.info(f"Token store: restored {len(self._tokens)} tokens")
+
+    def _schedule_save(self):
+        if not self._fernet or not self._persist_path:
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(1)
+        await self.save()
+
+    async def save(self):
+        if not self._fernet or not self._persist_path:
+            return
+        payload = json.dumps({str(user_id): token for user_id, (token, _) in self._tokens.items()})
+        await asyncio.to_thread(self._write, self._fernet.encrypt(payload.encode()))
+
+    def _write(self, blob: bytes):
+        try:
+            os.makedirs(os.path.dirname(self._persist_path) or ".", exist_ok=True)
+            tmp_path = f"{self._persist_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(blob)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self._persist_path)
+        except OSError as e:
+            logging.warning(f"Token store: failed to write {self._persist_path}: {e}")
+
+    async def close(self):
+        if self._save_task and not self._save_task.done():
+            self._save_task.cancel()
+        await asyncio.gather(*self._publish_tasks, return_exceptions=True)
+        await self.save()
+
+
+token_store = TokenStore(
+    default_ttl=settings.api_token_ttl,
+    refresh_margin=settings.api_token_refresh_margin,
+    credentials_idle_ttl=settings.api_credentials_idle_ttl,
+    persist_path=os.path.join(settings.data_dir, "tokens.bin"),
+    encryption_key=settings.token_store_key,
+)
@@ -0,0 +1,175 @@
+import hashlib
+import html
+import re
+from collections import OrderedDict
+from typing import Optional
+
+# Выражения привязаны к \n, а не к ^ с MULTILINE: поиск литерала в начале шаблона
+# идет намного быстрее, чем попытка совпадения в каждой позиции текста.
+# Заголовок: ### Текст, ###Текст или # Текст (одиночный # без пробела — это хештег)
+_HEADER_RE = re.compile(r"\n([ \t]*)(?:#{3,6}|#{1,2}(?=[ \t]))[ \t]*([^\n]*)")
+# Маркер списка "- " или "* " в начале строки
+_BULLET_RE = re.compile(r"\n([ \t]*)[-*][ \t]+(?=\S)")
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+
+_MEMO_SIZE = 512
+# {blake2b(текст): HTML}: большие тексты не хранятся в памяти как ключи
+_memo: OrderedDict[bytes, str] = OrderedDict()
+
+
+def quote(value) -> str:
+    """Экранирует значение для вставки в сообщение с parse_mode=HTML."""
+    return html.escape(str(value), quote=False)
+
+
+def _header(match: re.Match) -> str:
+    # Текст уже экранирован, поэтому <b> в нем может быть только от **жирного**;
+    # вложенный <b> внутри заголовка не нужен
+    title = match.group(2).replace("<b>", "").replace("</b>", "")
+    return f"\n{match.group(1)}<b>{title}</b>"
+
+
+def render_rag_html(text: str) -> str:
+    """
+    Переводит Markdown-подмножество ответов RAG (заголовки #, списки - и *,
+    **жирный**, разделители ---) в HTML для Telegram. Исходный текст сначала
+    экранируется целиком, затем разметка заменяется скомпилированными
+    выражениями по всему тексту, без построчного цикла в Python.
+    Результат запоминается по хешу текста.
+    """
+    if not text:
+        return "Нет"
+    digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    rendered = _memo.get(digest)
+    if rendered is not None:
+        _memo.move_to_end(digest)
+        return rendered
+
+    # Экранирование не затрагивает символы разметки (#, -, *); ведущий \n
+    # позволяет обработать первую строку теми же выражениями
+    rendered = "\n" + quote(text).replace("---", "\n")
+    rendered = _BULLET_RE.sub(r"\n\1• ", rendered)
+    rendered = _BOLD_RE.sub(r"<b>\1</b>", rendered)
+    rendered = _HEADER_RE.sub(_header, rendered)[1:]
+
+    _memo[digest] = rendered
+    if len(_memo) > _MEMO_SIZE:
+        _memo.popitem(last=False)
+    return rendered
+
+
+
+MAX_MESSAGE_LENGTH = 4096
+
+# Тег (с разобранным именем), HTML-сущность или кусок текста; одиночные < и &
+# считаются текстом. Длина куска ограничена, чтобы повторный разбор после
+# разреза не проходил заново всю длинную строку без разметки
+_TOKEN_RE = re.compile(
+    r"<(/?)\s*([a-zA-Z][\w-]*)[^<>]*>|<[^<>]*>|&(?:#\d+|#x[0-9a-fA-F]+|[a-zA-Z]\w*);|[^<&]{1,8192}|[<&]"
+)
+
+# Места разреза в порядке предпочтения: абзац, строка, слово
+_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def _utf16_len(text: str) -> int:
+    """Длина в единицах UTF-16: так длину сообщения считает Telegram."""
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def _utf16_prefix(text: str, units: int) -> int:
+    """Сколько первых символов text помещается в units единиц UTF-16."""
+    count = min(len(text), units)
+    if text.isascii():
+        return count
+    # Символ занимает одну или две единицы, поэтому отбросить нужно не меньше
+    # половины превышения: так за несколько шагов находится наибольший префикс
+    while (excess := _utf16_len(text[:count]) - units) > 0:
+        count -= (excess + 1) // 2
+    return count
+
+
+def split_long_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Разбивает HTML-сообщение на части не длиннее limit единиц UTF-16 видимого
+    текста (теги не учитываются, сущность считается одним символом).
+    Разрез делается по абзацу, затем по строке, затем по пробелу, но не раньше
+    середины части; если таких мест нет — посреди слова. Незакрытые на месте
+    разреза теги закрываются в конце части и открываются заново в следующей.
+    Текст проходится по смещениям за линейное время: после разреза разбор
+    продолжается с места разреза, то есть повторяется не больше одной части.
+    """
+    if _utf16_len(text) <= limit:
+        return [text]
+
+    parts: list[str] = []
+    min_fill = limit // 2
+    # Открытые теги: (имя, исходный открывающий тег); кортеж, чтобы запоминать без копирования
+    stack: tuple[tuple[str, str], ...] = ()
+    # Последнее место разреза каждого вида: (смещение, длина разделителя,
+    # заполнение до начала куска, начало куска, теги). Заполнение в самом месте
+    # разреза досчитывается только при выборе разреза
+    breaks: list[Optional[tuple]] = [None] * len(_SEPARATORS)
+    reopen, start, used, pos = "", 0, 0, 0
+
+    def note_breaks(chunk: str, offset: int):
+        for kind, separator in enumerate(_SEPARATORS):
+            index = chunk.rfind(separator)
+            if index >= 0:
+                breaks[kind] = (offset + index, len(separator), used, offset, stack)
+
+    def emit(end: int, open_tags: tuple):
+        body = text[start:end]
+        if body.strip():
+            closing = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+            parts.append(reopen + body + closing)
+
+    while pos < len(text):
+        token = _TOKEN_RE.match(text, pos)
+        value = token.group()
+
+        if value[0] == "<" and len(value) > 1:
+            tag = token.group(2)
+            if tag is not None:
+                tag = tag.lower()
+                if token.group(1):
+                    for depth in range(len(stack) - 1, -1, -1):
+                        if stack[depth][0] == tag:
+                            stack = stack[:depth]
+                            break
+                elif not value.endswith("/>"):
+                    stack += ((tag, value),)
+            pos = token.end()
+            continue
+
+        entity = value[0] == "&" and len(value) > 1
+        size = 1 if entity else _utf16_len(value)
+        if used + size <= limit:
+            if not entity:
+                note_breaks(value, pos)
+            used += size
+            pos = token.end()
+            continue
+
+        # Токен не помещается: разрез в уже набранной части или в начале токена
+        fit = 0 if entity else _utf16_prefix(value, limit - used)
+        note_breaks(value[:fit], pos)
+        cut_end = cut_next = pos + fit
+        open_tags = stack
+        for item in breaks:
+            if item is None:
+                continue
+            index, length, filled, chunk_start, tags = item
+            if filled + _utf16_len(text[chunk_start:index]) >= min_fill:
+                cut_end, cut_next, open_tags = index, index + length, tags
+                break
+
+        emit(cut_end, open_tags)
+        stack = open_tags
+        reopen = "".join(tag for _, tag in stack)
+        start = pos = cut_next
+        used = 0
+        breaks = [None] * len(_SEPARATORS)
+
+    emit(len(text), ())
+    return parts
@@ -1,11 +1,12 @@
+import asyncio
 import logging
 from datetime import datetime
+from typing import Optional
 from aiogram import F, Router, Bot
+from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, PhotoSize
-from io import BytesIO
-import re
-import asyncio
 
 from app.api.client import api_client
 from app.bot.keyboards import (
@@ -18,9 +19,18 @@ from app.bot.keyboards import (
     get_gender_keyboard,
     get_document_upload_keyboard,
     get_verification_keyboard,
+    get_album_mapping_keyboard,
 )
 from app.bot.states import NewCase, CheckStatus
-from app.bot.utils import split_long_message
+from app.bot.formatting import quote, render_rag_html, split_long_message
+from app.bot.progress import ProgressMessage
+from app.bot.storage import modify_data
+from app.bot.utils import FileTooLargeError, edit_message, submit_photo_for_ocr
+from app.config import settings
+from app.services.case_cache import case_cache
+from app.services.history_cache import history_cache
+from app.services.poll_jobs import poll_jobs
+from app.services.poll_scheduler import PollJob, case_poller, ocr_poller
 
 router = Router()
 
@@ -33,19 +43,23 @@ async def handle_start_new_case(callback: CallbackQuery, state: FSMContext):
     Обрабатывает нажатие кнопки 'Начать новое дело' из главного меню.
     Запрашивает у API типы пенсий и предлагает их пользователю.
     """
-    await callback.message.edit_text("Загружаю доступные типы пенсий...")
+    # Опросы OCR из предыдущего незавершенного сценария больше не нужны
+    await poll_jobs.cancel_owner(callback.from_user.id, kind="ocr")
+    # Справочник обычно уже в кеше, и тогда промежуточный текст не показывается
+    progress = ProgressMessage(callback.message, edit=True)
+    progress.update("Загружаю доступные типы пенсий...")
     
     pension_types = await api_client.get_pension_types(user_id=callback.from_user.id)
     
     if pension_types:
         keyboard = get_pension_types_keyboard(pension_types)
-        await callback.message.edit_text(
+        await progress.finish(
             "Выберите тип пенсии, на который вы претендуете:",
             reply_markup=keyboard
         )
         await state.set_state(NewCase.choosing_pension_type)
     else:
-        await callback.message.edit_text(
+        await progress.finish(
             "К сожалению, не удалось загрузить типы пенсий. Попробуйте позже."
         )
         await callback.answer()
@@ -77,8 +91,8 @@ async def ask_for_next_document(message: Message, state: FSMContext):
     if current_doc_index < len(docs_to_upload):
         doc = docs_to_upload[current_doc_index]
         await message.answer(
-            f"Пожалуйста, загрузите следующий документ: <b>{doc['name']}</b>\n"
-            f"<i>{doc['description']}</i>"
+            f"Пожалуйста, загрузите следующий документ: <b>{quote(doc['name'])}</b>\n"
+            f"<i>{quote(doc['description'])}</i>"
         )
         await state.set_state(NewCase.uploading_documents_cycle)
     else:
@@ -113,12 +127,12 @@ async def handle_pension_type_chosen(
         pension_type_name=chosen_type_name
     )
 
-    await callback.message.edit_text(f"Выбран тип пенсии: <b>{chosen_type_name}</b>")
+    await callback.message.edit_text(f"Выбран тип пенсии: <b>{quote(chosen_type_name)}</b>")
     
     # По новому ТЗ, после выбора типа пенсии мы сразу переходим к сбору personal_data
     # или к загрузке документов. Логику OCR перенесем на следующий шаг.
     
-    await callback.message.answer("📝 Введите вашу **фамилию**.")
+    await callback.message.answer("📝 Введите вашу <b>фамилию</b>.")
     await state.set_state(NewCase.entering_last_name)
     await callback.answer()
 
@@ -128,7 +142,7 @@ async def handle_pension_type_chosen(
 @router.message(NewCase.entering_last_name, F.text)
 async def handle_last_name(message: Message, state: FSMContext):
     await state.update_data(last_name=message.text)
-    await message.answer(f"Принято: {message.text}.\n\n📝 Введите ваше **имя**.")
+    await message.answer(f"Принято: {quote(message.text)}.\n\n📝 Введите ваше <b>имя</b>.")
     await state.set_state(NewCase.entering_first_name)
 
 
@@ -136,7 +150,7 @@ async def handle_last_name(message: Message, state: FSMContext):
 async def handle_first_name(message: Message, state: FSMContext):
     await state.update_data(first_name=message.text)
     await message.answer(
-        f"Принято: {message.text}.\n\n📝 Введите ваше **отчество**.",
+        f"Принято: {quote(message.text)}.\n\n📝 Введите ваше <b>отчество</b>.",
         reply_markup=get_skip_keyboard("Пропустить"),
     )
     await state.set_state(NewCase.entering_middle_name)
@@ -146,7 +160,7 @@ async def handle_first_name(message: Message, state: FSMContext):
 async def handle_skip_middle_name(callback: CallbackQuery, state: FSMContext):
     await state.update_data(middle_name=None)
     await callback.message.edit_text("Отчество пропущено.")
-    await callback.message.answer("📅 Введите дату рождения в формате **ДД.ММ.ГГГГ**.")
+    await callback.message.answer("📅 Введите дату рождения в формате <b>ДД.ММ.ГГГГ</b>.")
     await state.set_state(NewCase.entering_birth_date)
     await callback.answer()
 
@@ -154,8 +168,8 @@ async def handle_skip_middle_name(callback: CallbackQuery, state: FSMContext):
 @router.message(NewCase.entering_middle_name, F.text)
 async def handle_middle_name(message: Message, state: FSMContext):
     await state.update_data(middle_name=message.text)
-    await message.answer(f"Принято: {message.text}.")
-    await message.answer("📅 Введите дату рождения в формате **ДД.ММ.ГГГГ**.")
+    await message.answer(f"Принято: {quote(message.text)}.")
+    await message.answer("📅 Введите дату рождения в формате <b>ДД.ММ.ГГГГ</b>.")
     await state.set_state(NewCase.entering_birth_date)
 
 
@@ -164,7 +178,7 @@ async def handle_birth_date(message: Message, state: FSMContext):
     try:
         datetime.strptime(message.text, "%d.%m.%Y")
         await state.update_data(birth_date=message.text)
-        await message.answer(f"Принято: {message.text}.\n\n📝 Введите номер **СНИЛС** (11 цифр, можно с пробелами и дефисами).")
+        await message.answer(f"Принято: {quote(message.text)}.\n\n📝 Введите номер <b>СНИЛС</b> (11 цифр, можно с пробелами и дефисами).")
         await state.set_state(NewCase.entering_snils)
     except ValueError:
         await message.answer(
@@ -179,7 +193,7 @@ async def handle_snils(message: Message, state: FSMContext):
     if snils.isdigit() and len(snils) == 11:
         await state.update_data(snils=snils)
         await message.answer(
-            f"Принято.\n\n👫 Укажите ваш **пол**.",
+            f"Принято.\n\n👫 Укажите ваш <b>пол</b>.",
             reply_markup=get_gender_keyboard(),
         )
         await state.set_state(NewCase.entering_gender)
@@ -204,7 +218,7 @@ async def handle_gender_callback(callback: CallbackQuery, state: FSMContext):
 @router.message(NewCase.entering_citizenship, F.text)
 async def handle_citizenship(message: Message, state: FSMContext):
     await state.update_data(citizenship=message.text)
-    await message.answer(f"Принято: {message.text}.\n\n👨‍👩‍👧‍👦 Укажите **количество иждивенцев** (цифрой, 0 если нет).")
+    await message.answer(f"Принято: {quote(message.text)}.\n\n👨‍👩‍👧‍👦 Укажите <b>количество иждивенцев</b> (цифрой, 0 если нет).")
     await state.set_state(NewCase.entering_dependents)
 
 
@@ -244,7 +258,7 @@ async def handle_dependents(message: Message, state: FSMContext):
             docs_message_lines = ["Для этого типа пенсии требуются:\n"]
             for doc in required_docs:
                 status = "❗️" if doc.get('is_critical') else "🔹"
-                docs_message_lines.append(f"{status} {doc.get('name')}")
+                docs_message_lines.append(f"{status} {quote(doc.get('name'))}")
             
             await message.answer(
                 "\n".join(docs_message_lines),
@@ -271,11 +285,183 @@ async def handle_upload_doc_button(callback: CallbackQuery, state: FSMContext):
     doc_type_to_upload = callback.data.split(":")[1]
     await state.update_data(current_upload_doc_type=doc_type_to_upload)
     
-    await callback.message.answer(f"Пришлите мне фотографию или скан для документа: <b>{doc_type_to_upload}</b>")
+    await callback.message.answer(f"Пришлите мне фотографию или скан для документа: <b>{quote(doc_type_to_upload)}</b>")
     await state.set_state(NewCase.uploading_document)
     await callback.answer()
 
 
+# --- Загрузка нескольких документов альбомом ---
+
+# Тип для фото, не относящихся к требуемым документам
+OTHER_DOC = {"ocr_type": "other", "name": "Другой документ"}
+
+
+def _album_doc_options(required_docs: list) -> list[dict]:
+    """Типы, между которыми переключается фото альбома: требуемые документы и «другой»."""
+    options = [doc for doc in required_docs if doc.get("ocr_type")]
+    if not any(doc["ocr_type"] == OTHER_DOC["ocr_type"] for doc in options):
+        options.append(OTHER_DOC)
+    return options
+
+
+def _album_keyboard(album_photos: list[dict], required_docs: list):
+    names = {doc["ocr_type"]: doc.get("name") or doc["ocr_type"] for doc in _album_doc_options(required_docs)}
+    return get_album_mapping_keyboard(tuple(names.get(photo["doc_type"], photo["doc_type"]) for photo in album_photos))
+
+
+@router.message(StateFilter(NewCase.managing_documents, NewCase.uploading_document), F.media_group_id, F.photo)
+async def handle_album_upload(message: Message, state: FSMContext, album: Optional[list[Message]] = None):
+    """
+    Принимает альбом фото документов (части собирает AlbumMiddleware) и предлагает
+    сопоставить фото с типами документов. По умолчанию фото получают еще не
+    загруженные документы по порядку; если перед этим была нажата кнопка
+    документа, все фото считаются его страницами.
+    """
+    photos = [item.photo[-1] for item in (album or [message]) if item.photo]
+    if len(photos) > settings.album_max_photos:
+        await message.answer(f"В альбоме больше {settings.album_max_photos} фото, лишние будут пропущены.")
+        photos = photos[:settings.album_max_photos]
+
+    data = await state.get_data()
+    required_docs = data.get("required_docs", [])
+    uploaded_docs = data.get("uploaded_docs", {})
+    if await state.get_state() == NewCase.uploading_document.state and data.get("current_upload_doc_type"):
+        doc_types = [data["current_upload_doc_type"]] * len(photos)
+    else:
+        missing = [
+            doc["ocr_type"] for doc in required_docs
+            if doc.get("ocr_type") and (uploaded_docs.get(doc["ocr_type"]) or {}).get("status") not in ("PROCESSING", "COMPLETED")
+        ]
+        doc_types = [missing[i] if i < len(missing) else OTHER_DOC["ocr_type"] for i in range(len(photos))]
+
+    album_photos = [
+        {
+            "file_id": photo.file_id,
+            "file_unique_id": photo.file_unique_id,
+            "max_side": max(photo.width, photo.height),
+            "doc_type": doc_type,
+        }
+        for photo, doc_type in zip(photos, doc_types)
+    ]
+    await state.update_data(album_photos=album_photos)
+    await state.set_state(NewCase.mapping_album)
+    await message.answer(
+        f"Получено фото: {len(album_photos)}. Проверьте, какой документ на каждом: нажатие на строку меняет тип. "
+        "Несколько фото одного типа считаются страницами одного документа.",
+        reply_markup=_album_keyboard(album_photos, required_docs)
+    )
+
+
+@router.callback_query(NewCase.mapping_album, F.data.startswith("album_type:"))
+async def handle_album_type_switch(callback: CallbackQuery, state: FSMContext):
+    """Переключает тип документа для одного фото альбома."""
+    index = int(callback.data.split(":")[1])
+    data = await state.get_data()
+    album_photos = data.get("album_photos", [])
+    required_docs = data.get("required_docs", [])
+    if index < len(album_photos):
+        doc_types = [doc["ocr_type"] for doc in _album_doc_options(required_docs)]
+        current = album_photos[index]["doc_type"]
+        position = doc_types.index(current) + 1 if current in doc_types else 0
+        album_photos[index]["doc_type"] = doc_types[position % len(doc_types)]
+        await state.update_data(album_photos=album_photos)
+        # Текст не меняется, поэтому обновляется только клавиатура
+        await edit_message(callback.message, callback.message.html_text, _album_keyboard(album_photos, required_docs))
+    await callback.answer()
+
+
+@router.callback_query(NewCase.mapping_album, F.data == "album_cancel")
+async def handle_album_cancel(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.update_data(album_photos=[])
+    await state.set_state(NewCase.managing_documents)
+    await callback.message.edit_text("Загрузка альбома отменена.")
+    await callback.message.answer(
+        "Вы можете загрузить документы по одному или отправить альбом еще раз.",
+        reply_markup=get_document_upload_keyboard(data.get("required_docs", []), data.get("uploaded_docs", {}))
+    )
+    await callback.answer()
+
+
+@router.callback_query(NewCase.mapping_album, F.data == "album_submit")
+async def handle_album_submit(callback: CallbackQuery, state: FSMContext, bot: Bot):
+    """
+    Отправляет все фото альбома на OCR одновременно (не больше ocr_upload_concurrency
+    за раз) и ставит один опрос на все задачи: результаты приходят вместе.
+    """
+    data = await state.get_data()
+    album_photos = data.get("album_photos", [])
+    user_id, chat_id = callback.from_user.id, callback.message.chat.id
+    # Правка убирает клавиатуру, чтобы альбом нельзя было отправить дважды
+    progress = await callback.message.edit_text(f"⏳ Отправляю на распознавание фото: {len(album_photos)}...")
+    await callback.answer()
+
+    semaphore = asyncio.Semaphore(settings.ocr_upload_concurrency)
+
+    async def submit(photo: dict) -> Optional[dict]:
+        async with semaphore:
+            try:
+                return await submit_photo_for_ocr(
+                    bot,
+                    user_id=user_id,
+                    file_id=photo["file_id"],
+                    document_type=photo["doc_type"],
+                    file_unique_id=photo.get("file_unique_id"),
+                    max_side=photo.get("max_side"),
+                )
+            except FileTooLargeError:
+                return None
+            except Exception as e:
+                # Ошибка одного фото не должна терять задачи, уже созданные для остальных
+                logging.error(f"Failed to submit album photo for user {user_id}: {e!r}")
+                return None
+
+    results = await asyncio.gather(*(submit(photo) for photo in album_photos))
+    tasks = [
+        {"task_id": result["task_id"], "doc_type": photo["doc_type"]}
+        for photo, result in zip(album_photos, results) if result and "task_id" in result
+    ]
+
+    # Фото одного типа — страницы одного документа
+    pages: dict[str, list[str]] = {}
+    for task in tasks:
+        pages.setdefault(task["doc_type"], []).append(task["task_id"])
+    uploaded_docs = await _update_uploaded_docs(
+        state,
+        {
+            doc_type: {"task_id": task_ids[0], "task_ids": task_ids, "status": "PROCESSING"}
+            for doc_type, task_ids in pages.items()
+        },
+        album_photos=[],
+    )
+    await state.set_state(NewCase.managing_documents)
+
+    if tasks:
+        # Если все фото уже распознавались, результат показывается без ожидания первого опроса
+        all_cached = all(result.get("cached") for result in results if result and "task_id" in result)
+        await poll_jobs.submit(
+            "ocr",
+            key=album_job_key(tasks),
+            owner=user_id,
+            descriptor={
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "tasks": tasks,
+                "initial_delay": 0.0 if all_cached else settings.ocr_poll_initial_delay,
+            },
+        )
+        text = f"Распознавание запущено для фото: {len(tasks)}. Пришлю результаты вместе, когда все будет готово."
+    else:
+        text = "❌ Не удалось отправить фото на распознавание."
+    if failed := len(album_photos) - len(tasks):
+        text += f"\n❌ Не отправлено фото: {failed}. Их можно загрузить еще раз."
+    await edit_message(progress if isinstance(progress, Message) else callback.message, text)
+    await callback.message.answer(
+        "Вы можете загрузить следующий документ или дождаться результатов обработки.",
+        reply_markup=get_document_upload_keyboard(data.get("required_docs", []), uploaded_docs)
+    )
+
+
 @router.message(NewCase.uploading_document, F.photo)
 async def handle_document_photo_upload(message: Message, state: FSMContext, bot: Bot):
     """Принимает фото документа, отправляет на OCR и начинает опрос статуса."""
@@ -287,45 +473,58 @@ async def handle_document_photo_upload(message: Message, state: FSMContext, bot:
         await state.clear()
         return
 
-    # Отправляем уведомление пользователю
-    progress_message = await message.answer(f"⏳ Получил фото для '{doc_type}'. Начинаю распознавание, это может занять до минуты...")
+    # Уведомление появится, только если отправка на OCR затянется
+    progress = ProgressMessage(message)
+    progress.update(f"⏳ Получил фото для '{quote(doc_type)}'. Начинаю распознавание, это может занять до минуты...")
 
-    # Скачиваем фото
+    # Отправляем фото на OCR
     photo: PhotoSize = message.photo[-1]
-    image_bytes_io = BytesIO()
-    await bot.download(file=photo.file_id, destination=image_bytes_io)
-    image_bytes = image_bytes_io.getvalue()
-    
-    # Отправляем на OCR
-    result = await api_client.create_ocr_task(
-        user_id=message.from_user.id,
-        file_content=image_bytes,
-        document_type=doc_type
-    )
+    try:
+        result = await submit_photo_for_ocr(
+            bot,
+            user_id=message.from_user.id,
+            file_id=photo.file_id,
+            document_type=doc_type,
+            file_unique_id=photo.file_unique_id,
+            max_side=max(photo.width, photo.height),
+        )
+    except FileTooLargeError:
+        await progress.finish(f"❌ Фото для '{quote(doc_type)}' больше 10 МБ. Пожалуйста, отправьте изображение меньшего размера.")
+        await state.set_state(NewCase.managing_documents)
+        return
 
     if not result or "task_id" not in result:
-        await progress_message.edit_text(f"❌ К сожалению, не удалось начать обработку документа '{doc_type}'. Попробуйте загрузить еще раз.")
+        await progress.finish(f"❌ К сожалению, не удалось начать обработку документа '{quote(doc_type)}'. Попробуйте загрузить еще раз.")
         # Возвращаемся к выбору документов
         await state.set_state(NewCase.managing_documents)
         return
 
     task_id = result["task_id"]
-    await progress_message.edit_text(f"Распознавание для '{doc_type}' запущено. ID задачи: `{task_id}`. Ожидайте результата. Я проверю его через несколько секунд.")
+    if result.get("cached"):
+        await progress.finish(f"✅ Это фото документа '{quote(doc_type)}' уже распознано, сейчас покажу результат.")
+    else:
+        await progress.finish(f"Распознавание для '{quote(doc_type)}' запущено. ID задачи: <code>{quote(task_id)}</code>. Ожидайте результата. Я проверю его через несколько секунд.")
     
     # Сохраняем таску
-    uploaded_docs = data.get("uploaded_docs", {})
-    uploaded_docs[doc_type] = {"task_id": task_id, "status": "PROCESSING"}
-    await state.update_data(uploaded_docs=uploaded_docs)
+    uploaded_docs = await _update_uploaded_docs(state, {doc_type: {"task_id": task_id, "status": "PROCESSING"}})
+    # Состояние меняется до постановки опроса: иначе готовый результат OCR может
+    # перевести сценарий к проверке данных раньше, чем это состояние будет записано
+    await state.set_state(NewCase.managing_documents)
     
-    # Запускаем опрос статуса задачи
-    asyncio.create_task(poll_ocr_status(
-        user_id=message.from_user.id,
-        chat_id=message.chat.id,
-        task_id=task_id,
-        doc_type=doc_type,
-        state=state,
-        bot=bot
-    ))
+    # Ставим задачу в общий планировщик опроса статусов OCR
+    await poll_jobs.submit(
+        "ocr",
+        key=task_id,
+        owner=message.from_user.id,
+        descriptor={
+            "user_id": message.from_user.id,
+            "chat_id": message.chat.id,
+            "task_id": task_id,
+            "doc_type": doc_type,
+            # Готовый результат показывается без ожидания первого опроса
+            "initial_delay": 0.0 if result.get("cached") else settings.ocr_poll_initial_delay,
+        },
+    )
 
     # Сразу возвращаем пользователя к управлению документами, не дожидаясь окончания опроса
     required_docs = data.get("required_docs", [])
@@ -333,54 +532,293 @@ async def handle_document_photo_upload(message: Message, state: FSMContext, bot:
         "Вы можете загрузить следующий документ или дождаться результатов обработки.",
         reply_markup=get_document_upload_keyboard(required_docs, uploaded_docs)
     )
-    await state.set_state(NewCase.managing_documents)
 
 
-async def poll_ocr_status(user_id: int, chat_id: int, task_id: str, doc_type: str, state: FSMContext, bot: Bot):
-    """Асинхронно опрашивает статус OCR задачи и обрабатывает результат."""
-    # Простой поллинг с несколькими попытками
-    for _ in range(10): # Например, 10 попыток с интервалом 5 секунд
-        await asyncio.sleep(5) 
+async def _update_uploaded_docs(state: FSMContext, docs: dict, same_task: bool = False, **extra) -> dict:
+    """
+    Атомарно записывает документы docs в uploaded_docs (и поля extra) и
+    возвращает новые uploaded_docs. Результат опроса приходит из другого
+    воркера, поэтому читать uploaded_docs и записывать их целиком нельзя:
+    запись затрет документы, загруженные за это время. С same_task документ
+    обновляется, только если у него та же задача OCR (его не загрузили заново).
+    """
+    def change(data: dict):
+        uploaded_docs = data.setdefault("uploaded_docs", {})
+        for doc_type, doc_info in docs.items():
+            if same_task and (uploaded_docs.get(doc_type) or {}).get("task_id") != doc_info["task_id"]:
+                continue
+            uploaded_docs[doc_type] = doc_info
+        data.update(extra)
+
+    data = await modify_data(state.storage, state.key, change)
+    return data.get("uploaded_docs", {})
+
+
+def album_job_key(tasks: list[dict]) -> str:
+    return f"album:{tasks[0]['task_id']}"
+
+
+def build_ocr_poll_job(descriptor: dict, bot: Bot, storage: BaseStorage) -> PollJob:
+    """Строит задачу опроса OCR по ее описанию (задачу может исполнять другой воркер)."""
+    user_id, chat_id = descriptor["user_id"], descriptor["chat_id"]
+    state = FSMContext(storage=storage, key=StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id))
+
+    if "tasks" in descriptor:
+        # Альбом: все задачи опрашиваются вместе
+        tasks = descriptor["tasks"]
+        key = album_job_key(tasks)
+
+        async def poll(job: PollJob) -> bool:
+            return await check_ocr_album_status(job, user_id, chat_id, tasks, state, bot)
+
+        async def on_expire(job: PollJob):
+            await finish_ocr_album(chat_id, tasks, job.meta.get("results", {}), state, bot)
+    else:
+        key, doc_type = descriptor["task_id"], descriptor["doc_type"]
+
+        async def poll(job: PollJob) -> bool:
+            return await check_ocr_status(job, user_id, chat_id, key, doc_type, state, bot)
+
+        async def on_expire(job: PollJob):
+            await handle_ocr_poll_expired(chat_id, key, doc_type, state, bot)
+
+    return PollJob(
+        key=key,
+        poll=poll,
+        owner=user_id,
+        initial_delay=descriptor.get("initial_delay", settings.ocr_poll_initial_delay),
+        max_delay=settings.ocr_poll_max_delay,
+        backoff_factor=settings.ocr_poll_backoff_factor,
+        max_wait=settings.ocr_poll_max_wait,
+        on_expire=on_expire,
+    )
+
+
+poll_jobs.register("ocr", ocr_poller, build_ocr_poll_job)
+
+
+async def check_ocr_status(
+    job: PollJob, user_id: int, chat_id: int, task_id: str, doc_type: str, state: FSMContext, bot: Bot
+) -> bool:
+    """Один опрос статуса OCR задачи. Возвращает True, если опрос можно завершить."""
+    result = await api_client.get_ocr_task_status(user_id=user_id, task_id=task_id)
+    status = result.get("status") if result else None
+
+    if status in ("COMPLETED", "FAILED"):
+        # Сценарий мог завершиться, пока шло распознавание
+        if await state.get_state() not in NewCase:
+            return True
+
+    if status == "COMPLETED":
+        # Сохраняем результат и обновляем статус
+        ocr_data = result.get("data", {})
+        await _update_uploaded_docs(
+            state,
+            {doc_type: {"task_id": task_id, "status": "COMPLETED", "data": ocr_data}},
+            same_task=True,
+            last_ocr_result=ocr_data,
+        )
         
-        result = await api_client.get_ocr_task_status(user_id=user_id, task_id=task_id)
+        # Показываем результат пользователю для верификации
+        verification_message = "✅ Распознавание завершено! Проверьте данные:\n\n"
+        for key, value in ocr_data.items():
+            verification_message += f"<b>{quote(FIELD_MAP.get(key, key))}:</b> {quote(value)}\n"
         
-        if result and result.get("status") == "COMPLETED":
-            data_from_fsm = await state.get_data()
-            uploaded_docs = data_from_fsm.get("uploaded_docs", {})
-            
-            # Сохраняем результат и обновляем статус
-            ocr_data = result.get("data", {})
-            uploaded_docs[doc_type] = {"task_id": task_id, "status": "COMPLETED", "data": ocr_data}
-            await state.update_data(uploaded_docs=uploaded_docs, last_ocr_result=ocr_data)
-            
-            # Показываем результат пользователю для верификации
-            verification_message = "✅ Распознавание завершено! Проверьте данные:\n\n"
-            for key, value in ocr_data.items():
-                verification_message += f"<b>{FIELD_MAP.get(key, key)}:</b> {value}\n"
-            
-            await bot.send_message(
-                chat_id,
-                verification_message,
-                reply_markup=get_verification_keyboard()
-            )
-            await state.set_state(NewCase.verifying_document_data)
-            return # Выходим из цикла и задачи
-
-        elif result and result.get("status") == "FAILED":
-            data_from_fsm = await state.get_data()
-            uploaded_docs = data_from_fsm.get("uploaded_docs", {})
-            uploaded_docs[doc_type]["status"] = "FAILED"
-            await state.update_data(uploaded_docs=uploaded_docs)
-            
-            error_detail = result.get("error", {}).get("detail", "Неизвестная ошибка")
-            await bot.send_message(chat_id, f"❌ К сожалению, не удалось распознать данные с документа '{doc_type}'. Ошибка: {error_detail}")
-            # Обновляем клавиатуру, чтобы показать ошибку
-            required_docs = data_from_fsm.get("required_docs", [])
-            await bot.send_message(chat_id, "Попробуйте загрузить его снова или выберите другой документ.", reply_markup=get_document_upload_keyboard(required_docs, uploaded_docs))
-            return
+        await bot.send_message(
+            chat_id,
+            verification_message,
+            reply_markup=get_verification_keyboard()
+        )
+        await state.set_state(NewCase.verifying_document_data)
+        return True
+
+    if status == "FAILED":
+        uploaded_docs = await _update_uploaded_docs(
+            state, {doc_type: {"task_id": task_id, "status": "FAILED"}}, same_task=True
+        )
+        data_from_fsm = await state.get_data()
+
+        error_detail = (result.get("error") or {}).get("detail", "Неизвестная ошибка")
+        await bot.send_message(chat_id, f"❌ К сожалению, не удалось распознать данные с документа '{quote(doc_type)}'. Ошибка: {quote(error_detail)}")
+        # Обновляем клавиатуру, чтобы показать ошибку
+        required_docs = data_from_fsm.get("required_docs", [])
+        await bot.send_message(chat_id, "Попробуйте загрузить его снова или выберите другой документ.", reply_markup=get_document_upload_keyboard(required_docs, uploaded_docs))
+        return True
+
+    # Предупреждаем один раз, что обработка идет дольше обычного, и продолжаем опрос
+    if not job.meta.get("slow_notice_sent") and job.age >= settings.ocr_poll_slow_notice:
+        job.meta["slow_notice_sent"] = True
+        await bot.send_message(chat_id, f"⏳ Обработка документа '{quote(doc_type)}' затягивается. Я сообщу, когда будет готово. Вы можете продолжать.")
+    return False
+
+
+def build_case_watch_job(descriptor: dict, bot: Bot, storage: BaseStorage) -> PollJob:
+    """Строит задачу ожидания решения по делу."""
+    user_id, chat_id, case_id = descriptor["user_id"], descriptor["chat_id"], descriptor["case_id"]
+
+    async def poll(job: PollJob) -> bool:
+        return await check_case_decision(user_id, chat_id, case_id, bot)
+
+    async def on_expire(job: PollJob):
+        await bot.send_message(
+            chat_id,
+            f"⏳ Решение по делу #{case_id} пока не готово. Проверьте статус позже через меню."
+        )
+
+    return PollJob(
+        key=case_id,
+        poll=poll,
+        owner=user_id,
+        initial_delay=settings.case_watch_initial_delay,
+        max_delay=settings.case_watch_max_delay,
+        backoff_factor=settings.case_watch_backoff_factor,
+        max_wait=settings.case_watch_max_wait,
+        on_expire=on_expire,
+    )
+
+
+# Ожидание решения не привязано к сценарию и переживает перезапуск бота
+poll_jobs.register("case", case_poller, build_case_watch_job, persistent=True)
+
+
+async def check_case_decision(user_id: int, chat_id: int, case_id: int, bot: Bot) -> bool:
+    """Один опрос статуса дела. Возвращает True, когда решение доставлено или ждать нечего."""
+    result = await api_client.get_case_processing_status(user_id=user_id, case_id=case_id)
+    if not result:
+        return False
+    if result.get("error") == "not_found":
+        # Дело удалено
+        return True
+    status = result.get("final_status")
+    if "error" in result or not status or status == "PROCESSING":
+        return False
+
+    text = f"🔔 <b>Решение по делу #{case_id}</b>\n\nСтатус: {quote(status)}"
+    explanation = result.get("explanation")
+    if explanation and explanation.lower() != 'нет':
+        text += f"\nПояснение:\n{format_rag_explanation(explanation)}"
+    if error_info := result.get("error_info"):
+        text += f"\nОшибка: {quote(error_info.get('message') or 'Неизвестная ошибка')}"
+    for part in split_long_message(text):
+        await bot.send_message(chat_id, part)
+    # В кешированной истории дело все еще в статусе PROCESSING
+    history_cache.invalidate(user_id)
+    return True
+
+
+async def check_ocr_album_status(
+    job: PollJob, user_id: int, chat_id: int, tasks: list[dict], state: FSMContext, bot: Bot
+) -> bool:
+    """Один опрос всех еще не готовых задач альбома. Возвращает True, когда готовы все."""
+    results: dict = job.meta.setdefault("results", {})
+    pending = [task["task_id"] for task in tasks if task["task_id"] not in results]
+    statuses = await asyncio.gather(
+        *(api_client.get_ocr_task_status(user_id=user_id, task_id=task_id) for task_id in pending)
+    )
+    for task_id, result in zip(pending, statuses):
+        if result and result.get("status") in ("COMPLETED", "FAILED"):
+            results[task_id] = result
+
+    if len(results) < len(tasks):
+        if not job.meta.get("slow_notice_sent") and job.age >= settings.ocr_poll_slow_notice:
+            job.meta["slow_notice_sent"] = True
+            await bot.send_message(chat_id, "⏳ Обработка документов из альбома затягивается. Я сообщу, когда все будет готово. Вы можете продолжать.")
+        return False
+
+    await finish_ocr_album(chat_id, tasks, results, state, bot)
+    return True
+
+
+def _merge_pages(pages: list[dict]) -> dict:
+    """Объединяет данные страниц документа: списки (записи трудовой) склеиваются, остальное берется с первой страницы, где оно есть."""
+    merged: dict = {}
+    for page in pages:
+        for key, value in page.items():
+            if isinstance(value, list) and isinstance(merged.get(key), list):
+                merged[key] = merged[key] + value
+            elif not merged.get(key):
+                merged[key] = value
+    return merged
+
+
+async def finish_ocr_album(chat_id: int, tasks: list[dict], results: dict, state: FSMContext, bot: Bot):
+    """
+    Показывает результаты альбома одним сообщением. Задачи без результата
+    (опрос истек) считаются неудачными. Если распознан хотя бы один документ,
+    пользователь проверяет все распознанные данные сразу.
+    """
+    # Сценарий мог завершиться, пока шло распознавание
+    if await state.get_state() not in NewCase:
+        return
+    data = await state.get_data()
+    uploaded_docs = data.get("uploaded_docs", {})
+    required_docs = data.get("required_docs", [])
+    names = {doc["ocr_type"]: doc.get("name") or doc["ocr_type"] for doc in _album_doc_options(required_docs)}
+
+    pages: dict[str, list[str]] = {}
+    for task in tasks:
+        pages.setdefault(task["doc_type"], []).append(task["task_id"])
+
+    sections, failures, recognized, finished = [], [], [], {}
+    for doc_type, task_ids in pages.items():
+        doc_info = uploaded_docs.get(doc_type) or {}
+        if doc_info.get("task_ids") != task_ids:
+            # Документ уже загрузили заново, результат альбома для него устарел
+            continue
+        page_results = [results.get(task_id) for task_id in task_ids]
+        name = quote(names.get(doc_type, doc_type))
+        if all(result and result.get("status") == "COMPLETED" for result in page_results):
+            ocr_data = _merge_pages([result.get("data") or {} for result in page_results])
+            finished[doc_type] = {**doc_info, "status": "COMPLETED", "data": ocr_data}
+            recognized.append(ocr_data)
+            lines = [f"<b>{name}</b>"]
+            lines += [f"<b>{quote(FIELD_MAP.get(key, key))}:</b> {quote(value)}" for key, value in ocr_data.items()]
+            sections.append("\n".join(lines))
+        else:
+            finished[doc_type] = {**doc_info, "status": "FAILED"}
+            failed = next((result for result in page_results if result and result.get("status") == "FAILED"), None)
+            detail = (failed.get("error") or {}).get("detail", "Неизвестная ошибка") if failed else "не удалось дождаться результата"
+            failures.append(f"❌ {name}: {quote(detail)}")
+
+    if not sections and not failures:
+        return
 
-    # Если вышли из цикла по таймауту
-    await bot.send_message(chat_id, f"⏳ Обработка документа '{doc_type}' затягивается. Я сообщу, когда будет готово. Вы можете продолжать.")
+    if recognized:
+        # Поля личных данных берутся из первого документа, где они есть
+        last_ocr_result = _merge_pages(recognized)
+        await _update_uploaded_docs(state, finished, same_task=True, last_ocr_result=last_ocr_result)
+        text = "✅ Распознавание документов из альбома завершено! Проверьте данные:\n\n" + "\n\n".join(sections)
+        if failures:
+            text += "\n\n" + "\n".join(failures)
+        parts = split_long_message(text)
+        for part in parts[:-1]:
+            await bot.send_message(chat_id, part)
+        await bot.send_message(chat_id, parts[-1], reply_markup=get_verification_keyboard())
+        await state.set_state(NewCase.verifying_document_data)
+    else:
+        uploaded_docs = await _update_uploaded_docs(state, finished, same_task=True)
+        await bot.send_message(
+            chat_id,
+            "К сожалению, не удалось распознать документы из альбома:\n" + "\n".join(failures)
+            + "\n\nПопробуйте загрузить их снова или выберите другой документ.",
+            reply_markup=get_document_upload_keyboard(required_docs, uploaded_docs)
+        )
+
+
+async def handle_ocr_poll_expired(chat_id: int, task_id: str, doc_type: str, state: FSMContext, bot: Bot):
+    """Вызывается, если результат OCR так и не был получен."""
+    data_from_fsm = await state.get_data()
+    uploaded_docs = data_from_fsm.get("uploaded_docs", {})
+    if doc_info := uploaded_docs.get(doc_type):
+        if doc_info.get("task_id") == task_id:
+            uploaded_docs = await _update_uploaded_docs(
+                state, {doc_type: {**doc_info, "status": "FAILED"}}, same_task=True
+            )
+    await bot.send_message(
+        chat_id,
+        f"❌ Не удалось дождаться результата распознавания документа '{quote(doc_type)}'. Попробуйте загрузить его снова.",
+        reply_markup=get_document_upload_keyboard(data_from_fsm.get("required_docs", []), uploaded_docs)
+    )
 
 
 @router.callback_query(NewCase.verifying_document_data, F.data == "ocr_data_correct")
@@ -465,28 +903,28 @@ async def show_summary_and_ask_for_confirmation(message: Message, state: FSMCont
     """Показывает сводку и запрашивает подтверждение."""
     data = await state.get_data()
     
-    summary_parts = [f"<b>Тип пенсии:</b> {data.get('pension_type_name', 'Не указан')}"]
+    summary_parts = [f"<b>Тип пенсии:</b> {quote(data.get('pension_type_name', 'Не указан'))}"]
     
     summary_parts.append("\n<b>Персональные данные:</b>")
-    summary_parts.append(f"  ФИО: {data.get('last_name', '')} {data.get('first_name', '')} {data.get('middle_name', 'Нет')}")
-    summary_parts.append(f"  Дата рождения: {data.get('birth_date', 'Не указана')}")
-    summary_parts.append(f"  СНИЛС: {data.get('snils', 'Не указан')}")
-    summary_parts.append(f"  Пол: {data.get('gender', 'Не указан')}")
-    summary_parts.append(f"  Гражданство: {data.get('citizenship', 'Не указано')}")
-    summary_parts.append(f"  Иждивенцы: {data.get('dependents', 'Не указано')}")
+    summary_parts.append(f"  ФИО: {quote(data.get('last_name', ''))} {quote(data.get('first_name', ''))} {quote(data.get('middle_name', 'Нет'))}")
+    summary_parts.append(f"  Дата рождения: {quote(data.get('birth_date', 'Не указана'))}")
+    summary_parts.append(f"  СНИЛС: {quote(data.get('snils', 'Не указан'))}")
+    summary_parts.append(f"  Пол: {quote(data.get('gender', 'Не указан'))}")
+    summary_parts.append(f"  Гражданство: {quote(data.get('citizenship', 'Не указано'))}")
+    summary_parts.append(f"  Иждивенцы: {quote(data.get('dependents', 'Не указано'))}")
 
     if data.get('disability_group'):
         summary_parts.append("\n<b>Инвалидность:</b>")
-        summary_parts.append(f"  Группа: {data.get('disability_group')}")
-        summary_parts.append(f"  Дата установления: {data.get('disability_date')}")
-        summary_parts.append(f"  Номер справки: {data.get('disability_cert_number', 'Отсутствует')}")
+        summary_parts.append(f"  Группа: {quote(data.get('disability_group'))}")
+        summary_parts.append(f"  Дата установления: {quote(data.get('disability_date'))}")
+        summary_parts.append(f"  Номер справки: {quote(data.get('disability_cert_number', 'Отсутствует'))}")
         
     if data.get('work_experience_total_years') is not None:
         summary_parts.append("\n<b>Трудовой стаж:</b>")
-        summary_parts.append(f"  Общий стаж: {data.get('work_experience_total_years')} лет")
+        summary_parts.append(f"  Общий стаж: {quote(data.get('work_experience_total_years'))} лет")
 
     if data.get('pension_points') is not None:
-        summary_parts.append(f"\n<b>Пенсионные баллы (ИПК):</b> {data.get('pension_points')}")
+        summary_parts.append(f"\n<b>Пенсионные баллы (ИПК):</b> {quote(data.get('pension_points'))}")
         
     summary_text = "\n".join(summary_parts)
     
@@ -500,6 +938,7 @@ async def show_summary_and_ask_for_confirmation(message: Message, state: FSMCont
 @router.callback_query(NewCase.confirming_case_creation, F.data == "cancel_creation")
 async def handle_cancel_creation(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Создание дела отменено.")
+    await poll_jobs.cancel_owner(callback.from_user.id, kind="ocr")
     await state.clear()
 
 
@@ -546,14 +985,24 @@ async def handle_confirm_creation(callback: CallbackQuery, state: FSMContext):
     if result and result.get("case_id"):
         await callback.message.answer(
             f"✅ Дело успешно создано! Его номер: <b>{result['case_id']}</b>\n"
-            f"Статус: {result.get('final_status', 'N/A')}\n"
-            f"Пояснение: {result.get('explanation', 'Нет')}"
+            f"Статус: {quote(result.get('final_status', 'N/A'))}\n"
+            f"Пояснение: {quote(result.get('explanation', 'Нет'))}"
         )
+        if result.get("final_status") == "PROCESSING":
+            # Решение RAG будет готово позже: ждем его в фоне и присылаем сами
+            await poll_jobs.submit(
+                "case",
+                key=result["case_id"],
+                owner=user_id,
+                descriptor={"user_id": user_id, "chat_id": callback.message.chat.id, "case_id": result["case_id"]},
+            )
+            await callback.message.answer("🔔 Я пришлю решение по делу, как только оно будет готово.")
     else:
         await callback.message.answer(
             "❌ Произошла ошибка при создании дела. Попробуйте позже."
         )
         
+    await poll_jobs.cancel_owner(user_id, kind="ocr")
     await state.clear()
 
 
@@ -598,8 +1047,8 @@ def format_ocr_result(result: dict) -> str:
     status = result.get("status", "НЕИЗВЕСТНО")
     task_id = result.get("task_id", "")
     
-    lines = [f"<b>Задача OCR:</b> <code>{task_id}</code>"]
-    lines.append(f"<b>Статус:</b> {status}")
+    lines = [f"<b>Задача OCR:</b> <code>{quote(task_id)}</code>"]
+    lines.append(f"<b>Статус:</b> {quote(status)}")
     
     if status == "COMPLETED" and result.get("data"):
         lines.append("\n<b>Извлеченные данные:</b>")
@@ -608,104 +1057,75 @@ def format_ocr_result(result: dict) -> str:
             if not value:  # Пропускаем пустые значения
                 continue
             
-            display_name = FIELD_MAP.get(key, key)
+            display_name = quote(FIELD_MAP.get(key, key))
             
             if isinstance(value, list) and key == "records":
                 lines.append(f"  <b>{display_name}:</b>")
                 for item in value:
                     record_line = ", ".join(
-                        f"{FIELD_MAP.get(k, k)}: {v}" for k, v in item.items() if v
+                        f"{quote(FIELD_MAP.get(k, k))}: {quote(v)}" for k, v in item.items() if v
                     )
                     lines.append(f"    - {record_line}")
             elif isinstance(value, dict):
                 lines.append(f"  <b>{display_name}:</b>")
                 for sub_key, sub_value in value.items():
-                    lines.append(f"    - {sub_key}: {sub_value}")
+                    lines.append(f"    - {quote(sub_key)}: {quote(sub_value)}")
             else:
-                lines.append(f"  <b>{display_name}:</b> {value}")
+                lines.append(f"  <b>{display_name}:</b> {quote(value)}")
             
     elif status == "FAILED" and result.get("error"):
-        lines.append(f"<b>Ошибка:</b> {result['error'].get('detail', 'Неизвестная ошибка')}")
+        lines.append(f"<b>Ошибка:</b> {quote(result['error'].get('detail', 'Неизвестная ошибка'))}")
         
     return "\n".join(lines)
 
 def format_rag_explanation(text: str) -> str:
-    """
-    Форматирует текст от RAG в HTML для Telegram, поддерживая разные маркеры.
-    """
-    if not text:
-        return "Нет"
-
-    # 1. Замена разделителей
-    text = text.replace('---', '\n')
-
-    lines = text.split('\n')
-    processed_lines = []
-
-    for line in lines:
-        stripped_line = line.lstrip()
-        indent_space = ' ' * (len(line) - len(stripped_line))
-
-        # 2. Убираем маркеры заголовков ###
-        if stripped_line.startswith('###'):
-            processed_line = indent_space + stripped_line.replace('###', '').lstrip()
-            processed_lines.append(processed_line)
-            continue
-            
-        # 3. Обрабатываем маркеры списков " - " или "* "
-        if stripped_line.startswith('- ') or stripped_line.startswith('* '):
-            # Заменяем дефис/звездочку на "•" и сохраняем отступ
-            processed_line = indent_space + '• ' + stripped_line[2:]
-            processed_lines.append(processed_line)
-            continue
-            
-        # 4. Для строк, не требующих обработки
-        processed_lines.append(line)
-
-    final_text = '\n'.join(processed_lines)
-    
-    # 5. Обработка старого формата жирного текста **text** для обратной совместимости
-    final_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', final_text)
-
-    return final_text
+    """Форматирует текст от RAG в HTML для Telegram."""
+    return render_rag_html(text)
 
 
 @router.message(CheckStatus.entering_id, F.text)
 async def handle_id_for_status_check(message: Message, state: FSMContext, bot: Bot):
     entity_id = message.text
     user_id = message.from_user.id
-    await message.answer(f"Ищу информацию по ID: <code>{entity_id}</code>...")
+    progress = ProgressMessage(message)
+    progress.update(f"Ищу информацию по ID: <code>{quote(entity_id)}</code>...")
 
     # 1. Проверяем, не ID ли это OCR задачи
     ocr_result = await api_client.get_ocr_task_status(user_id=user_id, task_id=entity_id)
     if ocr_result and ocr_result.get("error") != "not_found":
         formatted_text = format_ocr_result(ocr_result)
-        await message.answer(formatted_text)
+        await progress.finish(formatted_text)
         await state.clear()
         return
 
     # 2. Если не OCR, проверяем, не ID ли это дела
     if entity_id.isdigit():
         case_result = await api_client.get_case_status(user_id=user_id, case_id=int(entity_id))
-        if case_result and case_result.get("error") != "not_found":
-            
-            status_text = f"Статус дела: {case_result.get('final_status')}"
-            explanation = case_result.get('final_explanation')
-
-            if explanation and explanation.lower() != 'нет':
-                formatted_explanation = format_rag_explanation(explanation)
-                status_text += f"\nПояснение:\n{formatted_explanation}"
-            
-            # Разбиваем сообщение на части, если оно слишком длинное
-            message_parts = split_long_message(status_text)
-            for part in message_parts:
+        # Ошибки (в том числе отказ в доступе) не показываются как статус дела
+        if case_result and "error" not in case_result:
+
+            def render() -> list[str]:
+                status_text = f"Статус дела: {quote(case_result.get('final_status'))}"
+                explanation = case_result.get('final_explanation')
+
+                if explanation and explanation.lower() != 'нет':
+                    formatted_explanation = format_rag_explanation(explanation)
+                    status_text += f"\nПояснение:\n{formatted_explanation}"
+                
+                # Разбиваем сообщение на части, если оно слишком длинное
+                return split_long_message(status_text)
+
+            scope = await api_client.auth_scope(user_id)
+            message_parts = case_cache.render(int(entity_id), scope, "status", render)
+            await progress.finish(message_parts[0])
+            for part in message_parts[1:]:
                 await message.answer(part)
 
             await state.clear()
             return
 
     # 3. Если ничего не найдено
-    await message.answer(f"Не удалось найти дело или OCR задачу с ID: {entity_id}")
+    await progress.finish(f"Не удалось найти дело или OCR задачу с ID: {quote(entity_id)}")
     await state.clear() 
 
 # Устаревшая логика, которая вызывает ошибку
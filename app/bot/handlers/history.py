@@ -3,11 +3,16 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery
 
 from app.api.client import api_client
+from app.bot.formatting import quote, render_rag_html, split_long_message
 from app.bot.keyboards import get_case_history_keyboard, get_case_details_keyboard
-from app.bot.utils import split_long_message
+from app.bot.progress import ProgressMessage
+from app.bot.utils import send_case_document
+from app.services.case_cache import case_cache
 
 router = Router()
 
+HISTORY_PAGE_SIZE = 5
+
 
 @router.callback_query(F.data == "case_history")
 async def handle_case_history(callback: CallbackQuery, state: FSMContext):
@@ -15,21 +20,24 @@ async def handle_case_history(callback: CallbackQuery, state: FSMContext):
     Обрабатывает нажатие на кнопку 'Моя история дел'.
     Запрашивает историю дел пользователя и выводит ее.
     """
-    await callback.message.edit_text("Запрашиваю вашу историю дел...")
+    user_id = callback.from_user.id
+    # Промежуточный текст появится, только если страницу придется ждать
+    progress = ProgressMessage(callback.message, edit=True)
+    progress.update("Запрашиваю вашу историю дел...")
     
     history_data = await api_client.get_case_history(
-        user_id=callback.from_user.id,
-        limit=5,
-        offset=0
+        user_id=user_id,
+        limit=HISTORY_PAGE_SIZE,
+        skip=0
     )
     
-    if history_data: # Проверяем, что список не пустой
-        await callback.message.edit_text(
-            "Ваши последние 5 дел:",
-            reply_markup=get_case_history_keyboard(history_data, limit=5, current_offset=0)
+    if isinstance(history_data, list) and history_data: # Проверяем, что список не пустой
+        await progress.finish(
+            f"Ваши последние {HISTORY_PAGE_SIZE} дел:",
+            reply_markup=get_case_history_keyboard(history_data, limit=HISTORY_PAGE_SIZE, current_offset=0)
         )
     else:
-        await callback.message.edit_text("Не удалось найти историю ваших дел или у вас их еще нет.")
+        await progress.finish("Не удалось найти историю ваших дел или у вас их еще нет.")
         
     await callback.answer()
 
@@ -37,24 +45,25 @@ async def handle_case_history(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("history_page:"))
 async def handle_history_pagination(callback: CallbackQuery, state: FSMContext):
     """Обрабатывает переключение страниц в истории дел."""
-    offset = int(callback.data.split(":")[1])
-    limit = 5 # Константа, как и в первом запросе
-    
-    await callback.message.edit_text("Загружаю...")
+    skip = int(callback.data.split(":")[1])
+    user_id = callback.from_user.id
+    progress = ProgressMessage(callback.message, edit=True)
+    progress.update("Загружаю...")
     
     history_data = await api_client.get_case_history(
-        user_id=callback.from_user.id,
-        limit=limit,
-        offset=offset
+        user_id=user_id,
+        limit=HISTORY_PAGE_SIZE,
+        skip=skip
     )
     
-    if history_data: # Проверяем, что список не пустой
-        await callback.message.edit_text(
-            "Ваши последние 5 дел:",
-            reply_markup=get_case_history_keyboard(history_data, limit=limit, current_offset=offset)
+    if isinstance(history_data, list) and history_data: # Проверяем, что список не пустой
+        # Страницы отличаются только клавиатурой, поэтому текст обычно не редактируется
+        await progress.finish(
+            f"Ваши последние {HISTORY_PAGE_SIZE} дел:",
+            reply_markup=get_case_history_keyboard(history_data, limit=HISTORY_PAGE_SIZE, current_offset=skip)
         )
     else:
-        await callback.message.edit_text("Больше дел не найдено.")
+        await progress.finish("Больше дел не найдено.")
         
     await callback.answer()
 
@@ -64,26 +73,29 @@ async def handle_view_case_details(callback: CallbackQuery, state: FSMContext, b
     """Показывает детальную информацию по конкретному делу."""
     case_id = int(callback.data.split(":")[1])
     
-    await callback.message.edit_text(f"Загружаю информацию по делу #{case_id}...")
+    progress = ProgressMessage(callback.message, edit=True)
+    progress.update(f"Загружаю информацию по делу #{case_id}...")
     
     case_details = await api_client.get_case_status(user_id=callback.from_user.id, case_id=case_id)
     
     if case_details and "error" not in case_details:
-        # Используем существующий форматер из case_management для красивого вывода
-        from .case_management import format_rag_explanation
-        
-        explanation = case_details.get('final_explanation')
-        details_text = f"<b>Дело #{case_id}</b>\n\nСтатус: {case_details.get('final_status')}"
-        
-        if explanation and explanation.lower() != 'нет':
-            formatted_explanation = format_rag_explanation(explanation)
-            details_text += f"\nПояснение:\n{formatted_explanation}"
-        
-        message_parts = split_long_message(details_text)
+        def render() -> list[str]:
+            explanation = case_details.get('final_explanation')
+            details_text = f"<b>Дело #{case_id}</b>\n\nСтатус: {quote(case_details.get('final_status'))}"
+            
+            if explanation and explanation.lower() != 'нет':
+                formatted_explanation = render_rag_html(explanation)
+                details_text += f"\nПояснение:\n{formatted_explanation}"
+            
+            return split_long_message(details_text)
+
+        # Для дел с окончательным решением части сообщения берутся готовыми из кеша
+        scope = await api_client.auth_scope(callback.from_user.id)
+        message_parts = case_cache.render(case_id, scope, "details", render)
 
         # Редактируем исходное сообщение первой частью текста
-        await callback.message.edit_text(
-            text=message_parts[0],
+        await progress.finish(
+            message_parts[0],
             reply_markup=get_case_details_keyboard(case_id) if len(message_parts) == 1 else None
         )
 
@@ -98,15 +110,25 @@ async def handle_view_case_details(callback: CallbackQuery, state: FSMContext, b
                     reply_markup=reply_markup
                 )
     else:
-        await callback.message.edit_text(f"Не удалось получить информацию по делу #{case_id}.")
+        await progress.finish(f"Не удалось получить информацию по делу #{case_id}.")
         
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("download_doc:"))
-async def handle_download_document(callback: CallbackQuery, state: FSMContext):
-    """Обработчик для скачивания документов (заглушка)."""
+async def handle_download_document(callback: CallbackQuery, state: FSMContext, bot: Bot):
+    """Отправляет документ с решением по делу в формате PDF или DOCX."""
     case_id, doc_format = callback.data.split(":")[1].split("_")
-    
-    await callback.message.answer(f"Функция скачивания дела #{case_id} в формате {doc_format} пока не реализована.")
-    await callback.answer() 
\ No newline at end of file
+    case_id = int(case_id)
+
+    # Ответ на нажатие сразу: загрузка большого файла может занять время
+    await callback.answer("Готовлю документ...")
+    error = await send_case_document(
+        bot, chat_id=callback.message.chat.id, user_id=callback.from_user.id, case_id=case_id, doc_format=doc_format
+    )
+    if error is None:
+        return
+    if error.get("error") == "not_found":
+        await callback.message.answer(f"Документ по делу #{case_id} еще не готов или не найден.")
+    else:
+        await callback.message.answer(f"Не удалось получить документ по делу #{case_id}. Попробуйте позже.")
@@ -1,12 +1,12 @@
-from io import BytesIO
-
 from aiogram import F, Router, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, PhotoSize
 
-from app.api.client import api_client
+from app.bot.formatting import quote
 from app.bot.keyboards import get_ocr_doc_type_keyboard
+from app.bot.progress import ProgressMessage
 from app.bot.states import Ocr
+from app.bot.utils import FileTooLargeError, submit_photo_for_ocr
 
 router = Router()
 
@@ -25,7 +25,7 @@ async def handle_ocr_type_chosen(callback: CallbackQuery, state: FSMContext):
     doc_type = callback.data.split(":")[1]
     await state.update_data(doc_type=doc_type)
 
-    await callback.message.edit_text(f"Вы выбрали: {doc_type}.")
+    await callback.message.edit_text(f"Вы выбрали: {quote(doc_type)}.")
     await callback.message.answer("Теперь, пожалуйста, отправьте мне фотографию документа.")
     await callback.answer()
     
@@ -34,30 +34,40 @@ async def handle_ocr_type_chosen(callback: CallbackQuery, state: FSMContext):
 
 @router.message(Ocr.uploading_document, F.photo)
 async def handle_document_photo(message: Message, state: FSMContext, bot: Bot):
-    await message.answer("Фото получено! Скачиваю и отправляю на сервер...")
+    # Промежуточный текст и итог — одно сообщение; если отправка быстрая, сразу итог
+    progress = ProgressMessage(message)
+    progress.update("Фото получено! Отправляю на сервер...")
 
     photo: PhotoSize = message.photo[-1]
-    image_bytes = BytesIO()
-    await bot.download(file=photo.file_id, destination=image_bytes)
-    image_bytes.seek(0) # Возвращаем курсор в начало файла
-
     data = await state.get_data()
     doc_type = data.get("doc_type")
 
-    result = await api_client.submit_document_for_extraction(
-        doc_type=doc_type,
-        image_bytes=image_bytes,
-        filename=f"{photo.file_id}.jpg"
-    )
+    try:
+        result = await submit_photo_for_ocr(
+            bot,
+            user_id=message.from_user.id,
+            file_id=photo.file_id,
+            document_type=doc_type,
+            file_unique_id=photo.file_unique_id,
+            max_side=max(photo.width, photo.height),
+        )
+    except FileTooLargeError:
+        await progress.finish("❌ Фото больше 10 МБ. Пожалуйста, отправьте изображение меньшего размера.")
+        return
 
-    if result and result.get("task_id"):
-        await message.answer(
+    if result and result.get("cached"):
+        await progress.finish(
+            f"✅ Этот документ уже распознан, повторная обработка не нужна.\n"
+            f"<b>ID задачи с результатом:</b> <code>{quote(result['task_id'])}</code>"
+        )
+    elif result and result.get("task_id"):
+        await progress.finish(
             f"✅ Документ успешно отправлен в обработку!\n"
-            f"<b>ID вашей задачи:</b> <code>{result['task_id']}</code>\n\n"
+            f"<b>ID вашей задачи:</b> <code>{quote(result['task_id'])}</code>\n\n"
             f"Вы сможете проверить статус позже."
             # TODO: Добавить кнопку для проверки статуса
         )
     else:
-        await message.answer("❌ Произошла ошибка при отправке документа. Попробуйте еще раз.")
+        await progress.finish("❌ Произошла ошибка при отправке документа. Попробуйте еще раз.")
 
-    await state.clear() 
\ No newline at end of file
+    await state.clear()
@@ -6,8 +6,41 @@ from aiogram.types import (
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Callable, Optional, TypeVar, Union
 
+Markup = TypeVar("Markup", ReplyKeyboardMarkup, InlineKeyboardMarkup)
 
+# Статус загрузки документа -> значок на кнопке
+_UPLOAD_STATUS_ICONS = {"PROCESSING": " ⏳", "COMPLETED": " ✅", "FAILED": " ❌"}
+
+
+def _prebuilt(build: Callable[[], Markup]) -> Callable[[], Markup]:
+    """
+    Строит статическую клавиатуру один раз при импорте: все вызовы получают один
+    и тот же объект, поэтому изменять возвращенную клавиатуру нельзя.
+    """
+    markup = build()
+
+    @wraps(build)
+    def get() -> Markup:
+        return markup
+
+    return get
+
+
+def markup_signature(markup: Optional[Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]]) -> Optional[tuple]:
+    """
+    Содержимое клавиатуры для сравнения. Клавиатура из полученного сообщения
+    хранит ссылку на бота, поэтому сравнивать объекты через == нельзя.
+    """
+    if markup is None:
+        return None
+    rows = markup.inline_keyboard if isinstance(markup, InlineKeyboardMarkup) else markup.keyboard
+    return tuple(tuple(button.model_dump_json(exclude_none=True) for button in row) for row in rows)
+
+
+@_prebuilt
 def get_yes_no_keyboard() -> ReplyKeyboardMarkup:
     """Возвращает клавиатуру с кнопками 'Да' и 'Нет'."""
     builder = ReplyKeyboardBuilder()
@@ -18,6 +51,7 @@ def get_yes_no_keyboard() -> ReplyKeyboardMarkup:
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
 
+@_prebuilt
 def get_data_input_method_keyboard() -> ReplyKeyboardMarkup:
     """Возвращает клавиатуру с выбором способа ввода данных."""
     builder = ReplyKeyboardBuilder()
@@ -28,19 +62,6 @@ def get_data_input_method_keyboard() -> ReplyKeyboardMarkup:
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=True)
 
 
-def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
-    """Возвращает клавиатуру главного меню."""
-    builder = ReplyKeyboardBuilder()
-    builder.row(
-        KeyboardButton(text="Создать новое дело"),
-        KeyboardButton(text="Проверить статус дела"),
-    )
-    builder.row(KeyboardButton(text="Распознать документ"))
-    # Можно добавить другие кнопки, например, "Мои дела" или "Помощь"
-    # builder.row(KeyboardButton(text="Помощь"))
-    return builder.as_markup(resize_keyboard=True)
-
-
 def get_pension_types_keyboard(
     pension_types: list[dict],
 ) -> InlineKeyboardMarkup:
@@ -56,6 +77,7 @@ def get_pension_types_keyboard(
     return builder.as_markup()
 
 
+@lru_cache(maxsize=32)
 def get_skip_keyboard(text: str) -> InlineKeyboardMarkup:
     """Возвращает клавиатуру с одной кнопкой для пропуска шага."""
     builder = InlineKeyboardBuilder()
@@ -63,6 +85,7 @@ def get_skip_keyboard(text: str) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_prebuilt
 def get_gender_keyboard() -> InlineKeyboardMarkup:
     """Возвращает клавиатуру для выбора пола."""
     builder = InlineKeyboardBuilder()
@@ -73,6 +96,7 @@ def get_gender_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_prebuilt
 def get_ocr_doc_type_keyboard() -> InlineKeyboardMarkup:
     """Возвращает клавиатуру для выбора типа документа для OCR."""
     buttons = {
@@ -89,7 +113,8 @@ def get_ocr_doc_type_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_main_menu_keyboard():
+@_prebuilt
+def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     """Возвращает клавиатуру главного меню."""
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -109,31 +134,23 @@ def get_document_upload_keyboard(
     required_docs: list, uploaded_docs: dict = None
 ) -> InlineKeyboardMarkup:
     """
-    Создает клавиатуру для управления загрузкой документов.
-    Динамически обновляет статус каждой кнопки.
+    Создает клавиатуру для управления загрузкой документов со статусом каждого
+    документа на кнопке. Готовые клавиатуры кешируются по составу документов
+    (для типа пенсии он один и тот же) и вектору статусов загрузки.
     """
-    if uploaded_docs is None:
-        uploaded_docs = {}
-        
-    builder = InlineKeyboardBuilder()
-    
-    for doc in required_docs:
-        doc_type = doc.get("ocr_type")
-        doc_name = doc.get("name")
-        
-        status_icon = ""
-        if doc_info := uploaded_docs.get(doc_type):
-            status = doc_info.get("status")
-            if status == "PROCESSING":
-                status_icon = " ⏳"
-            elif status == "COMPLETED":
-                status_icon = " ✅"
-            elif status == "FAILED":
-                status_icon = " ❌"
+    uploaded_docs = uploaded_docs or {}
+    layout = tuple((doc.get("ocr_type"), doc.get("name"), bool(doc.get("is_critical"))) for doc in required_docs)
+    statuses = tuple((uploaded_docs.get(doc_type) or {}).get("status") for doc_type, _, _ in layout)
+    return _build_document_upload_keyboard(layout, statuses)
 
+
+@lru_cache(maxsize=1024)
+def _build_document_upload_keyboard(layout: tuple, statuses: tuple) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for (doc_type, doc_name, _), status in zip(layout, statuses):
         builder.row(
             InlineKeyboardButton(
-                text=f"📸 {doc_name}{status_icon}",
+                text=f"📸 {doc_name}{_UPLOAD_STATUS_ICONS.get(status, '')}",
                 callback_data=f"upload_doc:{doc_type}"
             )
         )
@@ -144,17 +161,12 @@ def get_document_upload_keyboard(
         )
     )
     
-    # Кнопку "Далее" показываем, только если все критичные документы загружены
-    all_critical_done = True
-    for doc in required_docs:
-        if doc.get('is_critical'):
-            doc_type = doc.get("ocr_type")
-            if doc_type not in uploaded_docs or uploaded_docs[doc_type].get("status") != "COMPLETED":
-                all_critical_done = False
-                break
-    
+    # Кнопку "Далее" показываем, только если все критичные документы распознаны
+    all_critical_done = all(
+        status == "COMPLETED" for (_, _, is_critical), status in zip(layout, statuses) if is_critical
+    )
     if all_critical_done:
-         builder.row(
+        builder.row(
             InlineKeyboardButton(
                 text="➡️ Далее", callback_data="docs_upload_next_step"
             )
@@ -162,7 +174,7 @@ def get_document_upload_keyboard(
     else:
         # Можно добавить кнопку для пропуска, если это предусмотрено логикой
         builder.row(
-             InlineKeyboardButton(
+            InlineKeyboardButton(
                 text="✅ Пропустить и ввести данные вручную", callback_data="skip_doc_upload"
             )
         )
@@ -170,6 +182,25 @@ def get_document_upload_keyboard(
     return builder.as_markup()
 
 
+@lru_cache(maxsize=256)
+def get_album_mapping_keyboard(labels: tuple[str, ...]) -> InlineKeyboardMarkup:
+    """
+    Клавиатура сопоставления фото альбома с документами: нажатие на строку
+    переключает тип документа для этого фото.
+    """
+    builder = InlineKeyboardBuilder()
+    for index, label in enumerate(labels):
+        builder.row(
+            InlineKeyboardButton(text=f"🖼 Фото {index + 1}: {label}", callback_data=f"album_type:{index}")
+        )
+    builder.row(
+        InlineKeyboardButton(text="✅ Распознать все", callback_data="album_submit"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="album_cancel"),
+    )
+    return builder.as_markup()
+
+
+@_prebuilt
 def get_verification_keyboard() -> InlineKeyboardMarkup:
     """Возвращает клавиатуру для верификации распознанных данных."""
     builder = InlineKeyboardBuilder()
@@ -224,6 +255,7 @@ def get_case_history_keyboard(cases: list, limit: int, current_offset: int) -> I
     return builder.as_markup()
 
 
+@lru_cache(maxsize=1024)
 def get_case_details_keyboard(case_id: int) -> InlineKeyboardMarkup:
     """Создает клавиатуру для детального просмотра дела."""
     builder = InlineKeyboardBuilder()
@@ -241,6 +273,7 @@ def get_case_details_keyboard(case_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_prebuilt
 def get_check_ocr_keyboard() -> InlineKeyboardMarkup:
     """Возвращает клавиатуру для проверки статуса OCR."""
     builder = InlineKeyboardBuilder()
@@ -252,6 +285,7 @@ def get_check_ocr_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+@_prebuilt
 def get_confirmation_keyboard() -> InlineKeyboardMarkup:
     """Возвращает клавиатуру для подтверждения создания дела."""
     builder = InlineKeyboardBuilder()
@@ -0,0 +1,292 @@
+import asyncio
+import cProfile
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message, TelegramObject, Update
+
+from app.services.metrics import (
+    handler_duration,
+    handler_errors,
+    telegram_call_duration,
+    telegram_calls,
+    telegram_errors,
+    telegram_flood_waits,
+    telegram_outbound_wait,
+    update_duration,
+    updates_total,
+)
+from app.services.outbound import PRIORITY_NAMES, OutboundLimiter, current_priority
+from app.services.profiling import Trace, finish_trace, record, start_trace
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Считает апдейты и полное время их обработки (outer-middleware на dp.update)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        update_type = event.event_type
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            updates_total.inc(update_type)
+            update_duration.observe(time.perf_counter() - started, update_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время работы конкретного обработчика. Inner-middleware на наблюдателях
+    диспетчера применяется ко всем вложенным роутерам; роутер определяется
+    по модулю обработчика (auth, case_management, ocr, history).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        router = callback.__module__.rsplit(".", 1)[-1]
+        name = getattr(callback, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(router, name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, router, name)
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Собирает альбом (media group), который Telegram присылает отдельными
+    сообщениями: обработчик вызывается один раз, для первого сообщения, с
+    data["album"] — всеми сообщениями альбома по порядку; остальные поглощаются.
+    Альбом считается полным, если за delay не пришло новых частей.
+    Outer-middleware на dp.message; части альбома одного пользователя попадают
+    в один процесс и обрабатываются конкурентно.
+    """
+
+    def __init__(self, delay: float):
+        self._delay = delay
+        # {(чат, media_group_id): сообщения альбома}
+        self._albums: dict[tuple[int, str], list[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        if not event.media_group_id:
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(event)
+            return None
+
+        album = self._albums[key] = [event]
+        try:
+            collected = 0
+            while collected != len(album):
+                collected = len(album)
+                await asyncio.sleep(self._delay)
+        finally:
+            del self._albums[key]
+        data["album"] = sorted(album, key=lambda message: message.message_id)
+        return await handler(event, data)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Считает исходящие вызовы Bot API, ошибки и flood-wait (middleware сессии бота)."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        telegram_calls.inc(name)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            telegram_flood_waits.inc(name)
+            telegram_errors.inc(name, "TelegramRetryAfter")
+            raise
+        except Exception as e:
+            telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_call_duration.observe(time.perf_counter() - started, name)
+
+
+class OutboundRateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Пропускает исходящие сообщения через лимитер (middleware сессии бота) и
+    повторяет вызов после flood-wait, если ждать недолго. Регистрируется первым,
+    чтобы метрики и трассы ниже видели каждую попытку отдельно.
+    """
+
+    # Методы, на которые распространяются лимиты Telegram на сообщения
+    LIMITED_METHODS = frozenset({
+        "sendMessage",
+        "sendPhoto",
+        "sendDocument",
+        "sendMediaGroup",
+        "copyMessage",
+        "forwardMessage",
+        "editMessageText",
+        "editMessageCaption",
+        "editMessageReplyMarkup",
+    })
+
+    def __init__(self, limiter: OutboundLimiter, retry_attempts: int, max_retry_after: float):
+        self._limiter = limiter
+        self._retry_attempts = retry_attempts
+        self._max_retry_after = max_retry_after
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if method.__api_method__ not in self.LIMITED_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = current_priority()
+        attempt = 0
+        while True:
+            waited = await self._limiter.acquire(chat_id, priority)
+            telegram_outbound_wait.observe(waited, PRIORITY_NAMES[priority])
+            if waited:
+                record("bot.rate_limit", waited)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._limiter.block(chat_id, e.retry_after)
+                attempt += 1
+                if attempt > self._retry_attempts or e.retry_after > self._max_retry_after:
+                    raise
+                logging.warning(
+                    f"Flood wait on {method.__api_method__} to chat {chat_id}: "
+                    f"retry {attempt}/{self._retry_attempts} in {e.retry_after}s"
+                )
+
+
+class ProfilingRequestMiddleware(BaseRequestMiddleware):
+    """Учитывает вызовы Bot API как шаги bot.* в трассе текущего апдейта."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record(f"bot.{method.__api_method__}", time.perf_counter() - started)
+
+
+class SlowUpdateMiddleware(BaseMiddleware):
+    """
+    Замеряет обработку каждого апдейта и пишет в лог разбивку времени по шагам
+    (bot.*, api_client.*, state.*) для апдейтов дольше порога.
+    Доля апдейтов выполняется под cProfile; профили самых медленных из них
+    сохраняются на диск. cProfile видит все корутины, работавшие в это время,
+    поэтому одновременно профилируется не больше одного апдейта.
+    """
+
+    def __init__(self, threshold: float, sample_rate: float = 0.0, profile_dir: str = "profiles", keep: int = 20):
+        self._threshold = threshold
+        self._sample_rate = sample_rate
+        self._profile_dir = profile_dir
+        self._keep = keep
+        self._profiling = False
+        # Куча (длительность, путь) сохраненных профилей: вытесняется самый быстрый
+        self._kept: list[tuple[float, str]] = []
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        trace, token = start_trace()
+        profiler = None
+        if self._sample_rate and not self._profiling and random.random() < self._sample_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            return await handler(event, data)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            finish_trace(trace, token)
+            total = time.perf_counter() - trace.started
+            if total >= self._threshold:
+                self._log_slow(event, data, trace, total)
+                if profiler is not None:
+                    await self._save_profile(profiler, event, total)
+
+    def _log_slow(self, event: Update, data: dict[str, Any], trace: Trace, total: float):
+        breakdown = trace.breakdown()
+        accounted = sum(span["ms"] for span in breakdown.values())
+        user = data.get("event_from_user")
+        report = {
+            "update_id": event.update_id,
+            "type": event.event_type,
+            "user_id": user.id if user else None,
+            "total_ms": round(total * 1000, 1),
+            # Время вне отмеченных шагов: код обработчиков, ожидание event loop
+            "other_ms": round(max(0.0, total * 1000 - accounted), 1),
+            "spans": breakdown,
+        }
+        logging.warning(f"Slow update: {json.dumps(report, ensure_ascii=False)}")
+
+    async def _save_profile(self, profiler: cProfile.Profile, event: Update, total: float):
+        if len(self._kept) >= self._keep and total <= self._kept[0][0]:
+            return
+        path = os.path.join(self._profile_dir, f"{int(time.time())}_{event.update_id}_{int(total * 1000)}ms.prof")
+        evicted = heapq.heappushpop(self._kept, (total, path))[1] if len(self._kept) >= self._keep else None
+        if evicted is None:
+            heapq.heappush(self._kept, (total, path))
+        await asyncio.to_thread(self._write_profile, profiler, path, evicted)
+
+    @staticmethod
+    def _write_profile(profiler: cProfile.Profile, path: str, evicted: Optional[str]):
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            profiler.dump_stats(path)
+            if evicted:
+                os.remove(evicted)
+        except OSError as e:
+            logging.warning(f"Failed to write profile {path}: {e}")
+        else:
+            logging.info(f"Saved profile of slow update to {path}")
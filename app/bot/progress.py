@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from app.bot.utils import edit_message
+from app.config import settings
+
+
+class ProgressMessage:
+    """
+    Сообщение о ходе операции. Промежуточный текст (update) показывается, только
+    если операция длится дольше окна, и обновляется не чаще раза в окно: новая
+    правка заменяет еще не отправленную, а совпадающая с показанным текстом
+    отбрасывается. Итог (finish) показывается сразу.
+
+    С edit=True редактируется само message (сообщение бота), иначе в его чат
+    отправляется новое сообщение, которое потом редактируется.
+    """
+
+    def __init__(self, message: Message, edit: bool = False, window: Optional[float] = None):
+        self._anchor = message
+        self._current: Optional[Message] = message if edit else None
+        self._window = settings.progress_edit_window if window is None else window
+        self._ready_at = time.monotonic() + self._window
+        self._pending: Optional[tuple[str, Optional[InlineKeyboardMarkup]]] = None
+        self._timer: Optional[asyncio.Task] = None
+        # Не дает итогу обогнать уже начатую промежуточную правку
+        self._lock = asyncio.Lock()
+
+    def update(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        self._pending = (text, reply_markup)
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def finish(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """Показывает итоговый текст и возвращает сообщение с ним."""
+        self._pending = None
+        if self._timer is not None and not self._lock.locked():
+            self._timer.cancel()
+        async with self._lock:
+            await self._show(text, reply_markup)
+        return self._current
+
+    async def _flush_later(self):
+        try:
+            while self._pending is not None:
+                await asyncio.sleep(max(0.0, self._ready_at - time.monotonic()))
+                if self._pending is None:
+                    break
+                text, reply_markup = self._pending
+                self._pending = None
+                async with self._lock:
+                    await self._show(text, reply_markup)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.warning(f"Failed to update progress message: {e!r}")
+        finally:
+            self._timer = None
+
+    async def _show(self, text: str, reply_markup: Optional[InlineKeyboardMarkup]):
+        if self._current is None:
+            self._current = await self._anchor.answer(text, reply_markup=reply_markup)
+        else:
+            self._current = await edit_message(self._current, text, reply_markup)
+        self._ready_at = time.monotonic() + self._window
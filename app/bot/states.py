@@ -23,6 +23,8 @@ class NewCase(StatesGroup):
     # Управление документами
     managing_documents = State()
     uploading_document = State()
+    # Сопоставление фото из альбома с типами документов
+    mapping_album = State()
     verifying_document_data = State()
 
     # Финальное подтверждение
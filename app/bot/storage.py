@@ -0,0 +1,386 @@
+import asyncio
+import contextlib
+import copy
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.services.profiling import span
+from app.services.shared_store import SharedStore
+from app.services.single_flight import SingleFlight
+
+
+class _Record:
+    __slots__ = ("state", "data")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[dict] = None):
+        self.state = state
+        self.data = data if data is not None else {}
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Персистентное FSM-хранилище на SQLite (WAL).
+    Записи читаются лениво и держатся в горячем кеше в памяти, а изменения
+    сбрасываются на диск пачками (write-behind), чтобы каждый update_data
+    не стоил отдельной транзакции. Незавершенные сценарии переживают перезапуск бота.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.5,
+        cache_size: int = 10000,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self._path = path
+        self._flush_interval = flush_interval
+        self._cache_size = cache_size
+        self._key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._loads = SingleFlight()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Одно соединение и один поток: sqlite3 не любит конкурентный доступ к соединению
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._closed = False
+
+    # --- Работа с БД (выполняется в отдельном потоке) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _db_load(self, key: str) -> _Record:
+        row = self._connect().execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return _Record()
+        return _Record(state=row[0], data=json.loads(row[1]))
+
+    def _db_write(self, rows: list[tuple[str, Optional[str], str]]):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            for key, state, data in rows:
+                if state is None and data == "{}":
+                    conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+                else:
+                    conn.execute(
+                        "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                        "data = excluded.data, updated_at = excluded.updated_at",
+                        (key, state, data, now),
+                    )
+
+    def _db_count_states(self) -> dict[Optional[str], int]:
+        return dict(self._connect().execute("SELECT state, COUNT(*) FROM fsm GROUP BY state").fetchall())
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def count_states(self) -> dict[Optional[str], int]:
+        """Количество сессий по состояниям FSM (для метрик)."""
+        await self.flush()
+        return await self._run(self._db_count_states)
+
+    # --- Горячий кеш ---
+
+    async def _get_record(self, key: StorageKey) -> tuple[str, _Record]:
+        db_key = self._key_builder.build(key)
+        record = self._cache.get(db_key)
+        if record is None:
+            record = await self._loads.do(db_key, lambda: self._load(db_key))
+        else:
+            self._cache.move_to_end(db_key)
+        return db_key, record
+
+    async def _load(self, db_key: str) -> _Record:
+        # Запись могла появиться в кеше, пока мы ждали своей очереди
+        if (record := self._cache.get(db_key)) is not None:
+            return record
+        record = await self._run(self._db_load, db_key)
+        self._cache[db_key] = record
+        self._evict()
+        return record
+
+    def _evict(self):
+        # Вытесняем только записи, которые уже сохранены на диск
+        while len(self._cache) > self._cache_size:
+            for db_key in self._cache:
+                if db_key not in self._dirty:
+                    del self._cache[db_key]
+                    break
+            else:
+                return
+
+    def _mark_dirty(self, db_key: str, record: _Record):
+        # Запись могла быть вытеснена, пока вызывающий ждал загрузки
+        self._cache[db_key] = record
+        self._dirty.add(db_key)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Изменения, пришедшие во время записи, уходят следующей пачкой
+        while self._dirty:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Сбрасывает накопленные изменения на диск одной транзакцией."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        for db_key in list(dirty):
+            record = self._cache.get(db_key)
+            if record is None:
+                continue
+            try:
+                rows.append((db_key, record.state, json.dumps(record.data, ensure_ascii=False)))
+            except (TypeError, ValueError) as e:
+                # Запись с несериализуемыми данными не сохранится никогда; остальные сохраняются
+                logging.error(f"FSM storage: dropping unserializable record {db_key}: {e}")
+                dirty.discard(db_key)
+        try:
+            await self._run(self._db_write, rows)
+        except sqlite3.Error as e:
+            logging.error(f"FSM storage: failed to flush {len(rows)} records: {e}")
+            self._dirty |= dirty
+            return
+        self._evict()
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(db_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, record = await self._get_record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        db_key, record = await self._get_record(key)
+        record.data = data.copy()
+        self._mark_dirty(db_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, record = await self._get_record(key)
+        return record.data.copy()
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        db_key, record = await self._get_record(key)
+        record.data.update(data)
+        self._mark_dirty(db_key, record)
+        return record.data.copy()
+
+    async def modify_data(self, key: StorageKey, change: Callable[[dict], Any]) -> Dict[str, Any]:
+        """Меняет данные функцией change; между чтением и записью нет ожиданий, поэтому изменение атомарно."""
+        db_key, record = await self._get_record(key)
+        data = copy.deepcopy(record.data)
+        change(data)
+        record.data = data
+        self._mark_dirty(db_key, record)
+        return copy.deepcopy(data)
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+class SharedStorage(BaseStorage):
+    """
+    FSM-хранилище поверх общего хранилища (SharedStore) для кластерного режима.
+    Без локального кеша: состояние пользователя может читать и воркер-лидер,
+    который доставляет результаты фоновых опросов.
+
+    Изменения (чтение, правка, запись) записываются через compare-and-set и
+    повторяются, если запись успел изменить другой процесс (например, лидер
+    опросов, доставляющий результат OCR), а внутри процесса выполняются под
+    блокировкой ключа. Поэтому одновременные изменения не затирают друг друга.
+    """
+
+    def __init__(self, store: SharedStore, key_builder: Optional[KeyBuilder] = None):
+        self._store = store
+        self._key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # {ключ: [блокировка, число использующих]}; запись удаляется, когда ключ свободен
+        self._locks: dict[str, list] = {}
+
+    def _db_key(self, key: StorageKey) -> str:
+        return f"fsm:{self._key_builder.build(key)}"
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, db_key: str):
+        entry = self._locks.setdefault(db_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[db_key]
+
+    async def _load(self, key: StorageKey) -> tuple[str, _Record]:
+        db_key = self._db_key(key)
+        raw = await self._store.get(db_key)
+        if raw is None:
+            return db_key, _Record()
+        value = json.loads(raw)
+        return db_key, _Record(state=value["state"], data=value["data"])
+
+    async def _modify(self, key: StorageKey, change: Callable[[_Record], Any]) -> _Record:
+        db_key = self._db_key(key)
+        async with self._locked(db_key):
+            while True:
+                raw = await self._store.get(db_key)
+                record = _Record() if raw is None else _Record(**json.loads(raw))
+                change(record)
+                value = None
+                if record.state is not None or record.data:
+                    value = json.dumps({"state": record.state, "data": record.data}, ensure_ascii=False)
+                if await self._store.compare_and_set(db_key, raw, value):
+                    return record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        def change(record: _Record):
+            record.state = state.state if isinstance(state, State) else state
+
+        await self._modify(key, change)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, record = await self._load(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+
+        def change(record: _Record):
+            record.data = data.copy()
+
+        await self._modify(key, change)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, record = await self._load(key)
+        return record.data
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        record = await self._modify(key, lambda record: record.data.update(data))
+        return record.data.copy()
+
+    async def modify_data(self, key: StorageKey, change: Callable[[dict], Any]) -> Dict[str, Any]:
+        """Меняет данные функцией change атомарно (при конфликте change вызывается повторно)."""
+        record = await self._modify(key, lambda record: change(record.data))
+        return copy.deepcopy(record.data)
+
+    async def count_states(self) -> dict[Optional[str], int]:
+        counts: dict[Optional[str], int] = {}
+        for raw in (await self._store.scan("fsm:")).values():
+            state = json.loads(raw)["state"]
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    async def close(self) -> None:
+        # Общим хранилищем владеет вызывающий код
+        pass
+
+
+class ProfiledStorage(BaseStorage):
+    """Обертка над FSM-хранилищем, которая учитывает вызовы state.* в трассе апдейта."""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        async with span("state.set_state"):
+            await self.storage.set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with span("state.get_state"):
+            return await self.storage.get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with span("state.set_data"):
+            await self.storage.set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with span("state.get_data"):
+            return await self.storage.get_data(key)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        async with span("state.update_data"):
+            return await self.storage.update_data(key, data)
+
+    async def modify_data(self, key: StorageKey, change: Callable[[dict], Any]) -> Dict[str, Any]:
+        async with span("state.modify_data"):
+            return await modify_data(self.storage, key, change)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+async def modify_data(storage: BaseStorage, key: StorageKey, change: Callable[[dict], Any]) -> Dict[str, Any]:
+    """
+    Атомарно меняет данные FSM: change правит словарь данных на месте.
+    В отличие от get_data + update_data, изменение не затирает записи того же
+    ключа, сделанные между чтением и записью (другим апдейтом пользователя или
+    доставкой результата фонового опроса). Возвращает новые данные.
+    """
+    if isinstance(storage, (SQLiteStorage, SharedStorage, ProfiledStorage)):
+        return await storage.modify_data(key, change)
+    # MemoryStorage: чтение и запись выполняются без ожиданий между ними
+    data = copy.deepcopy(await storage.get_data(key))
+    change(data)
+    await storage.set_data(key, data)
+    return copy.deepcopy(data)
+
+
+async def count_states(storage: BaseStorage) -> dict[Optional[str], int]:
+    """Количество сессий по состояниям FSM для любого из используемых хранилищ."""
+    if isinstance(storage, ProfiledStorage):
+        storage = storage.storage
+    if isinstance(storage, (SQLiteStorage, SharedStorage)):
+        return await storage.count_states()
+    if isinstance(storage, MemoryStorage):
+        counts: dict[Optional[str], int] = {}
+        for record in storage.storage.values():
+            counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+    return {}
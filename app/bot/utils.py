@@ -1,32 +1,185 @@
+from io import BytesIO
+from typing import AsyncGenerator, AsyncIterable, Optional, Union
+
+import aiofiles
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, InputFile, Message
+
+from app.api.client import CaseDocument, api_client
+from app.bot.keyboards import markup_signature
+from app.config import settings
+from app.services.document_cache import document_cache
+from app.services.image_preprocessing import ALLOWED_MIME_TYPES, preprocess_image
+from app.services.ocr_results import ocr_results
+
+# Ограничение бэкенда на размер изображения для OCR
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 
-MAX_MESSAGE_LENGTH = 4096
+class FileTooLargeError(Exception):
+    """Файл превышает допустимый для загрузки на OCR размер."""
+
+    def __init__(self, file_size: int):
+        super().__init__(f"File size {file_size} exceeds {MAX_UPLOAD_SIZE} bytes")
+        self.file_size = file_size
+
+
+async def open_telegram_file_stream(bot: Bot, file_id: str) -> AsyncGenerator[bytes, None]:
+    """
+    Возвращает поток байтов файла из Telegram, не скачивая его целиком в память.
+    Размер проверяется заранее, чтобы не отправлять на бэкенд заведомо отклоняемый файл.
+    """
+    file = await bot.get_file(file_id)
+    if file.file_size and file.file_size > MAX_UPLOAD_SIZE:
+        raise FileTooLargeError(file.file_size)
+    return _iter_telegram_file(bot, file.file_path)
 
 
-def split_long_message(text: str) -> list[str]:
+async def submit_photo_for_ocr(
+    bot: Bot,
+    user_id: int,
+    file_id: str,
+    document_type: str,
+    file_unique_id: Optional[str] = None,
+    max_side: Optional[int] = None,
+) -> Optional[dict]:
     """
-    Splits a long message into multiple smaller ones.
-    Tries to split by newlines to keep formatting and avoid breaking HTML tags.
+    Передает фото из Telegram на OCR. Если включена предобработка, изображение
+    уменьшается и пережимается в пуле процессов, иначе передается потоком как есть.
+    Фото, которое по известному размеру (max_side — большая сторона PhotoSize)
+    уменьшать не нужно, тоже передается потоком: Telegram уже сжал его в JPEG.
+    Выбрасывает FileTooLargeError, если файл превышает лимит бэкенда.
+
+    Если то же фото (file_unique_id) уже распознано как document_type, фото не
+    скачивается и задача не создается: возвращается прежний task_id с
+    "cached": True, а статус задачи отдаст индекс без запроса к бэкенду.
     """
-    if len(text) <= MAX_MESSAGE_LENGTH:
-        return [text]
+    scope = None
+    if file_unique_id:
+        scope = await api_client.auth_scope(user_id)
+        if (cached := ocr_results.lookup(scope, file_unique_id, document_type)) is not None:
+            return {"task_id": cached["task_id"], "cached": True}
+
+    result = await _create_ocr_task(bot, user_id, file_id, document_type, max_side)
+    if file_unique_id and result and "task_id" in result:
+        ocr_results.track(result["task_id"], scope, file_unique_id, document_type)
+    return result
+
+
+async def _create_ocr_task(
+    bot: Bot, user_id: int, file_id: str, document_type: str, max_side: Optional[int] = None
+) -> Optional[dict]:
+    image_stream = await open_telegram_file_stream(bot, file_id)
+    try:
+        if not settings.ocr_preprocess_enabled or (max_side is not None and max_side <= settings.ocr_image_max_side):
+            return await api_client.create_ocr_task(
+                user_id=user_id, file_content=image_stream, document_type=document_type
+            )
+        buffer = BytesIO()
+        async for chunk in image_stream:
+            buffer.write(chunk)
+        image_bytes = buffer.getvalue()
+    finally:
+        await image_stream.aclose()
+
+    image_bytes, content_type = await preprocess_image(image_bytes)
+    if content_type not in ALLOWED_MIME_TYPES:
+        # Формат не распознан — отправляем как есть, решение примет бэкенд
+        content_type = "image/jpeg"
+    return await api_client.create_ocr_task(
+        user_id=user_id, file_content=image_bytes, document_type=document_type, content_type=content_type
+    )
+
+
+async def _iter_telegram_file(bot: Bot, file_path: str) -> AsyncGenerator[bytes, None]:
+    if bot.session.api.is_local:
+        # Локальный Bot API сервер отдает путь к файлу на диске
+        async with aiofiles.open(bot.session.api.wrap_local_file.to_local(file_path), "rb") as f:
+            while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+    else:
+        url = bot.session.api.file_url(bot.token, file_path)
+        async for chunk in bot.session.stream_content(url=url, chunk_size=UPLOAD_CHUNK_SIZE):
+            yield chunk
 
-    parts = []
-    current_part = ""
-    # Разделяем по строкам, чтобы сохранить форматирование
-    lines = text.split('\n')
-    
-    for line in lines:
-        # Если добавление следующей строки превысит лимит
-        if len(current_part) + len(line) + 1 > MAX_MESSAGE_LENGTH:
-            # Отправляем текущую часть
-            parts.append(current_part)
-            current_part = line + '\n'
+
+async def edit_message(message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> Message:
+    """
+    Редактирует сообщение бота, не тратя вызовы Bot API впустую: если текст не
+    изменился, обновляется только клавиатура, а если совпадает и она — сообщение
+    не трогается (Telegram все равно отклонил бы такую правку).
+    Возвращает актуальное сообщение.
+    """
+    same_markup = markup_signature(message.reply_markup) == markup_signature(reply_markup)
+    try:
+        if message.html_text == text:
+            if same_markup:
+                return message
+            result = await message.edit_reply_markup(reply_markup=reply_markup)
         else:
-            current_part += line + '\n'
+            result = await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        # Разметка текста могла восстановиться из сущностей иначе, чем была задана
+        if "message is not modified" not in str(e):
+            raise
+        return message
+    return result if isinstance(result, Message) else message
+
+
+class StreamInputFile(InputFile):
+    """Файл для отправки в Telegram из потока байтов: части передаются по мере получения."""
+
+    def __init__(self, stream: AsyncIterable[bytes], filename: str):
+        super().__init__(filename=filename, chunk_size=UPLOAD_CHUNK_SIZE)
+        self._stream = stream
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        async for chunk in self._stream:
+            yield chunk
+
+
+async def _upload_case_document(
+    bot: Bot, chat_id: int, user_id: int, case_id: int, doc_format: str
+) -> Union[Message, dict, None]:
+    document = await api_client.open_case_document(user_id=user_id, case_id=case_id, doc_format=doc_format)
+    if not isinstance(document, CaseDocument):
+        return document
+    try:
+        return await bot.send_document(chat_id, StreamInputFile(document.chunks(), document.filename))
+    finally:
+        document.close()
+
+
+async def send_case_document(bot: Bot, chat_id: int, user_id: int, case_id: int, doc_format: str) -> Optional[dict]:
+    """
+    Отправляет документ с решением по делу. В первый раз файл передается из
+    ответа бэкенда в send_document потоком, дальше — по запомненному file_id,
+    без бэкенда и повторной загрузки. Одновременные запросы одного документа
+    загружают его один раз. Возвращает None при успехе или ответ API с ошибкой
+    (пустой словарь — бэкенд недоступен).
+    """
+    scope = await api_client.auth_scope(user_id)
+    file_id = document_cache.get(case_id, doc_format, scope)
+    if file_id is not None:
+        await bot.send_document(chat_id, file_id)
+        return None
+
+    uploaded_here = False
+
+    async def upload() -> Union[Message, dict, None]:
+        nonlocal uploaded_here
+        uploaded_here = True
+        return await _upload_case_document(bot, chat_id, user_id, case_id, doc_format)
 
-    # Добавляем последнюю оставшуюся часть
-    if current_part:
-        parts.append(current_part)
-        
-    return parts 
\ No newline at end of file
+    result = await document_cache.upload(
+        case_id, doc_format, scope, upload,
+        file_id_of=lambda sent: sent.document.file_id if isinstance(sent, Message) and sent.document else None,
+    )
+    if not isinstance(result, Message):
+        return result or {}
+    # Повторное нажатие в том же чате: документ уже отправлен первым запросом
+    if not uploaded_here and result.chat.id != chat_id and result.document:
+        await bot.send_document(chat_id, result.document.file_id)
+    return None
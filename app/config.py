@@ -1,4 +1,6 @@
 import logging
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -15,6 +17,128 @@ class Settings(BaseSettings):
     api_manager_password: str
     log_level: str = "INFO"
 
+    # Режим получения апдейтов: "polling" или "webhook"
+    run_mode: str = "polling"
+    webhook_base_url: Optional[str] = None
+    webhook_path: str = "/webhook"
+    webhook_secret: Optional[str] = None
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    # Адрес Bot API (локальный сервер или фейковый Telegram); по умолчанию api.telegram.org
+    telegram_api_url: Optional[str] = None
+    # Лимиты исходящих сообщений Telegram (в секунду и допустимый всплеск):
+    # общий на процесс и на каждый чат; повторы после flood-wait (retry_after)
+    telegram_rate_limit_enabled: bool = True
+    telegram_global_rate: float = 30.0
+    telegram_global_burst: int = 30
+    telegram_chat_rate: float = 1.0
+    telegram_chat_burst: int = 3
+    telegram_retry_attempts: int = 3
+    telegram_max_retry_after: float = 60.0
+    # Окно (сек) для сообщений о ходе операций: промежуточный текст показывается,
+    # если операция длится дольше, и обновляется не чаще раза в окно
+    progress_edit_window: float = 1.0
+
+    # Метрики Prometheus (/metrics)
+    metrics_enabled: bool = True
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 9100
+
+    # Профилирование: порог (сек) для лога медленных апдейтов с разбивкой по шагам
+    # (0 - выключено) и доля апдейтов, выполняемых под cProfile
+    slow_update_threshold: float = 2.0
+    profile_sample_rate: float = 0.0
+    profile_keep: int = 20
+
+    # Пул соединений к API
+    api_pool_limit: int = 100
+    api_pool_limit_per_host: int = 50
+    api_keepalive_timeout: float = 60.0
+    api_dns_cache_ttl: int = 300
+    api_connect_timeout: float = 5.0
+    api_request_timeout: float = 30.0
+    api_pool_warmup_connections: int = 4
+
+    # Повторы запросов и предохранитель
+    api_retry_attempts: int = 3
+    api_retry_base_delay: float = 0.5
+    api_retry_max_delay: float = 10.0
+    api_breaker_failure_threshold: int = 5
+    api_breaker_recovery_timeout: float = 30.0
+
+    # Токены API: срок жизни по умолчанию (если в JWT нет exp), запас для
+    # упреждающего обновления, сколько хранить учетные данные неактивного
+    # пользователя и ключ Fernet для шифрования токенов на диске
+    api_token_ttl: int = 1800
+    api_token_refresh_margin: int = 120
+    api_credentials_idle_ttl: int = 86400
+    token_store_key: Optional[str] = None
+
+    # Локальные данные бота (снимки кешей и т.п.)
+    data_dir: str = "data"
+
+    # Кластерный режим: "standalone" (один процесс), "ingress" (принимает апдейты
+    # и раскладывает по воркерам) или "worker" (обрабатывает свой шард)
+    cluster_role: str = "standalone"
+    cluster_workers: int = 1
+    cluster_worker_index: int = 0
+    shared_store_url: str = "sqlite:///data/shared.sqlite3"
+    cluster_leader_lease_ttl: float = 15.0
+    cluster_sync_interval: float = 1.0
+    cluster_queue_poll_interval: float = 0.05
+
+    # FSM-хранилище: "sqlite" (переживает перезапуск) или "memory"
+    fsm_storage: str = "sqlite"
+    fsm_storage_flush_interval: float = 0.5
+    fsm_storage_cache_size: int = 10000
+
+    # Кеш справочников
+    reference_cache_ttl: int = 600
+    reference_cache_max_stale: int = 604800
+
+    # Кеш страниц истории дел (секунды) и число пользователей в нем
+    history_cache_ttl: float = 60.0
+    history_cache_max_users: int = 10000
+
+    # Кеш дел с окончательным решением (секунды) и его объем в байтах
+    case_cache_ttl: float = 3600.0
+    case_cache_max_bytes: int = 16 * 1024 * 1024
+
+    # file_id документов с решением в Telegram: время жизни (секунды) и число записей
+    case_document_cache_ttl: float = 7 * 24 * 3600.0
+    case_document_cache_max_entries: int = 10000
+
+    # Предобработка изображений перед OCR
+    ocr_preprocess_enabled: bool = True
+    ocr_preprocess_workers: int = 2
+    ocr_image_max_side: int = 2048
+    ocr_image_quality: int = 85
+
+    # Готовые результаты OCR по file_unique_id фото: время жизни (секунды,
+    # как у задач OCR на бэкенде) и число записей
+    ocr_result_cache_ttl: float = 86400.0
+    ocr_result_cache_max_entries: int = 10000
+
+    # Опрос статуса OCR задач
+    ocr_poll_initial_delay: float = 3.0
+    ocr_poll_max_delay: float = 30.0
+    ocr_poll_backoff_factor: float = 1.5
+    ocr_poll_slow_notice: float = 50.0
+    ocr_poll_max_wait: float = 1800.0
+    ocr_poll_concurrency: int = 20
+    # Загрузка документов альбомом: сколько ждать остальные фото альбома (сек),
+    # сколько фото принимать и сколько из них одновременно отправлять на OCR
+    album_collect_delay: float = 0.6
+    album_max_photos: int = 10
+    ocr_upload_concurrency: int = 3
+
+    # Ожидание решения по созданному делу (/cases/{id}/status) и уведомление пользователя
+    case_watch_initial_delay: float = 10.0
+    case_watch_max_delay: float = 120.0
+    case_watch_backoff_factor: float = 1.5
+    case_watch_max_wait: float = 86400.0
+    case_watch_concurrency: int = 10
+
 
 settings = Settings()
 
@@ -1,39 +1,227 @@
 import asyncio
 import logging
+import os
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from app.api.client import api_client
+from app.api.tokens import token_store
 from app.bot.handlers import case_management, ocr, auth, history
+from app.bot.middlewares import (
+    AlbumMiddleware,
+    HandlerMetricsMiddleware,
+    OutboundRateLimitMiddleware,
+    ProfilingRequestMiddleware,
+    SlowUpdateMiddleware,
+    TelegramMetricsMiddleware,
+    UpdateMetricsMiddleware,
+)
+from app.bot.storage import ProfiledStorage, SharedStorage, SQLiteStorage, count_states
 from app.config import settings
+from app.services import image_preprocessing
+from app.services.cluster import run_ingress_polling, run_ingress_webhook, run_worker
+from app.services.history_cache import history_cache
+from app.services.metrics import metrics, start_metrics_server
+from app.services.outbound import outbound_limiter
+from app.services.poll_jobs import poll_jobs
+from app.services.poll_scheduler import case_poller, ocr_poller
+from app.services.reference_cache import reference_cache
+from app.services.shared_store import SharedStore, SQLiteSharedStore, create_shared_store
 
 
-async def main():
-    logging.basicConfig(level=settings.log_level)
+def create_bot() -> Bot:
+    session = None
+    if settings.telegram_api_url:
+        # Локальный Bot API сервер или фейковый Telegram для офлайн-проверок
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+    # Тексты бота размечены HTML; пользовательские и серверные значения экранируются (quote)
+    return Bot(token=settings.bot_token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
-    bot = Bot(token=settings.bot_token)
-    storage = MemoryStorage()
+
+def create_dispatcher(store: Optional[SharedStore] = None) -> Dispatcher:
+    if store is not None:
+        # Воркеры кластера делят состояние FSM через общее хранилище
+        storage = SharedStorage(store)
+    elif settings.fsm_storage == "sqlite":
+        storage = SQLiteStorage(
+            path=os.path.join(settings.data_dir, "fsm.sqlite3"),
+            flush_interval=settings.fsm_storage_flush_interval,
+            cache_size=settings.fsm_storage_cache_size,
+        )
+    else:
+        storage = MemoryStorage()
+    if settings.slow_update_threshold > 0:
+        storage = ProfiledStorage(storage)
     dp = Dispatcher(storage=storage)
+    # Фото альбома приходят отдельными апдейтами; обработчики получают их вместе
+    dp.message.outer_middleware(AlbumMiddleware(delay=settings.album_collect_delay))
 
     # Подключаем роутеры
     dp.include_router(auth.router)
     dp.include_router(case_management.router)
     dp.include_router(ocr.router)
     dp.include_router(history.router)
+    return dp
+
+
+def setup_rate_limit(bot: Bot):
+    # Регистрируется до остальных middleware сессии, чтобы быть внешним
+    bot.session.middleware(OutboundRateLimitMiddleware(
+        outbound_limiter,
+        retry_attempts=settings.telegram_retry_attempts,
+        max_retry_after=settings.telegram_max_retry_after,
+    ))
+
+
+def setup_metrics(bot: Bot, dp: Dispatcher):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    # Inner-middleware диспетчера распространяются на обработчики всех роутеров
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+    async def fsm_sessions():
+        return {(state or "none",): count for state, count in (await count_states(dp.storage)).items()}
 
+    metrics.gauge("bot_fsm_sessions", "FSM sessions by state", fsm_sessions, ("state",))
+    metrics.gauge("ocr_polls_in_flight", "OCR status polls scheduled in this process", lambda: len(ocr_poller))
+    metrics.gauge("case_watches_in_flight", "Cases awaiting a decision in this process", lambda: len(case_poller))
+    metrics.gauge(
+        "telegram_outbound_queue_depth", "Outbound messages waiting for rate limits",
+        outbound_limiter.queue_depth, ("priority",),
+    )
+
+
+def setup_profiling(bot: Bot, dp: Dispatcher):
+    dp.update.outer_middleware(SlowUpdateMiddleware(
+        threshold=settings.slow_update_threshold,
+        sample_rate=settings.profile_sample_rate,
+        profile_dir=os.path.join(settings.data_dir, "profiles"),
+        keep=settings.profile_keep,
+    ))
+    bot.session.middleware(ProfilingRequestMiddleware())
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
     # Пропускаем накопившиеся апдейты и запускаем polling
     await bot.delete_webhook(drop_pending_updates=True)
+    logging.info("Bot started in polling mode...")
+    await dp.start_polling(bot)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Принимает апдейты через вебхук. Telegram получает 200 сразу, а обработка
+    идет в фоне. Вебхук не снимается при остановке, поэтому апдейты,
+    пришедшие во время перезапуска, не теряются.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.webhook_secret or None,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.webhook_host, port=settings.webhook_port)
+    await site.start()
+
+    if settings.webhook_base_url:
+        await bot.set_webhook(
+            url=f"{settings.webhook_base_url.rstrip('/')}{settings.webhook_path}",
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    logging.info(f"Bot started in webhook mode on {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main():
+    logging.basicConfig(level=settings.log_level)
+
+    store = None
+    journal = None
+    if settings.cluster_role != "standalone":
+        store = create_shared_store(settings.shared_store_url)
+        token_store.attach(store)
+    else:
+        # Журнал фоновых задач, которые должны пережить перезапуск (ожидание решений по делам)
+        journal = SQLiteSharedStore(os.path.join(settings.data_dir, "poll_jobs.sqlite3"))
+
+    bot = create_bot()
+    dp = create_dispatcher(store)
+    poll_jobs.setup(bot, dp.storage, store, journal)
+
+    if settings.telegram_rate_limit_enabled:
+        setup_rate_limit(bot)
+
+    if settings.slow_update_threshold > 0:
+        setup_profiling(bot, dp)
+
+    metrics_runner = None
+    if settings.metrics_enabled:
+        setup_metrics(bot, dp)
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
+
+    # Восстанавливаем токены, чтобы после перезапуска не входить заново
+    token_store.load()
+
+    # Справочники из снимка на диске доступны сразу после старта
+    reference_cache.load_snapshot()
+
+    # Прогреваем пул соединений к API до приема первых апдейтов
+    await api_client.warmup()
+
+    if restored := await poll_jobs.restore():
+        logging.info(f"Restored {restored} background poll jobs")
 
     # Запуск бота
     try:
-        logging.info("Bot started...")
-        await dp.start_polling(bot)
+        if settings.cluster_role == "ingress":
+            if settings.run_mode == "webhook":
+                await run_ingress_webhook(bot, dp, store)
+            else:
+                await run_ingress_polling(bot, dp, store)
+        elif settings.cluster_role == "worker":
+            await run_worker(bot, dp, store)
+        elif settings.run_mode == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
     finally:
         logging.info("Bot stopped.")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await ocr_poller.stop()
+        await case_poller.stop()
+        await outbound_limiter.close()
+        # Сбрасываем на диск отложенные изменения FSM
+        await dp.storage.close()
         await bot.session.close()
         # Закрываем сессию API клиента
         await api_client.close()
+        await reference_cache.close()
+        await history_cache.close()
+        await token_store.close()
+        if store is not None:
+            await store.close()
+        if journal is not None:
+            await journal.close()
+        image_preprocessing.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+import copy
+import json
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from app.config import settings
+
+# Статусы, после которых решение по делу больше не меняется
+TERMINAL_STATUSES = frozenset({"СООТВЕТСТВУЕТ", "НЕ СООТВЕТСТВУЕТ", "FAILED"})
+
+
+class _CaseEntry:
+    __slots__ = ("scope", "payload", "stored_at", "parts", "size")
+
+    def __init__(self, scope: Optional[str], payload: dict, size: int):
+        # Учетная запись API, получившая данные: другим запись не отдается
+        self.scope = scope
+        self.payload = payload
+        self.stored_at = time.monotonic()
+        # {вид отображения: готовые части сообщения}
+        self.parts: dict[str, list[str]] = {}
+        self.size = size
+
+
+class CaseCache:
+    """
+    Кеш дел с окончательным решением: ответ бэкенда и уже отформатированные,
+    разбитые на части сообщения. Вытеснение по LRU с ограничением суммарного
+    размера, записи живут не дольше ttl; удаление дела сбрасывает запись.
+    Без известной учетной записи (scope=None) кеш не используется.
+    """
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[int, _CaseEntry] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Примерный объем кеша в байтах (по длине строк)."""
+        return self._size
+
+    @staticmethod
+    def is_terminal(payload: Optional[dict]) -> bool:
+        return bool(payload) and "error" not in payload and payload.get("final_status") in TERMINAL_STATUSES
+
+    def get(self, case_id: int, scope: Optional[str]) -> Optional[dict]:
+        if scope is None:
+            return None
+        entry = self._entry(case_id)
+        if entry is None or entry.scope != scope:
+            return None
+        return copy.deepcopy(entry.payload)
+
+    def put(self, case_id: int, scope: Optional[str], payload: dict):
+        """Сохраняет дело, если решение по нему окончательное."""
+        if scope is None or not self.is_terminal(payload):
+            return
+        self.invalidate(case_id)
+        entry = _CaseEntry(scope, copy.deepcopy(payload), len(json.dumps(payload, ensure_ascii=False)))
+        self._entries[case_id] = entry
+        self._size += entry.size
+        self._evict()
+
+    def render(self, case_id: int, scope: Optional[str], view: str, build: Callable[[], list[str]]) -> list[str]:
+        """
+        Возвращает части сообщения для вида view. Для закешированного дела они
+        строятся один раз, для остальных build вызывается каждый раз. Готовые
+        части отдаются только учетной записи, получившей дело (как в get).
+        """
+        entry = self._entry(case_id) if scope is not None else None
+        if entry is None or entry.scope != scope:
+            return build()
+        parts = entry.parts.get(view)
+        if parts is None:
+            parts = entry.parts[view] = build()
+            added = sum(len(part) for part in parts)
+            entry.size += added
+            self._size += added
+            self._evict()
+        return list(parts)
+
+    def invalidate(self, case_id: int):
+        entry = self._entries.pop(case_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _entry(self, case_id: int) -> Optional[_CaseEntry]:
+        entry = self._entries.get(case_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.stored_at >= self._ttl:
+            self.invalidate(case_id)
+            return None
+        self._entries.move_to_end(case_id)
+        return entry
+
+    def _evict(self):
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+
+
+case_cache = CaseCache(ttl=settings.case_cache_ttl, max_bytes=settings.case_cache_max_bytes)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from app.config import settings
+from app.services.poll_jobs import poll_jobs
+from app.services.shared_store import SharedStore
+
+LEADER_LEASE = "poll-leader"
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{settings.cluster_worker_index}"
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    """Находит ID пользователя (или чата) в сыром апдейте Telegram."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            if isinstance(value.get(field), dict) and "id" in value[field]:
+                return value[field]["id"]
+    return None
+
+
+def update_queue(shard: int) -> str:
+    return f"updates:{shard}"
+
+
+async def enqueue_update(store: SharedStore, update: dict):
+    """Кладет апдейт в очередь воркера: все апдейты пользователя попадают к одному воркеру."""
+    shard = (update_user_id(update) or 0) % settings.cluster_workers
+    await store.push(update_queue(shard), json.dumps(update, ensure_ascii=False))
+
+
+# --- Ingress: принимает апдейты от Telegram и раскладывает по воркерам ---
+
+async def run_ingress_webhook(bot: Bot, dp: Dispatcher, store: SharedStore):
+    async def handle(request: web.Request) -> web.Response:
+        if settings.webhook_secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != settings.webhook_secret:
+            return web.Response(status=401)
+        await enqueue_update(store, await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(settings.webhook_path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=settings.webhook_host, port=settings.webhook_port).start()
+
+    if settings.webhook_base_url:
+        await bot.set_webhook(
+            url=f"{settings.webhook_base_url.rstrip('/')}{settings.webhook_path}",
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    logging.info(f"Ingress started in webhook mode, {settings.cluster_workers} shards")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_ingress_polling(bot: Bot, dp: Dispatcher, store: SharedStore):
+    # Накопившиеся апдейты не сбрасываем: воркеры обработают их из очереди
+    await bot.delete_webhook()
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    logging.info(f"Ingress started in polling mode, {settings.cluster_workers} shards")
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error(f"Ingress: failed to get updates: {e!r}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            try:
+                await enqueue_update(store, update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            except Exception as e:
+                # offset не сдвигается: апдейт и оставшиеся в пачке будут получены заново
+                logging.error(f"Ingress: failed to enqueue update {update.update_id}: {e!r}")
+                await asyncio.sleep(1)
+                break
+            offset = update.update_id + 1
+
+
+# --- Worker: обрабатывает апдейты своего шарда ---
+
+async def _process_update(bot: Bot, dp: Dispatcher, update: dict):
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        logging.exception(f"Worker: failed to process update {update.get('update_id')}")
+
+
+async def run_worker(bot: Bot, dp: Dispatcher, store: SharedStore):
+    queue = update_queue(settings.cluster_worker_index)
+    leader = asyncio.create_task(run_poll_leader(store))
+    tasks: set[asyncio.Task] = set()
+    logging.info(f"Worker {settings.cluster_worker_index}/{settings.cluster_workers} started")
+    try:
+        while True:
+            payloads = await store.pop(queue)
+            if not payloads:
+                await asyncio.sleep(settings.cluster_queue_poll_interval)
+                continue
+            for payload in payloads:
+                task = asyncio.create_task(_process_update(bot, dp, json.loads(payload)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    finally:
+        leader.cancel()
+        await asyncio.gather(leader, *tasks, return_exceptions=True)
+
+
+async def run_poll_leader(store: SharedStore):
+    """
+    Выбор лидера через аренду в общем хранилище. Лидер опрашивает фоновые задачи
+    всего кластера; при потере аренды локальные опросы останавливаются.
+    """
+    owner = worker_id()
+    ttl = settings.cluster_leader_lease_ttl
+    is_leader = False
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                leader = await store.acquire_lease(LEADER_LEASE, owner, ttl)
+            except Exception as e:
+                logging.error(f"Poll leader: lease check failed: {e!r}")
+                leader = False
+
+            if leader != is_leader:
+                logging.info(f"Poll leader: {owner} {'acquired' if leader else 'lost'} leadership")
+                if not leader:
+                    poll_jobs.release()
+            is_leader = leader
+
+            if is_leader:
+                try:
+                    await poll_jobs.sync(lease_until=started + ttl)
+                except Exception as e:
+                    logging.error(f"Poll leader: sync failed: {e!r}")
+            await asyncio.sleep(settings.cluster_sync_interval)
+    finally:
+        poll_jobs.release()
+        if is_leader:
+            await store.release_lease(LEADER_LEASE, owner)
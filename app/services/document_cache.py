@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from app.config import settings
+from app.services.single_flight import SingleFlight
+
+
+class DocumentCache:
+    """
+    Telegram file_id документов с решением по делу, по (дело, формат). Файл,
+    однажды загруженный в Telegram, отправляется повторно по file_id: без
+    запроса к бэкенду и без загрузки. Запись отдается только той учетной
+    записи API, которая скачала документ; удаление дела сбрасывает его записи.
+    Без известной учетной записи (scope=None) кеш и объединение загрузок не
+    используются.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        # {(дело, формат): (сохранено, учетная запись, file_id)}
+        self._entries: OrderedDict[tuple[int, str], tuple[float, Optional[str], str]] = OrderedDict()
+        self._flights = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, case_id: int, doc_format: str, scope: Optional[str]) -> Optional[str]:
+        if scope is None:
+            return None
+        key = (case_id, doc_format)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, owner, file_id = entry
+        if time.monotonic() - stored_at >= self._ttl:
+            del self._entries[key]
+            return None
+        if owner != scope:
+            return None
+        self._entries.move_to_end(key)
+        return file_id
+
+    def put(self, case_id: int, doc_format: str, scope: Optional[str], file_id: str):
+        if scope is None:
+            return
+        self._entries[(case_id, doc_format)] = (time.monotonic(), scope, file_id)
+        self._entries.move_to_end((case_id, doc_format))
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, case_id: int):
+        for key in [key for key in self._entries if key[0] == case_id]:
+            del self._entries[key]
+
+    async def upload(
+        self,
+        case_id: int,
+        doc_format: str,
+        scope: Optional[str],
+        upload: Callable[[], Awaitable[Any]],
+        file_id_of: Callable[[Any], Optional[str]],
+    ) -> Any:
+        """
+        Выполняет upload (скачивание у бэкенда и отправку в Telegram) один раз на
+        документ: одновременные вызовы получают тот же результат. file_id из
+        результата (file_id_of) запоминается.
+        """
+        if scope is None:
+            return await upload()
+
+        async def run() -> Any:
+            result = await upload()
+            if (file_id := file_id_of(result)) is not None:
+                self.put(case_id, doc_format, scope, file_id)
+            return result
+
+        return await self._flights.do((case_id, doc_format, scope), run)
+
+
+document_cache = DocumentCache(
+    ttl=settings.case_document_cache_ttl, max_entries=settings.case_document_cache_max_entries
+)
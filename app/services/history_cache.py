@@ -0,0 +1,105 @@
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from app.config import settings
+from app.services.single_flight import SingleFlight
+
+# Загрузка страницы истории: (skip, limit) -> список дел или ответ с ошибкой
+PageFetcher = Callable[[int, int], Awaitable[Any]]
+
+
+class _UserPages:
+    __slots__ = ("generation", "pages")
+
+    def __init__(self):
+        # Увеличивается при инвалидации: загрузки, начатые до нее, не попадают в кеш
+        self.generation = 0
+        # {(skip, limit): (fetched_at, страница)}
+        self.pages: dict[tuple[int, int], tuple[float, list]] = {}
+
+
+class HistoryCache:
+    """
+    Кеш страниц истории дел по пользователям. Пока пользователь смотрит страницу N,
+    страница N+1 загружается в фоне, поэтому листание вперед и назад не ждет бэкенд.
+    Кеш пользователя сбрасывается, когда у него появляется новое дело или меняется
+    статус существующего; число пользователей в кеше ограничено (LRU).
+    """
+
+    def __init__(self, ttl: float, max_users: int):
+        self._ttl = ttl
+        self._max_users = max_users
+        self._users: OrderedDict[int, _UserPages] = OrderedDict()
+        self._flights = SingleFlight()
+        self._background: set[asyncio.Task] = set()
+
+    async def get_page(self, user_id: int, skip: int, limit: int, fetcher: PageFetcher) -> Optional[Any]:
+        page = self._lookup(user_id, skip, limit)
+        if page is None:
+            page = await self._flights.do((user_id, skip, limit), lambda: self._fill(user_id, skip, limit, fetcher))
+        if isinstance(page, list) and len(page) == limit:
+            # Полная страница — вероятно, есть следующая
+            self._prefetch(user_id, skip + limit, limit, fetcher)
+        return copy.deepcopy(page)
+
+    def invalidate(self, user_id: int):
+        user = self._users.get(user_id)
+        if user is not None:
+            user.generation += 1
+            user.pages.clear()
+
+    def _user(self, user_id: int) -> _UserPages:
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = _UserPages()
+            if len(self._users) > self._max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return user
+
+    def _lookup(self, user_id: int, skip: int, limit: int) -> Optional[list]:
+        user = self._users.get(user_id)
+        entry = user.pages.get((skip, limit)) if user is not None else None
+        if entry is None:
+            return None
+        fetched_at, page = entry
+        if time.monotonic() - fetched_at >= self._ttl:
+            del user.pages[(skip, limit)]
+            return None
+        self._users.move_to_end(user_id)
+        return page
+
+    async def _fill(self, user_id: int, skip: int, limit: int, fetcher: PageFetcher) -> Any:
+        generation = self._user(user_id).generation
+        page = await fetcher(skip, limit)
+        user = self._users.get(user_id)
+        # Ошибки API приходят словарем с ключом "error" и не кешируются
+        if isinstance(page, list) and user is not None and user.generation == generation:
+            user.pages[(skip, limit)] = (time.monotonic(), page)
+        return page
+
+    def _prefetch(self, user_id: int, skip: int, limit: int, fetcher: PageFetcher):
+        key = (user_id, skip, limit)
+        if self._lookup(user_id, skip, limit) is not None or self._flights.in_flight(key):
+            return
+        task = asyncio.create_task(self._flights.do(key, lambda: self._fill(user_id, skip, limit, fetcher)))
+        self._background.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"History cache: prefetch failed: {task.exception()!r}")
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+
+
+history_cache = HistoryCache(ttl=settings.history_cache_ttl, max_users=settings.history_cache_max_users)
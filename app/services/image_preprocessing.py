@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.config import settings
+
+# MIME-типы изображений, которые принимает бэкенд
+ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/gif", "image/bmp", "image/webp"}
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _preprocess(data: bytes, max_side: int, quality: int) -> tuple[bytes, str]:
+    """
+    Уменьшает изображение до разрешения, достаточного для OCR, и пережимает в JPEG
+    без метаданных. Выполняется в отдельном процессе.
+    Возвращает (байты изображения, MIME-тип).
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            mime_type = Image.MIME.get(image.format or "", "application/octet-stream")
+            has_metadata = bool(image.getexif()) or "exif" in image.info
+            # Поворот по EXIF применяем до удаления метаданных
+            image = ImageOps.exif_transpose(image)
+            resized = max(image.size) > max_side
+            if resized:
+                image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            output = BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        # Нераспознанное изображение или «декомпрессионная бомба»: решение примет бэкенд
+        return data, "application/octet-stream"
+
+    processed = output.getvalue()
+    # Если пережатие не дало выигрыша, отправляем оригинал в его настоящем формате
+    if not resized and not has_metadata and len(processed) >= len(data) and mime_type in ALLOWED_MIME_TYPES:
+        return data, mime_type
+    return processed, "image/jpeg"
+
+
+async def preprocess_image(data: bytes) -> tuple[bytes, str]:
+    """Подготавливает изображение для OCR в пуле процессов, не блокируя event loop."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.ocr_preprocess_workers)
+    loop = asyncio.get_running_loop()
+    try:
+        processed, mime_type = await loop.run_in_executor(
+            _executor, _preprocess, data, settings.ocr_image_max_side, settings.ocr_image_quality
+        )
+    except BrokenProcessPool:
+        # Процесс пула упал (например, по памяти): пул пересоздается при следующем вызове
+        logging.error(f"Image preprocessing pool is broken, sending original image ({len(data)} bytes)")
+        shutdown()
+        return data, "application/octet-stream"
+    logging.debug(f"Preprocessed image: {len(data)} -> {len(processed)} bytes, {mime_type}")
+    return processed, mime_type
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,187 @@
+import asyncio
+import bisect
+import logging
+from typing import Awaitable, Callable, Union
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Значения метрики по наборам меток: {("GET", "/cases/{id}"): 1.0}
+Samples = dict[tuple[str, ...], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Samples = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    async def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = buckets
+        # {метки: [счетчики по корзинам..., +Inf, сумма]}
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0.0] * (len(self._buckets) + 2)
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    async def render(self) -> list[str]:
+        lines = self._header()
+        for labels, counts in self._values.items():
+            cumulative = 0.0
+            for bound, count in zip((*self._buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {counts[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение снимается в момент запроса /metrics функцией collect (обычной или асинхронной)."""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Union[Samples, float, Awaitable[Union[Samples, float]]]],
+        labelnames: tuple[str, ...] = (),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    async def render(self) -> list[str]:
+        value = self._collect()
+        if asyncio.iscoroutine(value):
+            value = await value
+        samples = value if isinstance(value, dict) else {(): value}
+        lines = self._header()
+        for labels, sample in samples.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {float(sample)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, collect, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, collect, labelnames))
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(await metric.render())
+            except Exception as e:
+                # Сбой одного сборщика не должен ломать весь ответ
+                logging.warning(f"Metrics: failed to collect {metric.name}: {e!r}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Запросы к API бэкенда
+api_request_duration = metrics.histogram(
+    "api_request_duration_seconds", "Backend API request latency", ("method", "path")
+)
+api_requests = metrics.counter(
+    "api_requests_total", "Backend API requests by status", ("method", "path", "status")
+)
+
+# Апдейты и обработчики бота
+updates_total = metrics.counter("bot_updates_total", "Processed Telegram updates", ("type",))
+update_duration = metrics.histogram("bot_update_duration_seconds", "Update processing time", ("type",))
+handler_duration = metrics.histogram(
+    "bot_handler_duration_seconds", "Handler latency", ("router", "handler")
+)
+handler_errors = metrics.counter("bot_handler_errors_total", "Handler exceptions", ("router", "handler"))
+
+# Исходящие вызовы Telegram Bot API
+telegram_calls = metrics.counter("telegram_api_calls_total", "Telegram Bot API calls", ("method",))
+telegram_errors = metrics.counter(
+    "telegram_api_errors_total", "Telegram Bot API errors", ("method", "error")
+)
+telegram_flood_waits = metrics.counter(
+    "telegram_api_flood_waits_total", "Telegram flood-wait (retry_after) responses", ("method",)
+)
+telegram_call_duration = metrics.histogram(
+    "telegram_api_call_duration_seconds", "Telegram Bot API call latency", ("method",)
+)
+telegram_outbound_wait = metrics.histogram(
+    "telegram_outbound_wait_seconds", "Time outbound messages waited for rate limits", ("priority",)
+)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=await metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный HTTP-сервер для /metrics, одинаковый для всех режимов запуска."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info(f"Metrics available on http://{host}:{port}/metrics")
+    return runner
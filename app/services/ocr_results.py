@@ -0,0 +1,86 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+
+# (учетная запись API, file_unique_id фото, тип документа)
+OcrKey = tuple[Optional[str], str, str]
+
+
+class OcrResultIndex:
+    """
+    Готовые результаты OCR по фото из Telegram. file_unique_id одинаков у
+    повторно отправленного фото, поэтому повторная загрузка того же документа
+    получает прежний task_id и данные без скачивания фото и новой задачи на
+    бэкенде. Записи живут столько же, сколько задачи OCR на бэкенде, и видны
+    только учетной записи API, которая их распознала; без известной учетной
+    записи (scope=None) индекс не используется.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        # Отправленные задачи до получения результата: {task_id: ключ}
+        self._pending: OrderedDict[str, OcrKey] = OrderedDict()
+        # {ключ: (готово в, результат задачи)} и {task_id: ключ}
+        self._results: OrderedDict[OcrKey, tuple[float, dict]] = OrderedDict()
+        self._by_task: dict[str, OcrKey] = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def track(self, task_id: str, scope: Optional[str], file_unique_id: str, doc_type: str):
+        """Запоминает, по какому фото создана задача; результат привяжется к нему в record."""
+        if scope is None:
+            return
+        self._pending[task_id] = (scope, file_unique_id, doc_type)
+        while len(self._pending) > self._max_entries:
+            self._pending.popitem(last=False)
+
+    def record(self, task_id: str, result: dict):
+        """Сохраняет результат задачи, если она отслеживается и распознана успешно."""
+        status = result.get("status")
+        if status not in ("COMPLETED", "FAILED"):
+            return
+        key = self._pending.pop(task_id, None)
+        if key is None or status != "COMPLETED":
+            return
+        self._drop(key)
+        self._results[key] = (time.monotonic(), {**copy.deepcopy(result), "task_id": task_id})
+        self._by_task[task_id] = key
+        while len(self._results) > self._max_entries:
+            self._drop(next(iter(self._results)))
+
+    def lookup(self, scope: Optional[str], file_unique_id: str, doc_type: str) -> Optional[dict]:
+        """Результат (с task_id) для того же фото и типа документа или None."""
+        if scope is None:
+            return None
+        return self._get((scope, file_unique_id, doc_type))
+
+    def get_task(self, task_id: str, scope: Optional[str]) -> Optional[dict]:
+        """Результат задачи по ее ID, если он сохранен для этой учетной записи."""
+        key = self._by_task.get(task_id)
+        if key is None or scope is None or key[0] != scope:
+            return None
+        return self._get(key)
+
+    def _get(self, key: OcrKey) -> Optional[dict]:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        completed_at, result = entry
+        if time.monotonic() - completed_at >= self._ttl:
+            self._drop(key)
+            return None
+        self._results.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def _drop(self, key: OcrKey):
+        entry = self._results.pop(key, None)
+        if entry is not None:
+            self._by_task.pop(entry[1].get("task_id"), None)
+
+
+ocr_results = OcrResultIndex(ttl=settings.ocr_result_cache_ttl, max_entries=settings.ocr_result_cache_max_entries)
@@ -0,0 +1,145 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from typing import Hashable, Optional
+
+from app.config import settings
+
+# Приоритеты исходящих сообщений: ответы пользователю раньше фоновых уведомлений
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+def mark_background():
+    """
+    Помечает отправки текущей задачи как фоновые. Вызывается в начале отдельной
+    asyncio-задачи (опросы планировщика), поэтому на другие задачи не влияет.
+    """
+    _priority.set(BACKGROUND)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class _Bucket:
+    """
+    Ведро токенов в виде GCRA: хранится только время, к которому ведро
+    «опустеет», поэтому ожидание резервируется без фоновых пополнений.
+    """
+
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.tat = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до следующего токена (без резервирования)."""
+        return max(0.0, max(self.tat, now) - self.tolerance - now)
+
+    def reserve(self, now: float) -> float:
+        """Резервирует токен и возвращает, сколько нужно подождать до отправки."""
+        wait = self.delay(now)
+        self.tat = max(self.tat, now) + self.interval
+        return wait
+
+    def block(self, until: float):
+        """После flood-wait следующий токен выдается не раньше until."""
+        self.tat = max(self.tat, until + self.tolerance)
+
+
+class OutboundLimiter:
+    """
+    Ограничивает частоту исходящих сообщений Telegram: ведро на каждый чат и
+    общее ведро процесса. Сначала ожидается очередь чата (по порядку вызовов),
+    затем общий токен; общие токены выдаются по приоритету, так что фоновые
+    уведомления не задерживают ответы пользователям.
+    """
+
+    def __init__(self, global_rate: float, global_burst: int, chat_rate: float, chat_burst: int):
+        self._global = _Bucket(global_rate, global_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: dict[Hashable, _Bucket] = {}
+        self._sweep_at = 1024
+        # Ожидающие общего токена: (приоритет, порядковый номер, future)
+        self._queue: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._waiting = dict.fromkeys(PRIORITY_NAMES, 0)
+
+    def queue_depth(self) -> dict[tuple[str, ...], float]:
+        """Число отправок, ждущих лимита, по приоритетам (для метрик)."""
+        return {(PRIORITY_NAMES[priority],): count for priority, count in self._waiting.items()}
+
+    async def acquire(self, chat_id: Optional[Hashable], priority: int = INTERACTIVE) -> float:
+        """Дожидается разрешения на отправку. Возвращает время ожидания в секундах."""
+        now = time.monotonic()
+        wait = self._chat(chat_id, now).reserve(now) if chat_id is not None else 0.0
+        if wait == 0.0 and not self._queue and self._global.delay(now) == 0.0:
+            self._global.reserve(now)
+            return 0.0
+
+        self._waiting[priority] += 1
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (priority, next(self._counter), future))
+            if self._pump is None or self._pump.done():
+                self._pump = asyncio.create_task(self._release())
+            await future
+        finally:
+            self._waiting[priority] -= 1
+        return time.monotonic() - now
+
+    def block(self, chat_id: Optional[Hashable], retry_after: float):
+        """Учитывает flood-wait: чат (или весь процесс, если чат неизвестен) ждет retry_after."""
+        now = time.monotonic()
+        bucket = self._chat(chat_id, now) if chat_id is not None else self._global
+        bucket.block(now + retry_after)
+
+    async def close(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
+        for _, _, future in self._queue:
+            future.cancel()
+        self._queue.clear()
+
+    def _chat(self, chat_id: Hashable, now: float) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._sweep_at:
+                # Ведра, опустевшие к текущему моменту, ничем не отличаются от новых
+                self._chats = {key: value for key, value in self._chats.items() if value.tat > now}
+                self._sweep_at = max(1024, 2 * len(self._chats))
+            bucket = self._chats[chat_id] = _Bucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def _release(self):
+        while self._queue:
+            wait = self._global.delay(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            # Ожидание могло быть отменено вместе с отправкой
+            if not future.done():
+                self._global.reserve(time.monotonic())
+                future.set_result(None)
+
+
+outbound_limiter = OutboundLimiter(
+    global_rate=settings.telegram_global_rate,
+    global_burst=settings.telegram_global_burst,
+    chat_rate=settings.telegram_chat_rate,
+    chat_burst=settings.telegram_chat_burst,
+)
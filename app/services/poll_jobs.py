@@ -0,0 +1,174 @@
+import json
+import time
+from typing import Callable, Hashable, Optional
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import BaseStorage
+
+from app.services.poll_scheduler import PollJob, PollScheduler
+from app.services.shared_store import SharedStore
+
+# Строит исполняемую задачу по ее описанию: (описание, бот, FSM-хранилище) -> PollJob
+JobFactory = Callable[[dict, Bot, BaseStorage], PollJob]
+
+
+class PollJobRegistry:
+    """
+    Фоновые опросы, описанные данными, а не замыканиями.
+    В одиночном режиме задача сразу ставится в локальный планировщик. В кластерном
+    режиме описание записывается в общее хранилище, а опрашивает задачи только
+    воркер-лидер, поэтому результат не опрашивается и не доставляется дважды.
+    При смене лидера новый лидер подхватывает незавершенные задачи.
+
+    Задачи постоянных видов в одиночном режиме дублируются в локальный журнал
+    и восстанавливаются после перезапуска (restore).
+    """
+
+    def __init__(self):
+        # {вид: (планировщик, фабрика, переживает ли перезапуск)}
+        self._kinds: dict[str, tuple[PollScheduler, JobFactory, bool]] = {}
+        self._bot: Optional[Bot] = None
+        self._storage: Optional[BaseStorage] = None
+        self._store: Optional[SharedStore] = None
+        self._journal: Optional[SharedStore] = None
+        # Аренда лидера действует до этого момента (time.monotonic)
+        self._leader_until = 0.0
+        # {ключ в общем хранилище: (вид, ключ задачи, владелец)} для задач, опрашиваемых этим процессом
+        self._active: dict[str, tuple[str, Hashable, Hashable]] = {}
+        # Завершенные задачи, которые еще могут вернуться из устаревшего снимка хранилища
+        self._finished: set[str] = set()
+
+    def register(self, kind: str, scheduler: PollScheduler, factory: JobFactory, persistent: bool = False):
+        self._kinds[kind] = (scheduler, factory, persistent)
+
+    def setup(
+        self,
+        bot: Bot,
+        storage: BaseStorage,
+        store: Optional[SharedStore] = None,
+        journal: Optional[SharedStore] = None,
+    ):
+        self._bot = bot
+        self._storage = storage
+        self._store = store
+        # В кластерном режиме задачи и так лежат в общем хранилище
+        self._journal = journal if store is None else None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._store is None or time.monotonic() < self._leader_until
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    @staticmethod
+    def _store_key(kind: str, owner: Hashable, key: Hashable) -> str:
+        return f"poll:{kind}:{owner}:{key}"
+
+    def _journaled(self, kind: str) -> bool:
+        return self._journal is not None and self._kinds[kind][2]
+
+    async def submit(self, kind: str, key: Hashable, owner: Hashable, descriptor: dict):
+        """Регистрирует задачу опроса."""
+        store_key = self._store_key(kind, owner, key)
+        entry = {"kind": kind, "submitted_at": time.time(), "descriptor": descriptor}
+        if self._store is None:
+            if self._journaled(kind):
+                await self._journal.set(store_key, json.dumps(entry, ensure_ascii=False))
+            self._start(store_key, entry)
+        else:
+            await self._store.set(store_key, json.dumps(entry, ensure_ascii=False))
+
+    async def cancel_owner(self, owner: Hashable, kind: Optional[str] = None):
+        """Отменяет задачи владельца: все или только указанного вида."""
+        kinds = [kind] if kind is not None else list(self._kinds)
+        for name in kinds:
+            self._kinds[name][0].cancel_owner(owner)
+        for store_key, (job_kind, _, job_owner) in list(self._active.items()):
+            if job_owner == owner and job_kind in kinds:
+                del self._active[store_key]
+        for name in kinds:
+            prefix = f"poll:{name}:{owner}:"
+            if self._store is not None:
+                for store_key in await self._store.scan(prefix):
+                    self._finished.add(store_key)
+                    await self._store.delete(store_key)
+            elif self._journaled(name):
+                for store_key in await self._journal.scan(prefix):
+                    await self._journal.delete(store_key)
+
+    async def restore(self) -> int:
+        """Одиночный режим: запускает задачи из журнала, не завершенные до перезапуска."""
+        if self._journal is None:
+            return 0
+        restored = 0
+        for store_key, raw in (await self._journal.scan("poll:")).items():
+            entry = json.loads(raw)
+            if entry["kind"] in self._kinds and store_key not in self._active:
+                self._start(store_key, entry)
+                restored += 1
+        return restored
+
+    def _start(self, store_key: str, entry: dict):
+        scheduler, factory, _ = self._kinds[entry["kind"]]
+        job = factory(entry["descriptor"], self._bot, self._storage)
+        poll, on_expire = job.poll, job.on_expire
+
+        async def tracked_poll(job: PollJob) -> bool:
+            # Бывший лидер, потерявший аренду, не должен доставлять результат
+            if not self.is_leader:
+                return False
+            done = await poll(job)
+            if done:
+                await self._forget(store_key)
+            return done
+
+        async def tracked_expire(job: PollJob):
+            await self._forget(store_key)
+            if on_expire:
+                await on_expire(job)
+
+        job.poll = tracked_poll
+        job.on_expire = tracked_expire
+        scheduler.schedule(job)
+        # Возраст задачи считается от постановки, а не от перехода к новому лидеру
+        job.created_at -= max(0.0, time.time() - entry["submitted_at"])
+        self._active[store_key] = (entry["kind"], job.key, job.owner)
+
+    async def _forget(self, store_key: str):
+        active = self._active.pop(store_key, None)
+        if self._store is not None:
+            self._finished.add(store_key)
+            await self._store.delete(store_key)
+        elif active is not None and self._journaled(active[0]):
+            await self._journal.delete(store_key)
+
+    async def sync(self, lease_until: float):
+        """
+        Вызывается лидером: продлевает срок действия аренды и приводит локальные
+        планировщики в соответствие с задачами в общем хранилище.
+        """
+        self._leader_until = lease_until
+        entries = await self._store.scan("poll:")
+        self._finished &= entries.keys()
+        for store_key, raw in entries.items():
+            if store_key in self._active or store_key in self._finished:
+                continue
+            entry = json.loads(raw)
+            if entry["kind"] not in self._kinds:
+                continue
+            self._start(store_key, entry)
+        # Задачи, удаленные из хранилища другими воркерами (например, пользователь отменил сценарий)
+        for store_key in set(self._active) - set(entries):
+            kind, key, _ = self._active.pop(store_key)
+            self._kinds[kind][0].cancel(key)
+
+    def release(self):
+        """Останавливает локальные опросы после потери лидерства."""
+        self._leader_until = 0.0
+        for kind, key, _ in self._active.values():
+            self._kinds[kind][0].cancel(key)
+        self._active.clear()
+
+
+poll_jobs = PollJobRegistry()
@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from app.config import settings
+from app.services.outbound import mark_background
+
+
+class PollJob:
+    """
+    Задача периодического опроса.
+    poll(job) возвращает True, когда опрос завершен, и False, если нужно повторить позже.
+    """
+
+    def __init__(
+        self,
+        key: Hashable,
+        poll: Callable[["PollJob"], Awaitable[bool]],
+        owner: Optional[Hashable] = None,
+        initial_delay: float = 3.0,
+        max_delay: float = 30.0,
+        backoff_factor: float = 1.5,
+        max_wait: float = 1800.0,
+        on_expire: Optional[Callable[["PollJob"], Awaitable[Any]]] = None,
+    ):
+        self.key = key
+        self.poll = poll
+        self.owner = owner
+        self.delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.max_wait = max_wait
+        self.on_expire = on_expire
+        self.attempts = 0
+        self.created_at = 0.0
+        self.cancelled = False
+        # Произвольное состояние, которое нужно задаче между опросами
+        self.meta: dict[str, Any] = {}
+
+    @property
+    def age(self) -> float:
+        return asyncio.get_running_loop().time() - self.created_at
+
+
+class PollScheduler:
+    """
+    Единый планировщик опросов: куча задач, упорядоченная по времени следующего опроса,
+    экспоненциальный backoff на задачу и общий лимит одновременных запросов.
+    Заменяет отдельную asyncio-задачу со sleep на каждый опрос.
+    """
+
+    def __init__(self, name: str, concurrency: int):
+        self._name = name
+        self._concurrency = concurrency
+        # (время следующего опроса, порядковый номер, задача)
+        self._heap: list[tuple[float, int, PollJob]] = []
+        self._jobs: dict[Hashable, PollJob] = {}
+        self._counter = itertools.count()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._active: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def schedule(self, job: PollJob):
+        """Ставит задачу в очередь. Задача с тем же ключом заменяет предыдущую."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        if previous := self._jobs.get(job.key):
+            previous.cancelled = True
+        job.created_at = loop.time()
+        self._jobs[job.key] = job
+        self._push(job, loop.time() + job.delay)
+
+    def cancel(self, key: Hashable) -> bool:
+        job = self._jobs.pop(key, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def cancel_owner(self, owner: Hashable) -> int:
+        """Отменяет все задачи владельца (например, когда пользователь завершил сценарий)."""
+        keys = [key for key, job in self._jobs.items() if job.owner == owner]
+        for key in keys:
+            self.cancel(key)
+        return len(keys)
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+        for task in list(self._active):
+            task.cancel()
+        await asyncio.gather(*self._active, return_exceptions=True)
+        self._runner = None
+
+    def _ensure_started(self):
+        if self._runner is None or self._runner.done():
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+    def _push(self, job: PollJob, when: float):
+        heapq.heappush(self._heap, (when, next(self._counter), job))
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, job = heapq.heappop(self._heap)
+                # Отмененные задачи удаляются из кучи лениво
+                if job.cancelled or self._jobs.get(job.key) is not job:
+                    continue
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._execute(job))
+                self._active.add(task)
+                task.add_done_callback(self._active.discard)
+                now = loop.time()
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: PollJob):
+        # Уведомления из опросов уступают очередь ответам пользователям
+        mark_background()
+        try:
+            job.attempts += 1
+            try:
+                done = await job.poll(job)
+            except Exception:
+                logging.exception(f"Poll scheduler '{self._name}': poll failed for {job.key}")
+                done = False
+        finally:
+            self._semaphore.release()
+
+        if job.cancelled:
+            return
+        if done:
+            self._jobs.pop(job.key, None)
+            return
+        if job.age >= job.max_wait:
+            self._jobs.pop(job.key, None)
+            logging.warning(f"Poll scheduler '{self._name}': giving up on {job.key} after {job.attempts} attempts")
+            if job.on_expire:
+                try:
+                    await job.on_expire(job)
+                except Exception:
+                    logging.exception(f"Poll scheduler '{self._name}': on_expire failed for {job.key}")
+            return
+
+        job.delay = min(job.max_delay, job.delay * job.backoff_factor)
+        # Небольшой разброс, чтобы опросы не синхронизировались
+        jitter = random.uniform(0.9, 1.1)
+        self._push(job, asyncio.get_running_loop().time() + job.delay * jitter)
+
+
+# Планировщик опроса статусов OCR задач
+ocr_poller = PollScheduler(name="ocr", concurrency=settings.ocr_poll_concurrency)
+
+# Планировщик ожидания решений по делам
+case_poller = PollScheduler(name="cases", concurrency=settings.case_watch_concurrency)
@@ -0,0 +1,65 @@
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+class Trace:
+    """Разбивка времени обработки одного апдейта по шагам (bot.*, api_client.*, state.*)."""
+
+    __slots__ = ("started", "finished", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = False
+        # {имя шага: [количество вызовов, суммарное время]}
+        self.spans: dict[str, list[float]] = {}
+
+    def add(self, name: str, duration: float):
+        # Фоновые задачи, запущенные из обработчика, наследуют контекст и могут пережить апдейт
+        if self.finished:
+            return
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [1, duration]
+        else:
+            span[0] += 1
+            span[1] += duration
+
+    def breakdown(self) -> dict[str, dict[str, float]]:
+        return {
+            name: {"count": int(count), "ms": round(total * 1000, 1)}
+            for name, (count, total) in sorted(self.spans.items(), key=lambda item: -item[1][1])
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace() -> tuple[Trace, contextvars.Token]:
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace: Trace, token: contextvars.Token):
+    trace.finished = True
+    _current_trace.reset(token)
+
+
+def record(name: str, duration: float):
+    """Добавляет шаг к трассе текущего апдейта, если она есть."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, duration)
+
+
+@asynccontextmanager
+async def span(name: str):
+    if _current_trace.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
@@ -0,0 +1,126 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from app.config import settings
+from app.services.single_flight import SingleFlight
+
+
+class ReferenceCache:
+    """
+    Кеш справочников API (типы пенсий, списки документов).
+    Свежие записи отдаются сразу, устаревшие — тоже сразу, но с фоновым обновлением
+    (stale-while-revalidate). Содержимое сохраняется на диск, чтобы после перезапуска
+    бот мог показать первое меню, не дожидаясь бэкенда.
+    """
+
+    def __init__(self, ttl: float, max_stale: float, snapshot_path: Optional[str] = None):
+        self._ttl = ttl
+        self._max_stale = max_stale
+        self._snapshot_path = snapshot_path
+        # {key: (fetched_at, value)}; время — wall clock, чтобы переживать перезапуск
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._flights = SingleFlight()
+        self._background: set[asyncio.Task] = set()
+        self._snapshot_task: Optional[asyncio.Task] = None
+
+    async def get(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """Возвращает значение по ключу, при необходимости загружая его через fetcher."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            fetched_at, value = entry
+            age = time.time() - fetched_at
+            if age < self._ttl:
+                return copy.deepcopy(value)
+            if age < self._max_stale:
+                self._revalidate(key, fetcher)
+                return copy.deepcopy(value)
+
+        value = await self._flights.do(key, lambda: self._fill(key, fetcher))
+        if value is None and entry is not None:
+            # Бэкенд недоступен — лучше устаревший справочник, чем ошибка
+            return copy.deepcopy(entry[1])
+        return copy.deepcopy(value)
+
+    def invalidate(self, key: Optional[str] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _revalidate(self, key: str, fetcher: Callable[[], Awaitable[Any]]):
+        if self._flights.in_flight(key):
+            return
+        task = asyncio.create_task(self._flights.do(key, lambda: self._fill(key, fetcher)))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _fill(self, key: str, fetcher: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        value = await fetcher()
+        # Кешируем только успешные ответы: ошибки API приходят словарем с ключом "error"
+        if not isinstance(value, list):
+            logging.warning(f"Reference cache: not caching response for {key}: {value}")
+            return None
+        self._entries[key] = (time.time(), value)
+        self._schedule_snapshot()
+        return value
+
+    # --- Снимок на диске ---
+
+    def load_snapshot(self):
+        if not self._snapshot_path or not os.path.exists(self._snapshot_path):
+            return
+        try:
+            with open(self._snapshot_path, encoding="utf-8") as f:
+                raw = json.load(f)
+            for key, item in raw.items():
+                self._entries[key] = (float(item["fetched_at"]), item["value"])
+            logging.info(f"Reference cache: loaded {len(raw)} entries from {self._snapshot_path}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Reference cache: failed to load snapshot {self._snapshot_path}: {e}")
+
+    def _schedule_snapshot(self):
+        if not self._snapshot_path:
+            return
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_task = asyncio.create_task(self._save_snapshot())
+
+    async def _save_snapshot(self):
+        # Небольшая задержка, чтобы несколько обновлений подряд записались одним файлом
+        await asyncio.sleep(1)
+        await asyncio.to_thread(self._write_snapshot, self._snapshot_payload())
+
+    def _snapshot_payload(self) -> dict:
+        return {
+            key: {"fetched_at": fetched_at, "value": value}
+            for key, (fetched_at, value) in self._entries.items()
+        }
+
+    def _write_snapshot(self, payload: dict):
+        try:
+            os.makedirs(os.path.dirname(self._snapshot_path) or ".", exist_ok=True)
+            tmp_path = f"{self._snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self._snapshot_path)
+        except OSError as e:
+            logging.warning(f"Reference cache: failed to write snapshot {self._snapshot_path}: {e}")
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        if self._snapshot_task and not self._snapshot_task.done():
+            self._snapshot_task.cancel()
+        if self._snapshot_path and self._entries:
+            await asyncio.to_thread(self._write_snapshot, self._snapshot_payload())
+
+
+reference_cache = ReferenceCache(
+    ttl=settings.reference_cache_ttl,
+    max_stale=settings.reference_cache_max_stale,
+    snapshot_path=os.path.join(settings.data_dir, "reference_cache.json"),
+)
@@ -0,0 +1,211 @@
+import asyncio
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlparse
+
+
+class SharedStore(ABC):
+    """
+    Общее хранилище состояния для нескольких процессов бота: ключ-значение с TTL,
+    очереди апдейтов и аренды (leases) для выбора лидера.
+    Реализация подключается по URL (см. create_shared_store).
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None): ...
+
+    @abstractmethod
+    async def delete(self, key: str): ...
+
+    @abstractmethod
+    async def compare_and_set(self, key: str, expected: Optional[str], value: Optional[str]) -> bool:
+        """
+        Атомарно записывает value (None — удаляет ключ), только если текущее
+        значение равно expected (None — ключа нет). True, если запись сделана.
+        """
+
+    @abstractmethod
+    async def scan(self, prefix: str) -> dict[str, str]:
+        """Возвращает все действующие ключи с заданным префиксом."""
+
+    @abstractmethod
+    async def push(self, queue: str, payload: str): ...
+
+    @abstractmethod
+    async def pop(self, queue: str, limit: int = 100) -> list[str]:
+        """Забирает из очереди до limit сообщений в порядке поступления."""
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Захватывает или продлевает аренду. True, если аренда принадлежит owner."""
+
+    @abstractmethod
+    async def release_lease(self, name: str, owner: str): ...
+
+    async def close(self):
+        pass
+
+
+class SQLiteSharedStore(SharedStore):
+    """
+    Общее хранилище на SQLite-файле (WAL). Подходит для нескольких процессов
+    на одной машине и для тестов; для нескольких машин нужна сетевая реализация.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-store")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL);"
+                "CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, payload TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS queue_name ON queue (name, id);"
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # --- Ключ-значение ---
+
+    def _db_get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _db_set(self, key: str, value: str, ttl: Optional[float]):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, expires_at),
+            )
+
+    def _db_compare_and_set(self, key: str, expected: Optional[str], value: Optional[str]) -> bool:
+        conn = self._connect()
+        with conn:
+            # Блокировка на запись берется до чтения, чтобы другой процесс не вклинился между сравнением и записью
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+            if (row[0] if row else None) != expected:
+                return False
+            if value is None:
+                conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, NULL) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = NULL",
+                    (key, value),
+                )
+        return True
+
+    def _db_delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _db_scan(self, prefix: str) -> dict[str, str]:
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        # Префикс сравниваем через диапазон ключей, чтобы не экранировать символы LIKE
+        rows = conn.execute(
+            "SELECT key, value FROM kv WHERE key >= ? AND key < ?", (prefix, prefix + "\U0010ffff")
+        ).fetchall()
+        return dict(rows)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._run(self._db_get, key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._run(self._db_set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._db_delete, key)
+
+    async def compare_and_set(self, key: str, expected: Optional[str], value: Optional[str]) -> bool:
+        return await self._run(self._db_compare_and_set, key, expected, value)
+
+    async def scan(self, prefix: str) -> dict[str, str]:
+        return await self._run(self._db_scan, prefix)
+
+    # --- Очереди ---
+
+    def _db_push(self, queue: str, payload: str):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO queue (name, payload) VALUES (?, ?)", (queue, payload))
+
+    def _db_pop(self, queue: str, limit: int) -> list[str]:
+        conn = self._connect()
+        with conn:
+            rows = conn.execute(
+                "SELECT id, payload FROM queue WHERE name = ? ORDER BY id LIMIT ?", (queue, limit)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM queue WHERE name = ? AND id <= ?", (queue, rows[-1][0]))
+        return [payload for _, payload in rows]
+
+    async def push(self, queue: str, payload: str):
+        await self._run(self._db_push, queue, payload)
+
+    async def pop(self, queue: str, limit: int = 100) -> list[str]:
+        return await self._run(self._db_pop, queue, limit)
+
+    # --- Аренды ---
+
+    def _db_acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                (name, owner, now + ttl, now),
+            )
+            row = conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def _db_release_lease(self, name: str, owner: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._run(self._db_acquire_lease, name, owner, ttl)
+
+    async def release_lease(self, name: str, owner: str):
+        await self._run(self._db_release_lease, name, owner)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+def create_shared_store(url: str) -> SharedStore:
+    """Создает общее хранилище по URL, например sqlite:///data/shared.sqlite3."""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative/path или sqlite:////absolute/path
+        return SQLiteSharedStore(parsed.path[1:] if parsed.path.startswith("/") else parsed.path)
+    raise ValueError(f"Unsupported shared store: {url}")
@@ -0,0 +1,88 @@
+"""
+Микробенчмарк форматирования пояснений RAG: прежний format_rag_explanation
+(replace + построчный цикл + re.sub, без экранирования) против render_rag_html,
+без мемоизации и с ней.
+
+    python -m tools.bench_rag_format --sizes 4000 100000 1000000
+"""
+import argparse
+import random
+import re
+import time
+
+from app.bot import formatting
+from app.bot.formatting import render_rag_html
+
+
+def legacy_format_rag_explanation(text: str) -> str:
+    """Реализация до перехода на render_rag_html (без экранирования)."""
+    if not text:
+        return "Нет"
+    text = text.replace('---', '\n')
+    lines = text.split('\n')
+    processed_lines = []
+    for line in lines:
+        stripped_line = line.lstrip()
+        indent_space = ' ' * (len(line) - len(stripped_line))
+        if stripped_line.startswith('###'):
+            processed_lines.append(indent_space + stripped_line.replace('###', '').lstrip())
+            continue
+        if stripped_line.startswith('- ') or stripped_line.startswith('* '):
+            processed_lines.append(indent_space + '• ' + stripped_line[2:])
+            continue
+        processed_lines.append(line)
+    final_text = '\n'.join(processed_lines)
+    return re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', final_text)
+
+
+_BLOCKS = (
+    "### Оценка права на пенсию",
+    "- Возраст заявителя: **достигнут** (требуется 60 лет, фактически 64 года).",
+    "- Страховой стаж: **{years} лет** при требуемых 15 годах, учтены периоды службы.",
+    "  * Период работы в ООО «Ромашка» подтвержден трудовой книжкой & справкой.",
+    "Согласно ст. 8 Федерального закона № 400-ФЗ, ИПК должен быть > 30; у заявителя {points}.",
+    "---",
+    "Рекомендация: назначить пенсию с даты обращения, <проверить> сведения о детях.",
+)
+
+
+def make_explanation(size: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines, length = ["Анализ системой RAG (уверенность: 93.5%):"], 0
+    while length < size:
+        line = rng.choice(_BLOCKS).format(years=rng.randint(15, 45), points=round(rng.uniform(20, 120), 1))
+        lines.append(line)
+        length += len(line) + 1
+    lines.append("ИТОГ: СООТВЕТСТВУЕТ")
+    return "\n".join(lines)
+
+
+def _measure(func, text: str, repeat: int, before=None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG explanation formatter benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4000, 100_000, 1_000_000], help="input sizes, chars")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>10}{'legacy ms':>12}{'render ms':>12}{'memo hit ms':>13}")
+    for size in args.sizes:
+        text = make_explanation(size)
+        legacy = _measure(legacy_format_rag_explanation, text, args.repeat)
+        cold = _measure(render_rag_html, text, args.repeat, before=formatting._memo.clear)
+        render_rag_html(text)
+        warm = _measure(render_rag_html, text, args.repeat)
+        print(f"{len(text):>10}{legacy * 1000:>12.2f}{cold * 1000:>12.2f}{warm * 1000:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
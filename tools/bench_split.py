@@ -0,0 +1,165 @@
+"""
+Бенчмарк разбиения длинных сообщений: прежний split_long_message (построчная
+склейка через +=) против текущего на входах в мегабайты. Для каждой части
+проверяются длина в единицах UTF-16, парность тегов и то, что видимый текст
+не потерян.
+
+С --random те же свойства проверяются на N случайных входах (вложенные
+теги, ссылки, сущности, суррогатные пары UTF-16, переводы строк) с малым
+лимитом части; для каждого нарушения печатается seed, чтобы его повторить.
+
+    python -m tools.bench_split --size 1000000
+    python -m tools.bench_split --random 2000 --limit 32
+"""
+import argparse
+import html
+import random
+import re
+import sys
+import time
+
+from app.bot.formatting import MAX_MESSAGE_LENGTH, render_rag_html, split_long_message
+from tools.bench_rag_format import make_explanation
+
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+_WORDS = ("пенсия", "стаж", "страховой", "ИПК", "заявитель", "период", "работы", "🎉", "𝔸", "документ")
+
+
+def legacy_split_long_message(text: str) -> list[str]:
+    """Реализация до перехода на разбор по смещениям."""
+    if len(text) <= MAX_MESSAGE_LENGTH:
+        return [text]
+    parts = []
+    current_part = ""
+    for line in text.split('\n'):
+        if len(current_part) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            parts.append(current_part)
+            current_part = line + '\n'
+        else:
+            current_part += line + '\n'
+    if current_part:
+        parts.append(current_part)
+    return parts
+
+
+def make_inputs(size: int, seed: int = 0) -> dict[str, str]:
+    rng = random.Random(seed)
+    words = [rng.choice(_WORDS) for _ in range(size // 6)]
+    lines = []
+    for index in range(0, len(words), 12):
+        lines.append(" ".join(words[index:index + 12]))
+    return {
+        "lines": "\n".join(lines)[:size],
+        "one line": " ".join(words)[:size],
+        "no spaces": ("x" * 97 + "🎉") * (size // 99),
+        "rag html": render_rag_html(make_explanation(size, seed)),
+        "bold block": "<b>" + html.escape(" ".join(words)[:size], quote=False) + "</b>",
+    }
+
+
+def make_random_input(rng: random.Random, tokens: int) -> str:
+    """Случайный HTML из tokens кусков: слова, пробелы, сущности, вложенные теги и ссылки."""
+    out, stack = [], []
+    while len(out) < tokens:
+        roll = rng.random()
+        if roll < 0.1 and len(stack) < 3:
+            name = rng.choice(("b", "i", "code", "a"))
+            out.append('<a href="https://example.com/?a=1&amp;b=2">' if name == "a" else f"<{name}>")
+            stack.append(name)
+        elif roll < 0.18 and stack:
+            out.append(f"</{stack.pop()}>")
+        elif roll < 0.3:
+            out.append(rng.choice((" ", "  ", "\n", "\n\n")))
+        elif roll < 0.4:
+            out.append(rng.choice(("&amp;", "&lt;", "&gt;", "&quot;")))
+        elif roll < 0.5:
+            out.append(rng.choice(("🎉", "𝔸")) * rng.randint(1, 12))
+        else:
+            out.append(rng.choice(_WORDS) if roll < 0.9 else "x" * rng.randint(1, 80))
+    # Вход из одних пробелов не разбивается, и проверка сочла бы его пустой частью
+    out.append(rng.choice(_WORDS))
+    out.extend(f"</{name}>" for name in reversed(stack))
+    return "".join(out)
+
+
+def run_random(count: int, limit: int, seed: int) -> int:
+    """Проверяет разбиение count случайных входов; возвращает число входов с нарушениями."""
+    failed = 0
+    for case_seed in range(seed, seed + count):
+        rng = random.Random(case_seed)
+        text = make_random_input(rng, rng.randint(1, limit))
+        try:
+            problems = check(text, split_long_message(text, limit), limit)
+        except Exception as e:
+            problems = [repr(e)]
+        if problems:
+            failed += 1
+            print(f"seed {case_seed}: {'; '.join(problems[:3])}")
+    print(f"{count} random inputs, limit {limit}: {failed} failed")
+    return failed
+
+
+def _visible(text: str) -> str:
+    return html.unescape(_TAG_RE.sub("", text))
+
+
+def check(text: str, parts: list[str], limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Нарушения свойств разбиения; пустой список — все в порядке."""
+    problems = []
+    for number, part in enumerate(parts):
+        units = len(_visible(part).encode("utf-16-le")) // 2
+        if units > limit:
+            problems.append(f"part {number}: {units} UTF-16 units")
+        if not part.strip():
+            problems.append(f"part {number}: empty")
+        stack = []
+        for closing, name in _TAG_RE.findall(part):
+            if not closing:
+                stack.append(name)
+            elif not stack or stack.pop() != name:
+                problems.append(f"part {number}: unbalanced </{name}>")
+                break
+        else:
+            if stack:
+                problems.append(f"part {number}: unclosed {stack}")
+    joined = re.sub(r"\s+", "", "".join(_visible(part) for part in parts))
+    if joined != re.sub(r"\s+", "", _visible(text)):
+        problems.append("visible text differs from input")
+    return problems
+
+
+def _measure(func, text: str, repeat: int) -> tuple[float, list[str]]:
+    best, parts = float("inf"), []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parts = func(text)
+        best = min(best, time.perf_counter() - started)
+    return best, parts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message splitter benchmark")
+    parser.add_argument("--size", type=int, default=1_000_000, help="input size, chars")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--random", type=int, default=0, metavar="N", help="check N random inputs instead")
+    parser.add_argument("--limit", type=int, default=32, help="part limit for --random, UTF-16 units")
+    parser.add_argument("--seed", type=int, default=0, help="first seed for --random")
+    args = parser.parse_args()
+
+    if args.random:
+        sys.exit(1 if run_random(args.random, args.limit, args.seed) else 0)
+
+    print(f"{'input':<12}{'chars':>10}{'legacy ms':>11}{'parts':>7}{'bad':>5}{'new ms':>9}{'parts':>7}  problems")
+    for name, text in make_inputs(args.size).items():
+        legacy, legacy_parts = _measure(legacy_split_long_message, text, args.repeat)
+        current, parts = _measure(split_long_message, text, args.repeat)
+        legacy_bad = len(check(text, legacy_parts))
+        problems = check(text, parts)
+        print(
+            f"{name:<12}{len(text):>10}{legacy * 1000:>11.1f}{len(legacy_parts):>7}{legacy_bad:>5}"
+            f"{current * 1000:>9.1f}{len(parts):>7}  {'; '.join(problems[:3]) or 'ok'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Локальный фейк бэкенда из api.md для нагрузочных тестов и офлайн-разработки.
+
+Поддерживает вход, справочники, OCR задачи, дела, историю и скачивание решения.
+Задержка ответа и доля сбоев настраиваются; OCR задачи и дела переходят из
+PROCESSING в итоговый статус через заданное время.
+
+    python -m tools.fake_backend --port 8000 --latency 0.05 --failure-rate 0.01
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+PENSION_TYPES = [
+    {
+        "id": "retirement_standard",
+        "display_name": "Страховая пенсия по старости (общие основания)",
+        "description": "Назначается при достижении пенсионного возраста, наличии стажа и ИПК.",
+    },
+    {
+        "id": "disability_social",
+        "display_name": "Социальная пенсия по инвалидности",
+        "description": "Назначается инвалидам I, II и III групп.",
+    },
+]
+
+PENSION_DOCUMENTS = [
+    {
+        "id": "doc_passport_rf",
+        "name": "Паспорт гражданина РФ",
+        "description": "Основной документ, удостоверяющий личность.",
+        "is_critical": True,
+        "condition_text": None,
+        "ocr_type": "passport",
+    },
+    {
+        "id": "doc_snils",
+        "name": "СНИЛС",
+        "description": "Страховой номер индивидуального лицевого счета.",
+        "is_critical": True,
+        "condition_text": None,
+        "ocr_type": "snils",
+    },
+    {
+        "id": "doc_work_book",
+        "name": "Трудовая книжка",
+        "description": "Подтверждает трудовой стаж.",
+        "is_critical": False,
+        "condition_text": None,
+        "ocr_type": "work_book",
+    },
+]
+
+OCR_RESULTS = {
+    "passport": {
+        "last_name": "Иванов",
+        "first_name": "Иван",
+        "middle_name": "Иванович",
+        "birth_date": "1960-01-15",
+        "sex": "Мужской",
+        "passport_series": "1234",
+        "passport_number": "567890",
+    },
+    "snils": {"snils_number": "123-456-789 00", "last_name": "Иванов", "first_name": "Иван"},
+    "work_book": {
+        "records": [{"date_in": "1985-06-01", "date_out": "2020-01-14", "organization": "ООО Ромашка", "position": "Инженер"}],
+        "calculated_total_years": 34.6,
+    },
+    "other": {"identified_document_type": "Справка", "extracted_fields": {}},
+}
+
+EXPLANATION = (
+    "Анализ системой RAG (уверенность: 95.0%):\n"
+    "### Оценка права на пенсию\n"
+    "- Возраст: **достигнут**\n"
+    "- Стаж: **достаточный**\n"
+    "---\n"
+    "ИТОГ: СООТВЕТСТВУЕТ"
+)
+
+# Эндпоинты, которые не требуют токена
+PUBLIC_PATHS = {"/api/v1/auth/token", "/api/v1/health", "/"}
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _make_token(username: str, ttl: float) -> str:
+    def encode(value: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+    payload = {"sub": username, "exp": int(time.time() + ttl), "jti": uuid.uuid4().hex}
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(payload)}.fake"
+
+
+class FakeBackend:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        ocr_delay: float = 1.0,
+        ocr_failure_rate: float = 0.0,
+        case_delay: float = 2.0,
+        token_ttl: float = 1800.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.ocr_delay = ocr_delay
+        self.ocr_failure_rate = ocr_failure_rate
+        self.case_delay = case_delay
+        self.token_ttl = token_ttl
+        self.tasks: dict[str, dict] = {}
+        self.cases: dict[int, dict] = {}
+        self._case_ids = itertools.count(1)
+        # {шаблон пути: количество запросов}
+        self.hits: dict[str, int] = {}
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware], client_max_size=11 * 1024 * 1024)
+        api = "/api/v1"
+        app.router.add_get("/", self.root)
+        app.router.add_get(f"{api}/health", self.health)
+        app.router.add_post(f"{api}/auth/token", self.auth_token)
+        app.router.add_get(f"{api}/users/me", self.users_me)
+        app.router.add_get(f"{api}/pension_types", self.pension_types)
+        app.router.add_get(f"{api}/pension_documents/{{pension_type_id}}", self.pension_documents)
+        app.router.add_get(f"{api}/standard_document_names", self.standard_document_names)
+        app.router.add_post(f"{api}/cases", self.create_case)
+        app.router.add_get(f"{api}/cases/history", self.case_history)
+        app.router.add_get(f"{api}/cases/{{case_id:\\d+}}/status", self.case_status)
+        app.router.add_get(f"{api}/cases/{{case_id:\\d+}}/document", self.case_document)
+        app.router.add_get(f"{api}/cases/{{case_id:\\d+}}", self.case_details)
+        app.router.add_delete(f"{api}/cases/{{case_id:\\d+}}", self.delete_case)
+        app.router.add_post(f"{api}/document_extractions", self.create_extraction)
+        app.router.add_get(f"{api}/document_extractions/{{task_id}}", self.extraction_status)
+        app.router.add_get(f"{api}/tasks/stats", self.tasks_stats)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource
+        template = route.canonical if route is not None else request.path
+        self.hits[template] = self.hits.get(template, 0) + 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if request.path not in PUBLIC_PATHS:
+            if not request.headers.get("Authorization", "").startswith("Bearer "):
+                return web.json_response({"detail": "Not authenticated"}, status=401)
+            if random.random() < self.failure_rate:
+                return web.json_response({"detail": "Service temporarily unavailable"}, status=503)
+        return await handler(request)
+
+    # --- Служебные ---
+
+    async def root(self, request: web.Request) -> web.Response:
+        return web.json_response({"message": "Fake pension consultant API"})
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"overall_status": "healthy", "timestamp": _now_iso(), "dependencies": []})
+
+    # --- Аутентификация ---
+
+    async def auth_token(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        username, password = form.get("username"), form.get("password")
+        if not username or not password:
+            return web.json_response({"detail": "Incorrect username or password"}, status=401)
+        return web.json_response({"access_token": _make_token(username, self.token_ttl), "token_type": "bearer"})
+
+    async def users_me(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": 1, "username": "user", "role": "manager", "is_active": True})
+
+    # --- Справочники ---
+
+    async def pension_types(self, request: web.Request) -> web.Response:
+        return web.json_response(PENSION_TYPES)
+
+    async def pension_documents(self, request: web.Request) -> web.Response:
+        if request.match_info["pension_type_id"] not in {p["id"] for p in PENSION_TYPES}:
+            return web.json_response({"detail": "Not found"}, status=404)
+        return web.json_response(PENSION_DOCUMENTS)
+
+    async def standard_document_names(self, request: web.Request) -> web.Response:
+        return web.json_response(sorted(doc["name"] for doc in PENSION_DOCUMENTS))
+
+    # --- Дела ---
+
+    def _case_status(self, case: dict) -> tuple[str, str]:
+        if time.time() - case["created_ts"] < self.case_delay:
+            return "PROCESSING", "Дело принято в обработку. Результаты будут доступны позже."
+        return "СООТВЕТСТВУЕТ", EXPLANATION
+
+    def _case_view(self, case: dict) -> dict:
+        status, explanation = self._case_status(case)
+        return {
+            "id": case["id"],
+            "created_at": case["created_at"],
+            "updated_at": None,
+            "pension_type": case["input"].get("pension_type"),
+            "personal_data": case["input"].get("personal_data"),
+            "final_status": status,
+            "final_explanation": explanation,
+            "rag_confidence": 0.95 if status != "PROCESSING" else None,
+            "errors": None,
+        }
+
+    async def create_case(self, request: web.Request) -> web.Response:
+        case_id = next(self._case_ids)
+        self.cases[case_id] = {
+            "id": case_id,
+            "created_at": _now_iso(),
+            "created_ts": time.time(),
+            "input": await request.json(),
+        }
+        return web.json_response({
+            "case_id": case_id,
+            "final_status": "PROCESSING",
+            "explanation": "Дело принято в обработку. Результаты будут доступны позже.",
+            "confidence_score": None,
+            "department_code": None,
+            "error_info": None,
+        }, status=202)
+
+    def _get_case(self, request: web.Request):
+        case_id = int(request.match_info["case_id"])
+        case = self.cases.get(case_id)
+        if case is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"error_code": "CASE_NOT_FOUND", "message": "Дело не найдено", "details": {"case_id": case_id}}),
+                content_type="application/json",
+            )
+        return case
+
+    async def case_status(self, request: web.Request) -> web.Response:
+        case = self._get_case(request)
+        status, explanation = self._case_status(case)
+        return web.json_response({
+            "case_id": case["id"],
+            "final_status": status,
+            "explanation": explanation,
+            "confidence_score": 0.95 if status != "PROCESSING" else None,
+            "department_code": None,
+            "error_info": None,
+        })
+
+    async def case_details(self, request: web.Request) -> web.Response:
+        return web.json_response(self._case_view(self._get_case(request)))
+
+    async def case_history(self, request: web.Request) -> web.Response:
+        # offset принимается для совместимости со старыми клиентами
+        skip = int(request.query.get("skip", request.query.get("offset", 0)))
+        limit = min(100, int(request.query.get("limit", 10)))
+        cases = sorted(self.cases.values(), key=lambda case: -case["id"])[skip:skip + limit]
+        entries = []
+        for case in cases:
+            view = self._case_view(case)
+            entries.append({key: view[key] for key in (
+                "id", "created_at", "pension_type", "final_status", "final_explanation", "rag_confidence", "personal_data"
+            )})
+        return web.json_response(entries)
+
+    async def case_document(self, request: web.Request) -> web.Response:
+        case = self._get_case(request)
+        doc_format = request.query.get("format")
+        if doc_format not in ("pdf", "docx"):
+            return web.json_response({"detail": "Invalid format"}, status=400)
+        if self._case_status(case)[0] == "PROCESSING":
+            return web.json_response({"detail": "Document is not ready"}, status=404)
+        content_type = "application/pdf" if doc_format == "pdf" else (
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        )
+        body = f"Решение по делу #{case['id']}\n{EXPLANATION}\n".encode() * 64
+        return web.Response(
+            body=body,
+            content_type=content_type,
+            headers={"Content-Disposition": f'attachment; filename="case_{case["id"]}.{doc_format}"'},
+        )
+
+    async def delete_case(self, request: web.Request) -> web.Response:
+        case = self._get_case(request)
+        del self.cases[case["id"]]
+        return web.json_response({"message": "Дело успешно удалено", "case_id": case["id"]})
+
+    # --- OCR ---
+
+    async def create_extraction(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        document_type, size = None, 0
+        async for part in reader:
+            if part.name == "document_type":
+                document_type = (await part.text()).strip()
+            elif part.name == "image":
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+        if document_type not in OCR_RESULTS or size == 0:
+            return web.json_response({"detail": "Invalid document"}, status=400)
+        task_id = str(uuid.uuid4())
+        self.tasks[task_id] = {
+            "document_type": document_type,
+            "created_ts": time.time(),
+            "failed": random.random() < self.ocr_failure_rate,
+        }
+        return web.json_response({
+            "task_id": task_id,
+            "status": "PROCESSING",
+            "message": "Документ принят на обработку. Проверьте статус позже.",
+        }, status=202)
+
+    def _task_status(self, task: dict) -> str:
+        if time.time() - task["created_ts"] < self.ocr_delay:
+            return "PROCESSING"
+        return "FAILED" if task["failed"] else "COMPLETED"
+
+    async def extraction_status(self, request: web.Request) -> web.Response:
+        task_id = request.match_info["task_id"]
+        task = self.tasks.get(task_id)
+        if task is None:
+            return web.json_response({"detail": "Task not found"}, status=404)
+        status = self._task_status(task)
+        response = {"task_id": task_id, "status": status, "data": None, "error": None}
+        if status == "COMPLETED":
+            response["data"] = OCR_RESULTS[task["document_type"]]
+        elif status == "FAILED":
+            response["error"] = {"detail": "Не удалось распознать документ.", "type": "VisionProcessingError"}
+        return web.json_response(response)
+
+    async def tasks_stats(self, request: web.Request) -> web.Response:
+        counts: dict[str, int] = {}
+        for task in self.tasks.values():
+            status = self._task_status(task)
+            counts[status] = counts.get(status, 0) + 1
+        return web.json_response({
+            "total": len(self.tasks),
+            "pending": counts.get("PROCESSING", 0),
+            "expired_processing": 0,
+            "status_specific_counts": counts,
+        })
+
+
+async def start_fake_backend(backend: FakeBackend, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, int]:
+    """Запускает фейк и возвращает (runner, фактический порт)."""
+    runner = web.AppRunner(backend.create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake pension consultant backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="base response delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay, seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--ocr-delay", type=float, default=1.0)
+    parser.add_argument("--ocr-failure-rate", type=float, default=0.0)
+    parser.add_argument("--case-delay", type=float, default=2.0)
+    args = parser.parse_args()
+
+    backend = FakeBackend(
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        ocr_delay=args.ocr_delay,
+        ocr_failure_rate=args.ocr_failure_rate,
+        case_delay=args.case_delay,
+    )
+    print(f"Fake backend on http://{args.host}:{args.port}/api/v1")
+    web.run_app(backend.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
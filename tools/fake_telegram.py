@@ -0,0 +1,200 @@
+"""
+Фейковый Telegram для офлайн-проверки webhook-режима.
+
+Отправляет синтетические апдейты на локальный вебхук бота и считает время
+ответа. Опционально поднимает фейковый Bot API сервер, чтобы исходящие
+вызовы бота не уходили в настоящий Telegram (TELEGRAM_API_URL=http://127.0.0.1:8081).
+
+    python -m tools.fake_telegram --api-port 8081 --updates 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+_message_ids = itertools.count(1)
+
+
+def _chat(user_id: int) -> dict:
+    return {"id": user_id, "type": "private", "first_name": f"user{user_id}"}
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def make_photo_update(
+    update_id: int, user_id: int, file_id: str, file_size: int = 0, media_group_id: Optional[str] = None
+) -> dict:
+    update = {
+        "update_id": update_id,
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "photo": [{
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "width": 1280,
+                "height": 960,
+                "file_size": file_size,
+            }],
+        },
+    }
+    if media_group_id is not None:
+        update["message"]["media_group_id"] = media_group_id
+    return update
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": _chat(user_id),
+                "text": "menu",
+            },
+        },
+    }
+
+
+# --- Фейковый Bot API ---
+
+async def _handle_method(request: web.Request) -> web.Response:
+    method = request.match_info["method"].lower()
+    if request.content_type == "application/json":
+        params = await request.json()
+    else:
+        params = dict(await request.post())
+    request.app["calls"][method] = request.app["calls"].get(method, 0) + 1
+
+    chat_id = int(params.get("chat_id") or 0)
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": _chat(chat_id),
+        "text": params.get("text", ""),
+    }
+    results = {
+        "getme": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"},
+        "sendmessage": message,
+        "senddocument": message,
+        "editmessagetext": message,
+        "getfile": {
+            "file_id": params.get("file_id", ""),
+            "file_unique_id": params.get("file_id", ""),
+            "file_size": 4,
+            "file_path": "photos/fake.jpg",
+        },
+    }
+    return web.json_response({"ok": True, "result": results.get(method, True)})
+
+
+async def _handle_file(request: web.Request) -> web.Response:
+    return web.Response(body=b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+
+
+def create_fake_api() -> web.Application:
+    app = web.Application()
+    app["calls"] = {}
+    app.router.add_post("/bot{token}/{method}", _handle_method)
+    app.router.add_get("/file/bot{token}/{path:.+}", _handle_file)
+    return app
+
+
+# --- Отправитель апдейтов ---
+
+async def send_updates(url: str, secret: str, count: int, concurrency: int, users: int) -> dict:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(session: aiohttp.ClientSession, update_id: int):
+        user_id = 100000 + update_id % users
+        if update_id % 3 == 0:
+            update = make_callback_update(update_id, user_id, "history")
+        else:
+            update = make_message_update(update_id, user_id, "/start")
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    async with aiohttp.ClientSession() as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(send_one(session, update_id) for update_id in range(1, count + 1)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates": count,
+        "elapsed": elapsed,
+        "statuses": statuses,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline webhook tester")
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--api-port", type=int, default=0, help="also serve a fake Bot API on this port")
+    args = parser.parse_args()
+
+    runner = None
+    if args.api_port:
+        fake_api = create_fake_api()
+        runner = web.AppRunner(fake_api)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+        print(f"Fake Bot API on http://127.0.0.1:{args.api_port}")
+
+    try:
+        report = await send_updates(args.webhook_url, args.secret, args.updates, args.concurrency, args.users)
+        print(
+            f"{report['updates']} updates in {report['elapsed']:.2f}s, "
+            f"ack p50={report['p50_ms']:.1f}ms p99={report['p99_ms']:.1f}ms, statuses={report['statuses']}"
+        )
+        if runner is not None:
+            # Даем боту доотправить ответы, обработанные в фоне
+            await asyncio.sleep(2)
+            print(f"Bot API calls: {fake_api['calls']}")
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,543 @@
+"""
+Офлайн нагрузочный тест: настоящий диспетчер бота, фейковый бэкенд
+(tools.fake_backend) и фейковая сессия Bot API вместо Telegram.
+
+Каждый синтетический пользователь проходит вход, создание дела с загрузкой
+документа на OCR (с --album еще и альбома из двух фото), проверку статуса,
+скачивание решения, историю дел и отдельное распознавание.
+В отчете: пропускная способность, p50/p95/p99 по шагам, ошибки и пиковая память.
+
+    python -m tools.load_bench --users 2000 --concurrency 200 --latency 0.02 --json report.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.enums import ParseMode
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+
+from tools.fake_backend import FakeBackend, start_fake_backend
+from tools.fake_telegram import make_callback_update, make_message_update, make_photo_update
+
+BOT_TOKEN = "123456:LOADBENCH"
+USER_ID_BASE = 10_000_000
+# Сообщения бота, которыми заканчивается опрос OCR
+OCR_DONE_MARKERS = ("Не удалось дождаться", "не удалось распознать")
+CASE_ID_RE = re.compile(r"Его номер: <b>(\d+)</b>")
+
+
+def _make_jpeg(width: int = 1280, height: int = 960) -> bytes:
+    """Шумное изображение: по размеру и времени сжатия ближе к фото, чем однотонное."""
+    from PIL import Image
+
+    image = Image.effect_noise((width, height), 40).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _has_button(method: TelegramMethod, callback_data: str) -> bool:
+    markup = getattr(method, "reply_markup", None)
+    for row in getattr(markup, "inline_keyboard", None) or ():
+        if any(button.callback_data == callback_data for button in row):
+            return True
+    return False
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API без сети: отвечает синтетическими объектами, отдает
+    фото для скачивания и позволяет дождаться нужного сообщения бота в чате.
+    """
+
+    def __init__(self, photo: bytes, flood_rate: float = 0.0):
+        super().__init__()
+        self.photo = photo
+        # Доля sendMessage, на которые отвечаем flood-wait (429, retry_after=1)
+        self.flood_rate = flood_rate
+        self.flood_waits = 0
+        # Файлы, загруженные в Telegram (а не отправленные по file_id), и их объем
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        # {метод Bot API: количество вызовов}
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+        # {chat_id: [(условие, future)]}
+        self._waiters: dict[int, list[tuple[Callable[[TelegramMethod], Any], asyncio.Future]]] = {}
+
+    def expect(self, chat_id: int, predicate: Callable[[TelegramMethod], Any]) -> asyncio.Future:
+        """Future, который получит непустой результат predicate для следующего подходящего вызова в чате."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append((predicate, future))
+        return future
+
+    def _notify(self, chat_id: int, method: TelegramMethod):
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        for waiter in list(waiters):
+            predicate, future = waiter
+            result = None if future.done() else predicate(method)
+            if future.done() or result:
+                waiters.remove(waiter)
+                if not future.done():
+                    future.set_result(result)
+        if not waiters:
+            del self._waiters[chat_id]
+
+    def _message(self, chat_id: int, text: Optional[str]) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text or "",
+        }
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None
+    ) -> TelegramType:
+        name = method.__api_method__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        chat_id = getattr(method, "chat_id", None)
+
+        if name == "sendMessage" and self.flood_rate and random.random() < self.flood_rate:
+            self.flood_waits += 1
+            content = {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }
+            # Выбрасывает TelegramRetryAfter
+            self.check_response(bot=bot, method=method, status_code=429, content=json.dumps(content))
+
+        if name in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument", "sendPhoto"):
+            result: Any = self._message(chat_id, getattr(method, "text", None) or getattr(method, "caption", None))
+            if name == "sendDocument":
+                file_id = method.document
+                if isinstance(method.document, InputFile):
+                    self.uploads += 1
+                    async for chunk in method.document.read(bot):
+                        self.uploaded_bytes += len(chunk)
+                    file_id = f"document{self.uploads}"
+                result["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        elif name == "sendMediaGroup":
+            result = [self._message(chat_id, None) for _ in method.media]
+        elif name == "getFile":
+            result = {
+                "file_id": method.file_id,
+                "file_unique_id": method.file_id,
+                "file_size": len(self.photo),
+                "file_path": f"photos/{method.file_id}.jpg",
+            }
+        elif name == "getMe":
+            result = {"id": bot.id, "is_bot": True, "first_name": "LoadBench", "username": "load_bench_bot"}
+        else:
+            result = True
+
+        if isinstance(chat_id, int):
+            self._notify(chat_id, method)
+        response = self.check_response(
+            bot=bot, method=method, status_code=200, content=json.dumps({"ok": True, "result": result})
+        )
+        return response.result
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        for offset in range(0, len(self.photo), chunk_size):
+            yield self.photo[offset:offset + chunk_size]
+
+    async def close(self):
+        pass
+
+
+class StepStats:
+    def __init__(self):
+        # {шаг: длительности в секундах}
+        self.durations: dict[str, list[float]] = {}
+        # {шаг: {причина: количество}}
+        self.errors: dict[str, dict[str, int]] = {}
+        self.updates = 0
+
+    def add(self, step: str, duration: float):
+        self.durations.setdefault(step, []).append(duration)
+
+    def error(self, step: str, reason: str):
+        errors = self.errors.setdefault(step, {})
+        errors[reason] = errors.get(reason, 0) + 1
+
+    def summary(self) -> dict[str, dict]:
+        result = {}
+        for step, values in self.durations.items():
+            values.sort()
+            result[step] = {
+                "count": len(values),
+                "p50_ms": _percentile(values, 50) * 1000,
+                "p95_ms": _percentile(values, 95) * 1000,
+                "p99_ms": _percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+                "errors": self.errors.get(step, {}),
+            }
+        return result
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+class SyntheticUser:
+    def __init__(
+        self, index: int, bot: Bot, dp, session: FakeSession, stats: StepStats, think_time: float, album: bool = False
+    ):
+        self.user_id = USER_ID_BASE + index
+        self.album = album
+        self.bot = bot
+        self.dp = dp
+        self.session = session
+        self.stats = stats
+        self.think_time = think_time
+        # Ожидание результата OCR регистрируется до загрузки фото, чтобы не пропустить ответ
+        self._ocr_result = self._expect_ocr()
+
+    async def _feed(self, step: str, update: dict):
+        if self.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * self.think_time))
+        self.stats.updates += 1
+        result = await self.dp.feed_raw_update(self.bot, update)
+        if result is UNHANDLED:
+            raise RuntimeError(f"unhandled update in step {step}")
+
+    async def message(self, step: str, text: str):
+        await self._feed(step, make_message_update(next(_update_ids), self.user_id, text))
+
+    async def callback(self, step: str, data: str):
+        await self._feed(step, make_callback_update(next(_update_ids), self.user_id, data))
+
+    async def photo(self, step: str):
+        await self._feed(step, make_photo_update(next(_update_ids), self.user_id, f"photo{self.user_id}"))
+
+    async def step(self, name: str, actions: Callable[[], Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await actions()
+        except Exception as e:
+            self.stats.error(name, type(e).__name__)
+            raise
+        self.stats.add(name, time.perf_counter() - started)
+        return result
+
+    async def run(self, ocr_timeout: float):
+        await self.step("login", self.login)
+        await self.step("new_case_form", self.fill_new_case)
+        await self.step("ocr_upload", self.upload_document)
+        outcome = await self.step("ocr_result_wait", lambda: self.wait_ocr(ocr_timeout))
+        if outcome == "ok":
+            await self.step("ocr_confirm", lambda: self.callback("ocr_confirm", "ocr_data_correct"))
+        else:
+            self.stats.error("ocr_result_wait", outcome)
+        if self.album:
+            outcome = await self.step("album_upload", lambda: self.upload_album(ocr_timeout))
+            if outcome == "ok":
+                await self.step("album_confirm", lambda: self.callback("album_confirm", "ocr_data_correct"))
+            else:
+                self.stats.error("album_upload", outcome)
+        case_id = await self.step("create_case", self.create_case)
+        if case_id is not None:
+            await self.step("check_status", lambda: self.check_status(case_id))
+            await self.step("download", lambda: self.download(case_id))
+        await self.step("history", lambda: self.history(case_id))
+        await self.step("ocr_menu", self.ocr_menu)
+
+    async def login(self):
+        await self.message("login", "/start")
+        await self.message("login", "/login")
+        await self.message("login", f"user{self.user_id}")
+        await self.message("login", "password")
+
+    async def fill_new_case(self):
+        for kind, value in (
+            ("callback", "new_case"),
+            ("callback", "pension_type:retirement_standard"),
+            ("message", "Иванов"),
+            ("message", "Иван"),
+            ("callback", "skip"),
+            ("message", "15.01.1960"),
+            ("message", "12345678900"),
+            ("callback", "gender:male"),
+            ("message", "РФ"),
+            ("message", "0"),
+        ):
+            await getattr(self, kind)("new_case_form", value)
+
+    async def upload_document(self):
+        await self.callback("ocr_upload", "upload_doc:passport")
+        await self.photo("ocr_upload")
+
+    async def upload_album(self, timeout: float) -> str:
+        """Альбом из двух фото (СНИЛС и трудовая по умолчанию), результаты приходят одним сообщением."""
+        self._ocr_result = self._expect_ocr()
+        group = f"album{self.user_id}"
+        # Части альбома приходят почти одновременно, как от Telegram
+        await asyncio.gather(*(
+            self._feed("album_upload", make_photo_update(
+                next(_update_ids), self.user_id, f"photo{self.user_id}_{page}", media_group_id=group
+            ))
+            for page in range(2)
+        ))
+        await self.callback("album_upload", "album_submit")
+        return await self.wait_ocr(timeout)
+
+    def _expect_ocr(self) -> asyncio.Future:
+        def predicate(method: TelegramMethod) -> Optional[str]:
+            if _has_button(method, "ocr_data_correct"):
+                return "ok"
+            text = getattr(method, "text", None) or ""
+            if any(marker in text for marker in OCR_DONE_MARKERS):
+                return "ocr_failed"
+            return None
+
+        return self.session.expect(self.user_id, predicate)
+
+    async def wait_ocr(self, timeout: float) -> str:
+        try:
+            return await asyncio.wait_for(self._ocr_result, timeout)
+        except asyncio.TimeoutError:
+            return "ocr_timeout"
+
+    async def create_case(self) -> Optional[int]:
+        created = self.session.expect(
+            self.user_id, lambda method: CASE_ID_RE.search(getattr(method, "text", None) or "")
+        )
+        await self.callback("create_case", "docs_upload_next_step")
+        await self.callback("create_case", "confirm_creation")
+        if not created.done():
+            created.cancel()
+            self.stats.error("create_case", "no_case_id")
+            return None
+        return int(created.result().group(1))
+
+    async def check_status(self, case_id: int):
+        await self.message("check_status", "Проверить статус дела")
+        await self.message("check_status", str(case_id))
+
+    async def download(self, case_id: int):
+        def predicate(method: TelegramMethod) -> Optional[str]:
+            if method.__api_method__ == "sendDocument":
+                return "ok"
+            return "not_ready" if "еще не готов" in (getattr(method, "text", None) or "") else None
+
+        # Документ появляется, когда по делу вынесено решение
+        while True:
+            sent = self.session.expect(self.user_id, predicate)
+            await self.callback("download", f"download_doc:{case_id}_pdf")
+            if sent.done() and sent.result() == "ok":
+                break
+            sent.cancel()
+            await asyncio.sleep(0.2)
+        # Второй раз документ должен уйти по file_id, без бэкенда
+        await self.callback("download", f"download_doc:{case_id}_pdf")
+
+    async def history(self, case_id: Optional[int]):
+        await self.callback("history", "case_history")
+        await self.callback("history", "history_page:5")
+        if case_id is not None:
+            await self.callback("history", f"view_case:{case_id}")
+
+    async def ocr_menu(self):
+        await self.message("ocr_menu", "Распознать документ")
+        await self.callback("ocr_menu", "ocr_type:passport")
+        await self.photo("ocr_menu")
+
+
+_update_ids = itertools.count(1)
+
+
+def _configure_env(api_base_url: str, data_dir: str, rate_limit: bool):
+    """
+    Настройки бота читаются при импорте app.config, поэтому окружение
+    задается до первого импорта модулей приложения.
+    """
+    os.environ["API_BASE_URL"] = api_base_url
+    os.environ["BOT_TOKEN"] = BOT_TOKEN
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["METRICS_ENABLED"] = "false"
+    os.environ["TELEGRAM_API_URL"] = ""
+    # Без лимитов бенчмарк меряет сам бот; с ними — пропускную способность в рамках лимитов Telegram
+    os.environ["TELEGRAM_RATE_LIMIT_ENABLED"] = "true" if rate_limit else "false"
+    for name, value in {
+        "API_ADMIN_USERNAME": "admin",
+        "API_ADMIN_PASSWORD": "admin",
+        "API_MANAGER_USERNAME": "manager",
+        "API_MANAGER_PASSWORD": "manager",
+        "LOG_LEVEL": "WARNING",
+        "OCR_POLL_INITIAL_DELAY": "0.5",
+        "OCR_POLL_MAX_DELAY": "2",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+async def run_bench(args: argparse.Namespace) -> dict:
+    backend = FakeBackend(
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        ocr_delay=args.ocr_delay,
+        ocr_failure_rate=args.ocr_failure_rate,
+        case_delay=args.case_delay,
+    )
+    backend_runner, port = await start_fake_backend(backend)
+    data_dir = tempfile.mkdtemp(prefix="load_bench_")
+    _configure_env(f"http://127.0.0.1:{port}/api/v1", data_dir, args.rate_limit)
+
+    from app.api.client import api_client
+    from app.api.tokens import token_store
+    from app.config import settings
+    from app.main import create_dispatcher, setup_profiling, setup_rate_limit
+    from app.services import image_preprocessing
+    from app.services.history_cache import history_cache
+    from app.services.outbound import outbound_limiter
+    from app.services.poll_jobs import poll_jobs
+    from app.services.poll_scheduler import case_poller, ocr_poller
+    from app.services.reference_cache import reference_cache
+
+    session = FakeSession(_make_jpeg(), flood_rate=args.flood_rate)
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = create_dispatcher()
+    poll_jobs.setup(bot, dp.storage, None)
+    if settings.telegram_rate_limit_enabled:
+        setup_rate_limit(bot)
+    if settings.slow_update_threshold > 0:
+        setup_profiling(bot, dp)
+    token_store.load()
+    reference_cache.load_snapshot()
+    await api_client.warmup()
+
+    stats = StepStats()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failed_users = 0
+
+    async def run_user(index: int):
+        nonlocal failed_users
+        async with semaphore:
+            user = SyntheticUser(index, bot, dp, session, stats, args.think_time, args.album)
+            try:
+                await user.run(args.ocr_timeout)
+            except Exception:
+                failed_users += 1
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_user(index) for index in range(args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await ocr_poller.stop()
+        await case_poller.stop()
+        await outbound_limiter.close()
+        await dp.storage.close()
+        await api_client.close()
+        await reference_cache.close()
+        await history_cache.close()
+        await token_store.close()
+        image_preprocessing.shutdown()
+        await backend_runner.cleanup()
+
+    report = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "failed_users": failed_users,
+        "elapsed_s": elapsed,
+        "updates": stats.updates,
+        "updates_per_s": stats.updates / elapsed if elapsed else 0.0,
+        "flows_per_s": (args.users - failed_users) / elapsed if elapsed else 0.0,
+        # ru_maxrss в Linux измеряется в килобайтах
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_before_mb": rss_before / 1024,
+        "steps": stats.summary(),
+        "bot_api_calls": session.calls,
+        "flood_waits": session.flood_waits,
+        "document_uploads": session.uploads,
+        "document_upload_mb": session.uploaded_bytes / 1024 / 1024,
+        "backend_hits": backend.hits,
+    }
+    if args.tracemalloc:
+        report["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return report
+
+
+def print_report(report: dict):
+    print(
+        f"{report['users']} users (concurrency {report['concurrency']}), {report['failed_users']} failed, "
+        f"{report['updates']} updates in {report['elapsed_s']:.2f}s"
+    )
+    print(f"throughput: {report['updates_per_s']:.1f} updates/s, {report['flows_per_s']:.1f} flows/s")
+    memory = f"peak RSS: {report['peak_rss_mb']:.1f} MB (before run {report['rss_before_mb']:.1f} MB)"
+    if "tracemalloc_peak_mb" in report:
+        memory += f", tracemalloc peak: {report['tracemalloc_peak_mb']:.1f} MB"
+    print(memory)
+    print(f"\n{'step':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  errors")
+    for step, row in report["steps"].items():
+        print(
+            f"{step:<18}{row['count']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+            f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}  {row['errors'] or ''}"
+        )
+    print(f"\nBot API calls: {report['bot_api_calls']} (flood waits: {report['flood_waits']})")
+    print(f"Documents uploaded to Telegram: {report['document_uploads']} ({report['document_upload_mb']:.1f} MB)")
+    print(f"Backend hits: {report['backend_hits']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="users walking their flows at once")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's updates, seconds")
+    parser.add_argument("--latency", type=float, default=0.01, help="fake backend base latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of backend 503 responses")
+    parser.add_argument("--ocr-delay", type=float, default=1.0)
+    parser.add_argument("--ocr-failure-rate", type=float, default=0.0)
+    parser.add_argument("--case-delay", type=float, default=0.5)
+    parser.add_argument("--ocr-timeout", type=float, default=60.0, help="how long a user waits for the OCR result")
+    parser.add_argument("--album", action="store_true", help="also upload an album of two photos per case")
+    parser.add_argument("--rate-limit", action="store_true", help="enable outbound Telegram rate limits")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of sendMessage calls answered with 429")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--json", help="write the report to this file for comparison between runs")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_bench(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()